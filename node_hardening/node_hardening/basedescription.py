@@ -17,10 +17,12 @@ class FailedOrIncompleteTopicsException(Exception):
     raised.
     """
 
-    def __init__(self, failed, incomplete, no_hardener_implemented):
+    def __init__(self, failed, incomplete, no_hardener_implemented,
+                 drifted=None):
         self.failed_topics = failed
         self.incomplete_topics = incomplete
         self.no_hardener_implemented_topics = no_hardener_implemented
+        self.drifted_topics = drifted or []
 
 
 class HardeningDescription(object):
@@ -39,10 +41,15 @@ class HardeningDescription(object):
         self.duration = None
         self.ignored_topics = []
         for section_attr, name in self.sections_names():
-            section = getattr(self, section_attr)
-            if not section:
+            section_class = getattr(self, section_attr, None)
+            if not section_class:
                 missing.append('The section class "%s" must be defined and '
                                'registered.' % name)
+                continue
+            # the registered classes are the definitions only, the state of
+            # this run is kept in its own sections and topics instances.
+            section = section_class()
+            setattr(self, section_attr, section)
             sections.append(section)
         if missing:
             raise IncompleteHardeningDefinition('\n'.join(missing))
@@ -71,7 +78,7 @@ class HardeningDescription(object):
         >>>
         """
         attr = camelcase_to_underscore(section_class.__name__)
-        setattr(cls, attr, section_class())
+        setattr(cls, attr, section_class)
         return section_class
 
     @classmethod
@@ -109,9 +116,12 @@ class HardeningDescription(object):
         no_hardener_implemented_topics = reduce(lambda a, b: a + b,
            [[t[1] for t in s.topics if t[1].is_defined() and
              not t[1].is_hardener_implemented()] for s in self.sections], [])
+        drifted_topics = reduce(lambda a, b: a + b,
+           [[t[1] for t in s.topics if t[1].drift] for s in self.sections], [])
         if failed_topics or incomplete_topics or \
-                no_hardener_implemented_topics:
+                no_hardener_implemented_topics or drifted_topics:
             raise FailedOrIncompleteTopicsException(failed_topics,
                                                     incomplete_topics,
-                                                no_hardener_implemented_topics)
+                                                no_hardener_implemented_topics,
+                                                    drifted_topics)
 
@@ -26,9 +26,9 @@ class BaseOsConfiguration(Section):
     system_cron_jobs = Topic(list, "Report a list of cron jobs in the system.")
     cron_jobs_per_user = Topic(dict, "Report a list of cron jobs per user.")
     suid_files = Topic(list, "Ensure that no additional SUID files have "
-                             "been added.")
+                             "been added.", timeout=900)
     sgid_files = Topic(list, "Ensure that no additional SGID files have "
-                             "been added.")
+                             "been added.", timeout=900)
 
 
 class BaseSecurityPatchManagement(Section):
@@ -0,0 +1,145 @@
+""" Runs the node hardening on a whole LITP deployment, the MS and all its
+managed nodes, through a single connection to the MS.
+"""
+import os
+import time
+import traceback
+
+from node_hardening.basedescription import FailedOrIncompleteTopicsException
+from node_hardening.events import EventStream
+from node_hardening.trace import TraceRecorder
+from node_hardening.metrics import Metrics, add_run_metrics
+from node_hardening.fleet import write_summary
+from node_hardening.hardening import HardeningProcessor
+from node_hardening.hardening.base import SshRunner, LitpHelper
+from node_hardening.report import ReportBuilder
+from node_hardening.runner import get_description_class
+from node_hardening.ssh import SshClient, tunnels
+from node_hardening.utils import run_in_pool
+
+
+def discover_nodes(ms_client, su_password=None):
+    """ Gets the host names of all the nodes of the LITP model of the MS.
+    :param ms_client: SshClient connected to the MS
+    :param su_password: str, in case the user is not root
+    :return: list of str
+    """
+    litp = LitpHelper(SshRunner(ms_client, [], su_password))
+    return [node['properties']['hostname']['value']
+            for node in litp.get_nodes()]
+
+
+def _harden(processor, report_dir, trace=None):
+    """ Runs the processor of a host and writes its report. It returns a
+    tuple of (name, success, report filename, None, duration, error).
+    """
+    description = processor.description
+    report_filename = os.path.join(report_dir, '%s.html' % description.host)
+    t0 = time.time()
+    success, error = True, None
+    try:
+        processor.start()
+    except FailedOrIncompleteTopicsException:
+        success = False
+    except Exception as err:
+        success, error = False, "%s: %s" % (type(err).__name__, err)
+        traceback.print_exc()
+    with open(report_filename, 'w') as report_file:
+        if trace is not None:
+            with trace.span('report', description.host, 'report'):
+                report_file.write(ReportBuilder(description).to_html())
+        else:
+            report_file.write(ReportBuilder(description).to_html())
+    return description.host, success, report_filename, None, \
+           time.time() - t0, error
+
+
+def run_cluster(ms_host, user, password, port=22, su_password=None,
+                node_user=None, node_password=None, node_su_password=None,
+                workers=4, report_dir='.', persistent_su=False,
+                topic_workers=1, audit=False, state_dir=None,
+                topic_timeout=None, run_timeout=None, events_to=None,
+                trace_to=None, metrics_to=None):
+    """ Connects to the MS, discovers the nodes from the deployments in the
+    LITP model and hardens the MS with the "litp.ms" description and the
+    nodes with the "litp.node" one, up to "workers" hosts at the same time.
+    The nodes are connected through tunnels over the same MS transport.
+    A report per host and a summary.txt file are written in the report_dir.
+
+    :param ms_host: str, ip or host name of the MS
+    :param user: str, username of the MS
+    :param password: str
+    :param port: int, ssh port of the MS, default is 22
+    :param su_password: str, in case the user of the MS is not root
+    :param node_user: str, username of the nodes, default is the same user
+    :param node_password: str, default is the same password
+    :param node_su_password: str, default is the same su_password
+    :param workers: int, the number of hosts hardened at the same time
+    :param report_dir: str, the directory of the reports and summary
+    :param persistent_su: bool, uses a single root shell for the su commands
+    :param topic_workers: int, number of topics processed at the same time
+    :param audit: bool, only checks the topics and reports the drift
+    :param state_dir: str, directory of the state kept between runs
+    :param topic_timeout: float, time budget in seconds of each topic
+    :param run_timeout: float, time budget in seconds of the run of each host
+    :param events_to: str, file or pipe where the JSON-lines events of the
+                      runs of all the hosts are written
+    :param trace_to: str, file where the spans of the runs of all the hosts
+                     are written in the Chrome trace-event format
+    :param metrics_to: str, file where the metrics of the runs of all the
+                       hosts are written in the Prometheus text format
+    :return: tuple (bool, str) => (all succeeded or not, summary filename)
+    """
+    node_user = node_user or user
+    node_password = node_password or password
+    node_su_password = node_su_password or su_password
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    t0 = time.time()
+    ms_client = SshClient(ms_host, user, password, port,
+                          persistent_su=persistent_su)
+    events = EventStream(events_to) if events_to else None
+    trace = TraceRecorder() if trace_to else None
+    try:
+        ms_client.connect()
+        # the nodes are reached through the transport of the MS itself.
+        tunnels.adopt(ms_host, port, user, ms_client.transport)
+        nodes = discover_nodes(ms_client, su_password)
+        print " Hardening the MS %s and the nodes: %s" % (ms_host,
+                                                          ', '.join(nodes))
+        ms_description = get_description_class('litp.ms')(ms_host)
+        processors = [HardeningProcessor('litp', ms_description, ms_host,
+                                         user, password, port, su_password,
+                                         workers=topic_workers,
+                                         ssh_client=ms_client,
+                                         status_prefix="[%s]" % ms_host,
+                                         audit=audit, state_dir=state_dir,
+                                         topic_timeout=topic_timeout,
+                                         run_timeout=run_timeout,
+                                         events=events, trace=trace)]
+        NodeDescription = get_description_class('litp.node')
+        for node in nodes:
+            processors.append(HardeningProcessor('litp',
+                NodeDescription(node), node, node_user, node_password, 22,
+                node_su_password, ms_host, user, password, persistent_su,
+                workers=topic_workers, via_port=port,
+                status_prefix="[%s]" % node, audit=audit,
+                state_dir=state_dir, topic_timeout=topic_timeout,
+                run_timeout=run_timeout, events=events, trace=trace))
+        results = run_in_pool(lambda p: _harden(p, report_dir, trace),
+                              processors, workers)
+    finally:
+        ms_client.close()
+        tunnels.close()
+        if events is not None:
+            events.close()
+        if trace is not None:
+            trace.write(trace_to)
+    if metrics_to:
+        metrics = Metrics()
+        for processor in processors:
+            add_run_metrics(metrics, processor)
+        metrics.write(metrics_to)
+    summary_filename = os.path.join(report_dir, 'summary.txt')
+    write_summary(summary_filename, results, time.time() - t0)
+    return all([r[1] for r in results]), summary_filename
@@ -0,0 +1,60 @@
+""" Writes the progress of the hardening runs as a JSON-lines event stream.
+"""
+import json
+import os
+import threading
+import time
+import Queue
+
+
+class EventStream(object):
+    """ This class writes one JSON object per line in a file or a pipe for
+    each event of a run, e.g.:
+
+        {"ts": 1700000000.5, "event": "topic_started", "host": "ms1",
+         "section": "LoginControl", "topic": "password_age"}
+
+    The emit() only queues the event, it's serialized and written by a
+    background thread, so it never slows the topics down. The file is opened
+    in append mode and each line is written at once, so many processes can
+    share it, e.g.: the hosts of an inventory.
+    """
+
+    def __init__(self, filename):
+        """ It requires the filename, "-" is the standard output.
+        """
+        self.filename = filename
+        if filename == '-':
+            self._fd = os.dup(1)
+        else:
+            self._fd = os.open(filename, os.O_WRONLY | os.O_APPEND |
+                               os.O_CREAT, 0644)
+        self._queue = Queue.Queue()
+        self._writer = threading.Thread(target=self._write)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def emit(self, event, **fields):
+        """ Queues an event, the fields must be serializable in JSON.
+        :param event: str, the name of the event
+        :return: None
+        """
+        self._queue.put((time.time(), event, fields))
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            ts, event, fields = item
+            fields.update(ts=ts, event=event)
+            line = json.dumps(fields, default=str)
+            os.write(self._fd, line + '\n')
+
+    def close(self):
+        """ Writes the events still queued and closes the file.
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+            os.close(self._fd)
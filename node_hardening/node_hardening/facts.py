@@ -0,0 +1,118 @@
+import threading
+from collections import OrderedDict
+
+from node_hardening.utils import resources_overlap
+
+
+class HostFacts(object):
+    """ This class is a snapshot of the common host state, gathered in a
+    single remote execution before any topic runs. The hardeners read those
+    facts instead of executing the same commands again and again.
+
+    A fact is invalidated after a harden step writes its resource, and it is
+    executed again only when it's read afterwards.
+    """
+
+    commands = OrderedDict([
+        ('passwd', 'cat /etc/passwd'),
+        ('packages', '/bin/rpm -qa'),
+        ('sestatus', '/usr/sbin/sestatus'),
+        ('netstat', '/bin/netstat -tulpn'),
+        ('sysctl', '/sbin/sysctl -a'),
+        ('chkconfig', '/sbin/chkconfig --list'),
+        ('system_auth', 'cat /etc/pam.d/system-auth'),
+        ('password_auth', 'cat /etc/pam.d/password-auth'),
+        ('limits_conf', '/bin/cat /etc/security/limits.conf'),
+        ('sshd_config', 'cat /etc/ssh/sshd_config'),
+        ('grub_conf', 'cat "/boot/grub/grub.conf"'),
+    ])
+
+    # the resource each fact is about, as declared by the hardeners.
+    resources = {
+        'passwd': 'file:/etc/passwd',
+        'packages': 'packages',
+        'sestatus': 'selinux',
+        'netstat': 'ports',
+        'sysctl': 'sysctl:',
+        'chkconfig': 'service:',
+        'system_auth': 'file:/etc/pam.d/system-auth',
+        'password_auth': 'file:/etc/pam.d/password-auth',
+        'limits_conf': 'file:/etc/security/limits.conf',
+        'sshd_config': 'file:/etc/ssh/sshd_config',
+        'grub_conf': 'file:/boot/grub/grub.conf',
+    }
+
+    def __init__(self, ssh_runner):
+        """ It requires the SshRunner used to gather the facts.
+        """
+        self.ssh = ssh_runner
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def gather(self, names=None):
+        """ Executes the commands of all the facts, or just the ones in
+        names, in a single remote script.
+        """
+        names = list(names or self.commands.keys())
+        cmds = [self.commands[name] for name in names]
+        _, results = self.ssh.execute_many(cmds, stop_on_failure=False)
+        with self._lock:
+            for name, result in zip(names, results):
+                self._values[name] = result
+
+    def invalidate(self, names=None):
+        """ Invalidates the given facts, or all of them in case names is
+        None.
+        """
+        with self._lock:
+            if names is None:
+                self._values.clear()
+            for name in names or []:
+                self._values.pop(name, None)
+
+    def invalidate_resources(self, resources):
+        """ Invalidates the facts about any of the given resources, or all of
+        them in case resources is None.
+        """
+        if resources is None:
+            return self.invalidate()
+        self.invalidate([name for name, res in self.resources.items()
+                         if any(resources_overlap(res, r) for r in resources)])
+
+    def get(self, name, ssh_runner, silent_fail_if=None):
+        """ Returns the output of the fact, the same way the SshRunner.run()
+        does. The fact is recorded in the output history of the ssh_runner,
+        flagged as cached in case it's taken from the snapshot.
+        """
+        cmd = self.commands[name]
+        with self._lock:
+            value = self._values.get(name)
+        if value is None:
+            out = ssh_runner.run(cmd, silent_fail_if, cacheable=True)
+            with self._lock:
+                self._values[name] = ssh_runner.outputs[-1][1:]
+            return out
+        code, out = value
+        return ssh_runner.handle_output(cmd, code, out, silent_fail_if,
+                                        cached=True)
+
+    def reader(self, ssh_runner):
+        """ Returns a FactsReader bound to the ssh_runner of a hardener.
+        """
+        return FactsReader(self, ssh_runner)
+
+
+class FactsReader(object):
+    """ This is the facts API available in the hardeners, as self.facts.
+    """
+
+    def __init__(self, host_facts, ssh_runner):
+        self._facts = host_facts
+        self._ssh = ssh_runner
+
+    def get(self, name, silent_fail_if=None):
+        """ Returns the output of the fact name, e.g.: "passwd", "packages".
+        In case of failure (status code != 0 and not in silent_fail_if), it
+        raises the CommandExecutionException.
+        """
+        return self._facts.get(name, self._ssh, silent_fail_if)
@@ -0,0 +1,204 @@
+""" Runs the node hardening on many hosts at once, from an inventory file.
+"""
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from ConfigParser import RawConfigParser
+
+from node_hardening.runner import run_node_hardening
+
+
+class InvalidInventory(Exception):
+    """ This exception is raised when the inventory file is not well defined.
+    """
+
+
+def load_inventory(filename):
+    """ Reads an inventory file in the INI format, where each host has its
+    own section referring to a credentials section, e.g.:
+
+        [credentials:litp]
+        user = litp-admin
+        password = some_password
+        su_password = some_root_password
+
+        [host:node1]
+        address = 10.0.0.2
+        description = litp.node
+        credentials = litp
+        via_host = 10.0.0.1
+        via_credentials = litp
+
+    The address (default is the host name), port, via_host and
+    via_credentials (default is the same credentials) are optional. The
+    via_host may be the name of another host of the inventory.
+
+    :param filename: str
+    :return: list of dicts, the arguments of the run_node_hardening()
+    """
+    parser = RawConfigParser()
+    if not parser.read(filename):
+        raise InvalidInventory("Inventory file %s not found." % filename)
+    credentials = {}
+    for section in parser.sections():
+        if section.startswith('credentials:'):
+            credentials[section.split(':', 1)[1]] = dict(parser.items(section))
+    hosts = []
+    for section in parser.sections():
+        if not section.startswith('host:'):
+            continue
+        name = section.split(':', 1)[1]
+        options = dict(parser.items(section))
+        try:
+            creds = credentials[options['credentials']]
+            via_creds = credentials[options.get('via_credentials',
+                                                options['credentials'])]
+            hosts.append({
+                'name': name,
+                'description_module': options['description'],
+                'host': options.get('address', name),
+                'port': int(options.get('port', 22)),
+                'user': creds['user'],
+                'password': creds['password'],
+                'su_password': creds.get('su_password'),
+                'via_host': options.get('via_host'),
+                'via_user': via_creds['user'] if 'via_host' in options
+                            else None,
+                'via_password': via_creds['password'] if 'via_host' in options
+                                else None,
+            })
+        except KeyError as err:
+            raise InvalidInventory("Missing %s in the section [%s] or in its "
+                                   "credentials." % (err, section))
+    if not hosts:
+        raise InvalidInventory("No [host:...] section found in %s." %
+                               filename)
+    addresses = dict([(h['name'], h['host']) for h in hosts])
+    for host in hosts:
+        if host['via_host']:
+            host['via_host'] = addresses.get(host['via_host'],
+                                             host['via_host'])
+    return hosts
+
+
+def _run_host(args):
+    """ Runs the node hardening of a single host in a pool process, with its
+    output redirected to a log file. It returns a tuple of (name, success,
+    report filename, log filename, duration, error).
+    """
+    host, report_dir, options = args
+    name = host['name']
+    log_filename = os.path.join(report_dir, '%s.log' % name)
+    report_filename = os.path.join(report_dir, '%s.html' % name)
+    kwargs = dict(host)
+    del kwargs['name']
+    kwargs.update(options)
+    if kwargs.pop('trace'):
+        kwargs['trace_to'] = os.path.join(report_dir, '%s.trace.json' % name)
+    if kwargs['metrics_to']:
+        directory, basename = os.path.split(kwargs['metrics_to'])
+        kwargs['metrics_to'] = os.path.join(directory, '%s_%s' % (name,
+                                                                  basename))
+    t0 = time.time()
+    success, error = False, None
+    with open(log_filename, 'w') as log:
+        sys.stdout = sys.stderr = log
+        try:
+            success, report_filename = run_node_hardening(
+                report_filename=report_filename, **kwargs)
+        except (Exception, SystemExit) as err:
+            error = "%s: %s" % (type(err).__name__, err)
+            traceback.print_exc()
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return name, success, report_filename, log_filename, \
+           time.time() - t0, error
+
+
+def run_fleet(inventory, workers=4, report_dir='.', topic=None,
+              persistent_su=False, topic_workers=1, audit=False,
+              state_dir=None, topic_timeout=None, run_timeout=None,
+              events_to=None, trace=False, metrics_to=None):
+    """ Runs the node hardening of all the hosts of the inventory file,
+    up to "workers" hosts at the same time. Each host runs in its own
+    process and writes its own report and log files in the report_dir.
+    Finally, a summary.txt file is written in the report_dir as well.
+
+    :param inventory: str, the inventory filename, see load_inventory()
+    :param workers: int, the number of hosts hardened at the same time
+    :param report_dir: str, the directory of the reports, logs and summary
+    :param topic: str, the name of the topic to be executed
+    :param persistent_su: bool, uses a single root shell for the su commands
+    :param topic_workers: int, number of topics processed at the same time
+    :param audit: bool, only checks the topics and reports the drift
+    :param state_dir: str, directory of the state kept between runs
+    :param topic_timeout: float, time budget in seconds of each topic
+    :param run_timeout: float, time budget in seconds of the run of each host
+    :param events_to: str, file or pipe shared by the hosts where the
+                      JSON-lines events of the runs are written
+    :param trace: bool, writes the spans of the run of each host in a
+                  "<host>.trace.json" file in the report_dir
+    :param metrics_to: str, the metrics of each host are written in the
+                       Prometheus text format in a "<host>_<basename>" file
+                       in the same directory, e.g.: "<host>_hardening.prom"
+    :return: tuple (bool, str) => (all succeeded or not, summary filename)
+    """
+    hosts = load_inventory(inventory)
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    options = {'topic': topic, 'persistent_su': persistent_su,
+               'topic_workers': topic_workers, 'audit': audit,
+               'state_dir': state_dir, 'topic_timeout': topic_timeout,
+               'run_timeout': run_timeout, 'events_to': events_to,
+               'trace': trace, 'metrics_to': metrics_to}
+    print " Hardening %s hosts, %s at a time." % (len(hosts), workers)
+    t0 = time.time()
+    # a process per host, so its output is redirected to its own log file
+    # and it starts with a clean module state (e.g. the ssh tunnels).
+    pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+    results = []
+    try:
+        for result in pool.imap_unordered(_run_host, [(host, report_dir,
+                                                        options)
+                                                       for host in hosts]):
+            name, success = result[:2]
+            print " %s%s" % (name.ljust(40), "SUCCESS" if success
+                                              else "FAILED")
+            results.append(result)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    order = [host['name'] for host in hosts]
+    results.sort(key=lambda r: order.index(r[0]))
+    summary_filename = os.path.join(report_dir, 'summary.txt')
+    write_summary(summary_filename, results, time.time() - t0)
+    return all([r[1] for r in results]), summary_filename
+
+
+def write_summary(filename, results, duration):
+    """ Writes the summary of the hosts hardened.
+    :param filename: str
+    :param results: list of tuples of (name, success, report filename, log
+                    filename or None, duration, error or None)
+    :param duration: float, the total duration in seconds
+    :return: None
+    """
+    failed = [r for r in results if not r[1]]
+    with open(filename, 'w') as summary:
+        summary.write("%s hosts, %s succeeded, %s failed in %.1f seconds.\n"
+                      "\n" % (len(results), len(results) - len(failed),
+                              len(failed), duration))
+        for name, success, report, log, host_duration, error in results:
+            line = "%s %s %6.1fs report: %s" % (
+                name.ljust(40), "SUCCESS" if success else "FAILED ",
+                host_duration, report)
+            if log:
+                line = "%s log: %s" % (line, log)
+            summary.write("%s\n" % line)
+            if error:
+                summary.write("    %s\n" % error)
@@ -1,13 +1,20 @@
-import inspect
 import pkgutil
 import sys
+import threading
 import time
 import traceback
+from collections import Counter
+from contextlib import contextmanager
 
 from node_hardening.ssh import SSHConnection
-from node_hardening.utils import import_module
-from node_hardening.hardening.base import BaseHardening, NullExpectedValue, \
-    StopHardeningExecution
+from node_hardening.session import SessionRecorder, ReplaySshClient
+from node_hardening.utils import import_module, run_dag, Deadline, \
+    DeadlineExceeded
+from node_hardening.facts import HostFacts
+from node_hardening.state import HostState
+from node_hardening.hardening.base import NullExpectedValue, \
+    StopHardeningExecution, CommandCache, SshRunner, HardenerRegistry, \
+    CommandExecutionException, LitpHelper, PlanCoalescer, CommandOutput
 
 
 class HardeningProcessor(object):
@@ -15,9 +22,19 @@ class HardeningProcessor(object):
     classes defined in the "hardening.<hardener_name>" package
     """
 
+    # the status lines of all the processors of this process are written one
+    # at a time.
+    print_lock = threading.Lock()
+    # the hardeners packages whose modules are already imported.
+    _loaded_packages = set()
+
     def __init__(self, hardener_name, description, host, username, password,
             port=22, su_password=None, via_host=None, via_user=None,
-            via_password=None):
+            via_password=None, persistent_su=False, record_to=None,
+            replay_from=None, replay_latency=False, workers=1,
+            via_port=22, ssh_client=None, status_prefix="", audit=False,
+            state_dir=None, topic_timeout=None, run_timeout=None,
+            profiler=None, events=None, trace=None):
         """ The constructor requires the node hardening description instance
         and the connection arguments as follows.
         :param description: a HardeningDescription instance
@@ -29,28 +46,155 @@ class HardeningProcessor(object):
         :param via_user: str, the username of the above host
         :param via_user: str, the username to be connected again
         :param via_password: str, the password of the above user
+        :param persistent_su: bool, runs the su commands through a single
+                              root shell instead of a "su -c" per command.
+        :param record_to: str, session file to record the commands executed.
+        :param replay_from: str, session file to replay instead of
+                            connecting to the host.
+        :param replay_latency: bool, replays the recorded latencies as well.
+        :param workers: int, number of topics processed at the same time.
+        :param via_port: int, the port of the "via_host", default is 22
+        :param ssh_client: an SshClient already connected to be used instead
+                           of a new one, it's not closed by the processor.
+        :param status_prefix: str, written before the status lines, e.g.:
+                              the host name when many hosts are processed.
+        :param audit: bool, only checks the topics and records the drift,
+                      the host is never changed.
+        :param state_dir: str, directory of the state kept between runs, the
+                          topics whose inputs have not changed since their
+                          last successful check are not checked again.
+        :param topic_timeout: float, time budget in seconds of each topic,
+                              unless the topic defines its own timeout.
+        :param run_timeout: float, time budget in seconds of the whole run,
+                            the topics still running when it's exceeded are
+                            marked as timed out.
+        :param profiler: a RunProfiler instance, each topic is processed
+                         under its own profiler.
+        :param events: an EventStream instance, the progress of the run is
+                       emitted in it as well.
+        :param trace: a TraceRecorder instance, the spans of the run are
+                      recorded in it.
         :return: None
         """
         self.hardener_name = hardener_name
         self.description = description
-        self.connection = SSHConnection(host, username, password, port,
-                                        via_host, via_user, via_password)
+        self.status_prefix = status_prefix
+        if ssh_client is not None:
+            self.connection = SSHConnection(client=ssh_client)
+        elif replay_from:
+            self.connection = SSHConnection(host, username, password, port,
+                                            via_host, via_user, via_password,
+                                            via_port,
+                                            persistent_su=persistent_su,
+                                            client_class=ReplaySshClient,
+                                            session_file=replay_from,
+                                            replay_latency=replay_latency)
+        else:
+            recorder = SessionRecorder(record_to) if record_to else None
+            self.connection = SSHConnection(host, username, password, port,
+                                            via_host, via_user, via_password,
+                                            via_port,
+                                            persistent_su=persistent_su,
+                                            recorder=recorder)
         self.su_password = su_password
-        self._len_msg = 0
+        self.audit = audit
+        # nothing is written in the audit mode, so every output is cached.
+        self.cache = CommandCache(cache_all=audit)
+        self.facts = None
+        # the LITP plans are coalesced during the start() only, the
+        # hardeners deferring theirs are checked again once it's applied.
+        self.plan_coalescer = None
+        self._deferred = []
+        self.state = HostState(state_dir, host) if state_dir else None
+        self.workers = workers
+        self.topic_timeout = topic_timeout
+        self.run_timeout = run_timeout
+        self.profiler = profiler
+        self.events = events
+        self.trace = trace
+        # the number of topics by status, e.g.: SUCCESS, FAILED, only the
+        # last status of each topic is counted.
+        self.statuses = Counter()
+        self._topic_statuses = {}
+        # the status line of each topic is built in its own thread and
+        # written at once.
+        self._status = threading.local()
 
     def start(self):
         """ Gets all methods of this class decorated by "section" and execute
         them.
         """
         t0 = time.time()
-        with self.connection as ssh_client:
-            for _, hardener_class in self._get_hardener_topics():
-                ignored = self.process_hardener(hardener_class, ssh_client)
+        self.connect()
+        with self.connection as ssh_client, \
+                Deadline(self.run_timeout, 'run'):
+            self.facts = HostFacts(SshRunner(ssh_client, [], self.su_password,
+                                             self.cache))
+            self._gather('facts', self.facts.gather)
+            hardener_classes = [h for _, h in self._get_hardener_topics()]
+            self._emit('run_started', topics=len(hardener_classes))
+            if self.state is not None:
+                self._gather('state', self.state.gather,
+                             SshRunner(ssh_client, [], self.su_password),
+                             hardener_classes)
+            process = lambda h: self.run_hardener(h, ssh_client)
+            # the topics run concurrently unless they conflict on the
+            # resources they read and write, which never happens in the
+            # audit mode.
+            depends = {}
+            if not self.audit:
+                depends = self.get_dependencies(hardener_classes)
+                self.plan_coalescer = PlanCoalescer()
+            for ignored in run_dag(process, hardener_classes, depends,
+                                   self.workers):
                 if ignored:
                     self.description.ignored_topics.append(ignored)
+            if self.plan_coalescer is not None:
+                self._apply_deferred_plan(ssh_client, hardener_classes)
+                self.plan_coalescer = None
+        if self.state is not None:
+            self.state.save()
         self.description.duration = time.time() - t0
+        self._emit('run_finished', duration=self.description.duration,
+                   statuses=dict([(s, c) for s, c in self.statuses.items()
+                                  if c]))
         self.description.check_failed_topics()
 
+    def _gather(self, name, gather, *args):
+        """ Gathers the facts or the state of the host before the topics. In
+        case the time budget of the run is exceeded meanwhile, the topics are
+        still processed, so they're marked as timed out.
+        :param name: str, "facts" or "state"
+        :param gather: the gather method
+        :return: None
+        """
+        try:
+            with self._span(name, 'ssh'):
+                gather(*args)
+        except DeadlineExceeded as err:
+            self._start_status(" Gathering the %s of the host..." % name)
+            self._print_status('TIMEOUT', str(err))
+
+    def connect(self):
+        """ Connects to the host before the connection is used, so the span
+        of the connection is recorded in the trace, if any.
+        """
+        with self._span('connect', 'ssh'):
+            self.connection.client.connect()
+
+    def run_hardener(self, hardener_class, ssh_client):
+        """ Does the process_hardener() below, under the profiler of the
+        topic in case the run is profiled.
+        :param hardener_class: hardener class
+        :param ssh_client: SSH client instance
+        :return: the value returned by process_hardener()
+        """
+        if self.profiler is None:
+            return self.process_hardener(hardener_class, ssh_client)
+        name = "%s.%s" % (hardener_class.section, hardener_class.topic)
+        return self.profiler.profile(name, self.process_hardener,
+                                     hardener_class, ssh_client)
+
     def process_hardener(self, hardener_class, ssh_client):
         """ Process a hardening procedure given a Hardener based class:
           1. Executes the check() method;
@@ -60,28 +204,64 @@ class HardeningProcessor(object):
              as expected in the topic description, mark as success and return.
           4. Executes the harden() method in case the check above fails.
           5. Do the check() again and compare the value: fail or success.
+        In the audit mode, 4 and 5 are skipped and the drift is recorded in
+        the topic instead. All the steps are bounded by the time budget of
+        the topic, see _process().
 
         :param hardener_class: hardener class
         :param ssh_client: SSH client instance
         :return: None
         """
         hardener = hardener_class(self.description, ssh_client,
-                                  self.su_password)
+                                  self.su_password, cache=self.cache,
+                                  facts=self.facts,
+                                  plan_coalescer=self.plan_coalescer)
         topic = hardener.topic
         topic.hardener_implemented = True
         if isinstance(topic.expected_value, NullExpectedValue):
             ignored = (hardener.section, hardener_class.topic)
-            msg = " Ignored %s: %s " % ignored
-            sys.stdout.write(msg)
-            sys.stdout.flush()
-            self._len_msg = len(msg)
+            self._start_status(" Ignored %s: %s " % ignored, *ignored)
             self._print_status("IGNORED",
                           "not part of %s description" % self.description.name)
             return ignored
-        msg = " Running %s: %s..." % (hardener.section, topic)
-        self._len_msg = len(msg)
-        sys.stdout.write(msg)
-        sys.stdout.flush()
+        self._start_status(" Running %s: %s..." % (hardener.section, topic),
+                           hardener.section, topic)
+        t0 = time.time()
+        self._emit('topic_started', section=hardener.section, topic=str(topic))
+        try:
+            with self._topic_deadline(topic):
+                self._process_topic(hardener, hardener_class, topic)
+        finally:
+            topic.duration = time.time() - t0
+            self._emit('topic_finished', section=hardener.section,
+                       topic=str(topic), duration=topic.duration)
+
+    def _topic_deadline(self, topic):
+        """ Returns the Deadline of the topic, either its own timeout or the
+        one of the processor.
+        :param topic: an instance of Topic class from the Hardener object.
+        :return: Deadline
+        """
+        return Deadline(topic.timeout or self.topic_timeout,
+                        'topic %s' % topic)
+
+    def _process_topic(self, hardener, hardener_class, topic):
+        """ Runs the steps of the process_hardener() above for a topic
+        described in the description.
+        :param hardener: the Hardener instance of the topic
+        :param hardener_class: hardener class
+        :param topic: an instance of Topic class from the Hardener object.
+        :return: None
+        """
+        if self.state is not None:
+            checked_at = self.state.is_unchanged(hardener_class, topic)
+            if checked_at is not None:
+                # 0. reuses the previous check as its inputs are the same.
+                topic.retrieved_value = topic.expected_value
+                topic.report = "Unchanged since %s, the previous check was " \
+                               "reused." % time.ctime(checked_at)
+                self._print_status('SUCCESS: unchanged since the last check')
+                return
 
         # 1 or 2. check or report
         value = self._process(hardener.check, topic, hardener.report)
@@ -92,54 +272,189 @@ class HardeningProcessor(object):
             topic.report = value
             self._print_status('SUCCESS', 'just report')
         elif topic.retrieved_value is None:
+            self._flush_status()
             return
         elif value == topic.expected_value:
             # 3. checked
             topic.report = "Checked only, no hardening needed."
             self._print_status('SUCCESS: checked only, no hardening needed')
+            if self.state is not None:
+                self.state.record(hardener_class, topic, True)
+        elif self.audit:
+            # 4. just records the drift in the audit mode.
+            if self.state is not None:
+                self.state.record(hardener_class, topic, False)
+            diff = "expected %s != %s" % (topic.expected_value, value)
+            topic.drift = True
+            topic.report = "Audit only, drift found: %s" % diff
+            self._print_status('DRIFT', diff)
         else:
-            # 4. do hardening as the checked value != expected
+            # 4. do hardening as the checked value != expected. The cached
+            # outputs are not valid anymore before and after it, nor the
+            # facts about the resources written by the hardener.
+            self.cache.clear()
             topic.report = self._process(hardener.harden, topic)
+            self.cache.clear()
+            if self.facts is not None:
+                self.facts.invalidate_resources(hardener.writes)
+            if self.state is not None:
+                self.state.record(hardener_class, topic, False)
+                self.state.invalidate_resources(hardener.writes)
             topic.harden_outputs = topic.outputs[len(topic.check_outputs):]
             if not topic.report:
+                self._flush_status()
+                return
+            if hardener.litp.plan_deferred:
+                # 5. is done once the LITP plan of the run is applied.
+                self._deferred.append(hardener)
+                self._print_status('PENDING', 'LITP plan deferred to the end '
+                                              'of the run')
                 return
             # 5. check again
-            value = self._process(hardener.check, topic)
-            topic.double_check_outputs = topic.outputs[len(topic.check_outputs)
-                                                  + len(topic.harden_outputs):]
+            self._check_again(hardener, topic)
+
+    def _check_again(self, hardener, topic):
+        """ Executes the check() method again after the harden one, and
+        compares the value: fail or success.
+        :param hardener: the Hardener instance of the topic
+        :param topic: an instance of Topic class from the Hardener object.
+        :return: None
+        """
+        value = self._process(hardener.check, topic, phase='double_check')
+        topic.double_check_outputs = topic.outputs[len(topic.check_outputs)
+                                                   + len(topic.harden_outputs):]
+        topic.retrieved_value = value
+        if value == topic.expected_value:
+            # checked again
+            if topic.report:
+                self._print_status('SUCCESS: checked and hardened')
+            else:
+                self._print_status('INCOMPLETE: no report provided')
+            topic.checked_and_hardened = True
+        else:
+            # hardening failed
+            diff =  "expected %s != %s" % (topic.expected_value, value)
+            topic.error = "Check failed after harden process: %s" % diff
+            self._print_status('FAILED', diff)
+
+    def _apply_deferred_plan(self, ssh_client, hardener_classes):
+        """ Runs the single LITP plan of the model changes deferred by the
+        hardeners, then checks again their topics and the passed ones reading
+        what they write, since those were checked before the plan ran.
+        :param ssh_client: SSH client instance
+        :param hardener_classes: list of the hardener classes processed
+        :return: None
+        """
+        deferred, self._deferred = self._deferred, []
+        if not deferred:
+            return
+        self._start_status(" Running the LITP plan of %s topics..." %
+                           len(deferred))
+        t0 = time.time()
+        plan_outputs = []
+        litp = LitpHelper(SshRunner(ssh_client, plan_outputs,
+                                    self.su_password))
+        try:
+            with self._span('litp_plan', 'litp', topics=len(deferred)):
+                status = self.plan_coalescer.run_plan(litp)
+        except (StopHardeningExecution, CommandExecutionException,
+                DeadlineExceeded) as err:
+            status = "Failed: %s" % err
+        # the plan is part of the harden step of all the deferred topics. Its
+        # outputs are recorded in the first one, and as cached in the others,
+        # so its commands are counted only once.
+        for index, hardener in enumerate(deferred):
+            topic = hardener.topic
+            entries = plan_outputs
+            if index:
+                entries = [CommandOutput(cmd, code, out, cached=True)
+                           for cmd, code, out in plan_outputs]
+            topic.outputs += entries
+            topic.harden_outputs += entries
+        if self.events is not None or self.trace is not None:
+            self._emit_commands(plan_outputs, {})
+        # the outputs and facts read before the plan ran are not valid anymore.
+        self.cache.clear()
+        if self.facts is not None:
+            for hardener in deferred:
+                self.facts.invalidate_resources(hardener.writes)
+        self._emit('phase_finished', phase='litp_plan',
+                   duration=time.time() - t0)
+        if status == 'Successful':
+            self._print_status('SUCCESS')
+        else:
+            self._print_status('FAILED', status)
+        for hardener in deferred:
+            topic = hardener.topic
+            self._start_status(" Checking %s: %s..." % (hardener.section,
+                                                        topic),
+                               hardener.section, topic)
+            if status != 'Successful':
+                topic.error = "The LITP plan failed: %s" % status
+                self._print_status('FAILED', topic.error)
+                continue
+            with self._topic_deadline(topic):
+                self._check_again(hardener, topic)
+        # all the passed topics reading what the plan wrote are checked
+        # again, the ones before the deferred hardeners as well.
+        deferred_classes = [h.__class__ for h in deferred]
+        for hardener_class in hardener_classes:
+            if hardener_class in deferred_classes or \
+               not any(hardener_class.conflicts_with(d)
+                       for d in deferred_classes):
+                continue
+            hardener = hardener_class(self.description, ssh_client,
+                                      self.su_password, cache=self.cache,
+                                      facts=self.facts)
+            topic = hardener.topic
+            if topic.just_report or topic.retrieved_value is None or \
+               topic.retrieved_value != topic.expected_value:
+                continue
+            self._start_status(" Checking %s: %s..." % (hardener.section,
+                                                        topic),
+                               hardener.section, topic)
+            outputs = len(topic.outputs)
+            with self._topic_deadline(topic):
+                value = self._process(hardener.check, topic,
+                                      phase='double_check')
+            topic.double_check_outputs += topic.outputs[outputs:]
             topic.retrieved_value = value
             if value == topic.expected_value:
-                # checked again
-                if topic.report:
-                    self._print_status('SUCCESS: checked and hardened')
-                else:
-                    self._print_status('INCOMPLETE: no report provided')
-                topic.checked_and_hardened = True
+                self._print_status('SUCCESS: unchanged by the LITP plan')
             else:
-                # hardening failed
-                diff =  "expected %s != %s" % (topic.expected_value, value)
-                topic.error = "Check failed after harden process: %s" % diff
+                diff = "expected %s != %s" % (topic.expected_value, value)
+                topic.error = "Check failed after the LITP plan: %s" % diff
                 self._print_status('FAILED', diff)
 
-    def _process(self, method, topic, not_implemented_method=None):
+    def _process(self, method, topic, not_implemented_method=None,
+                 phase=None):
         """ Executes the method and populate the topic attributes. 3 different
         exceptions are handled:
          1. NotImplementedError: executes the not_implemented_method and sets
                                  the topic.just_report attribute as True.
          2. StopHardeningExecution: sets the topic.error attribute with the
                                     error message.
-         3. Exception: sets the topic.unhandled_error attribute with the
+         3. DeadlineExceeded: the time budget of the topic or of the run is
+                              exceeded, the method is cancelled and the
+                              topic.timed_out attribute is set as well.
+         4. Exception: sets the topic.unhandled_error attribute with the
                        generic error message.
         :param method: method from a Hardener object (check, report or harden)
         :param topic: an instance of Topic class from the Hardener object.
         :param not_implemented_method: method from a Hardener object (report)
+        :param phase: str, the name of the phase in the events and the trace,
+                      default is the name of the method.
         :return: the value returned from the method() argument.
         """
+        phase = phase or method.__name__
         return_value = None
+        t0 = time.time()
+        outputs = len(topic.outputs)
         try:
             return_value = method()
         except NotImplementedError as err:
             if not_implemented_method:
+                self._phase_finished(phase, topic, t0, outputs)
                 if not_implemented_method.__name__ == 'report':
                     topic.just_report = True
                 return self._process(not_implemented_method, topic)
@@ -151,6 +466,10 @@ class HardeningProcessor(object):
         except StopHardeningExecution as err:
             topic.error = str(err)
             self._print_status('FAILED', topic.error)
+        except DeadlineExceeded as err:
+            topic.timed_out = True
+            topic.error = "Cancelled during %s: %s" % (method.__name__, err)
+            self._print_status('TIMEOUT', topic.error)
         except Exception as err:
             ex_type, ex, tb = sys.exc_info()
             self._print_status('ERROR', "%s: %s" % (str(ex_type), str(err)))
@@ -160,39 +479,175 @@ class HardeningProcessor(object):
             outs = '\n\n---------------------------------------\n\n'.join(outs)
             topic.unhandled_error = "TRACEBACK: \n\n%s\n\nOUTPUTS:\n\n%s" % \
                                     (tback, outs)
+        self._phase_finished(phase, topic, t0, outputs)
         return return_value
 
+    def _emit(self, event, **fields):
+        """ Emits an event of this host in the event stream, if any.
+        :param event: str, the name of the event
+        :return: None
+        """
+        if self.events is not None:
+            self.events.emit(event, host=self.description.host, **fields)
+
+    @contextmanager
+    def _span(self, name, category, **args):
+        """ Records the span of the "with" block in the trace, if any.
+        :param name: str
+        :param category: str
+        :return: None
+        """
+        if self.trace is None:
+            yield
+        else:
+            with self.trace.span(name, self.description.host, category,
+                                 **args):
+                yield
+
+    def _phase_finished(self, phase, topic, t0, outputs):
+        """ Emits the commands executed by a phase of a topic and the
+        duration of the phase, and records their spans in the trace.
+        :param phase: str, e.g.: check, report, harden or double_check
+        :param topic: an instance of Topic class from the Hardener object.
+        :param t0: float, the time the phase started
+        :param outputs: int, the length of the output history before it
+        :return: None
+        """
+        if self.events is None and self.trace is None:
+            return
+        duration = time.time() - t0
+        fields = getattr(self._status, 'fields', {})
+        self._emit_commands(topic.outputs[outputs:], fields)
+        self._emit('phase_finished', phase=phase, duration=duration,
+                   **fields)
+        if self.trace is not None:
+            name = "%s %s" % (phase, fields.get('topic', topic))
+            self.trace.add_span(name, self.description.host, 'topic', t0,
+                                duration, **fields)
+
+    def _emit_commands(self, entries, fields):
+        """ Emits the commands of an output history, and records their spans
+        in the trace.
+        :param entries: list of CommandOutput
+        :param fields: dict, the fields of the events and the spans
+        :return: None
+        """
+        batch_started = None
+        for entry in entries:
+            cmd, code, _ = entry
+            self._emit('command', cmd=cmd, code=code,
+                       duration=getattr(entry, 'duration', None),
+                       bytes=getattr(entry, 'nbytes', None),
+                       su=getattr(entry, 'su', None),
+                       cached=getattr(entry, 'cached', False), **fields)
+            if self.trace is None or \
+               getattr(entry, 'started', None) is None:
+                continue
+            if entry.batch > 1:
+                # the commands of a batch are a single span.
+                if entry.started == batch_started:
+                    continue
+                batch_started = entry.started
+                cmd = "%s (batch of %s)" % (cmd, entry.batch)
+            self.trace.add_command(self.description.host, cmd,
+                                   entry.started, entry.duration,
+                                   code=code, **fields)
+
+    def _start_status(self, msg, section=None, topic=None):
+        """ Starts the status line of the topic processed in this thread, it
+        is written along with the status by the _print_status() below.
+        :param msg: str
+        :param section: str, the section of the topic, for the events
+        :param topic: the topic, for the events
+        :return: None
+        """
+        msg = "%s%s" % (self.status_prefix, msg)
+        self._status.msg = msg
+        self._status.len_msg = len(msg)
+        self._status.fields = {}
+        if topic is not None:
+            self._status.fields = {'section': section, 'topic': str(topic)}
+
     def _print_status(self, status, desc=""):
         """ Helper method to print the status.
         :param status: str
         :param desc: str
         :return: None
         """
-        white_space = " " * (70 - self._len_msg)
+        msg = getattr(self._status, 'msg', '')
+        white_space = " " * (70 - getattr(self._status, 'len_msg', 0))
+        self._emit('status', status=status.split(':')[0],
+                   desc=desc or status.partition(': ')[2],
+                   **getattr(self._status, 'fields', {}))
         desc = ": %s" % desc if desc else ""
-        sys.stdout.write('%s%s%s\n' % (white_space, status, desc))
-        sys.stdout.flush()
+        fields = getattr(self._status, 'fields', {})
+        with self.print_lock:
+            if fields:
+                # a topic checked again, e.g.: after the LITP plan, replaces
+                # its previous status.
+                key = (fields['section'], fields['topic'])
+                previous = self._topic_statuses.get(key)
+                if previous is not None:
+                    self.statuses[previous] -= 1
+                self._topic_statuses[key] = status.split(':')[0]
+                self.statuses[status.split(':')[0]] += 1
+            sys.stdout.write('%s%s%s%s\n' % (msg, white_space, status, desc))
+            sys.stdout.flush()
+        self._status.msg = ''
+
+    def _flush_status(self):
+        """ Writes the status line of this thread in case no status was
+        printed for it.
+        :return: None
+        """
+        msg = getattr(self._status, 'msg', '')
+        if msg:
+            with self.print_lock:
+                sys.stdout.write('%s\n' % msg)
+                sys.stdout.flush()
+            self._status.msg = ''
+
+    def get_dependencies(self, hardener_classes):
+        """ Builds the DAG of the hardeners given in the execution order: each
+        hardener depends on the previous ones it conflicts with.
+        :param hardener_classes: list of hardener classes
+        :return: dict, index of a hardener => set of indexes it depends on
+        """
+        depends = {}
+        for index, hardener_class in enumerate(hardener_classes):
+            depends[index] = set([i for i, h in
+                                  enumerate(hardener_classes[:index])
+                                  if hardener_class.conflicts_with(h)])
+        return depends
 
     def _get_hardener_topics(self):
-        """ Returns a list of Hardener instances.
+        """ Returns a list of tuples of ("<module>.<topic>", hardener class),
+        the modules of the hardeners package are imported only once.
         :return: list
         """
         base_path = 'node_hardening.hardening.%s' % self.hardener_name
-        package = import_module(base_path)
-        hardeners = []
-        for importer, name, is_pkg in pkgutil.iter_modules(package.__path__):
-            if is_pkg:
-                continue
-            mod = import_module("%s.%s" % (base_path, name))
-            for item_name, item in inspect.getmembers(mod):
-                if not inspect.isclass(item):
-                    continue
-                if not issubclass(item, BaseHardening):
-                    continue
-                if item.section and item.topic:
-                    hardeners.append(("%s.%s" % (name, item.topic), item))
-        return hardeners
+        if base_path not in self._loaded_packages:
+            package = import_module(base_path)
+            for importer, name, is_pkg in pkgutil.iter_modules(
+                    package.__path__):
+                if not is_pkg:
+                    import_module("%s.%s" % (base_path, name))
+            self._loaded_packages.add(base_path)
+        return HardenerRegistry.hardeners(base_path)
 
     def get_hardener_topic(self, name):
-        hardener_topics = dict(self._get_hardener_topics())
-        return hardener_topics[name]
+        """ Returns the hardener class of the topic name, importing only its
+        module. A KeyError is raised in case there's no such module or topic,
+        the errors importing the module are raised as they are.
+        :param name: str, "<module>.<topic>", e.g.: "logincontrol.password_age"
+        :return: hardener class
+        """
+        base_path = 'node_hardening.hardening.%s' % self.hardener_name
+        module_name = name.rpartition('.')[0]
+        package = import_module(base_path)
+        modules = [n for _, n, is_pkg in pkgutil.iter_modules(package.__path__)
+                   if not is_pkg]
+        if module_name not in modules:
+            raise KeyError(name)
+        import_module("%s.%s" % (base_path, module_name))
+        return dict(HardenerRegistry.hardeners(base_path))[name]
@@ -1,8 +1,13 @@
+import base64
 import re
+import threading
 import time
+import uuid
 
 from node_hardening.section import NullExpectedValue, CommandExecutionException
-from node_hardening.utils import camelcase_to_underscore
+from node_hardening.utils import camelcase_to_underscore, resources_overlap, \
+    sleep
+from node_hardening.facts import HostFacts
 from node_hardening.parsers import LitpModelItemOutputParser, LitpPlanOutputParser
 
 
@@ -13,21 +18,96 @@ class StopHardeningExecution(Exception):
     """
 
 
+class CommandOutput(tuple):
+    """ An entry of the output history of a topic. It's just a tuple of
+    (cmd, code, output), so it can be unpacked as usual, that also carries
+    whether the output was taken from the CommandCache or not, and the
+    timing of the execution: the epoch time it started, the wall time and
+    the time to first byte in seconds (None when unknown), the bytes
+    received and whether it ran through su. The commands shipped in a single
+    script by run_many() share the timing of the script, the batch is the
+    number of its commands.
+    >>> out = CommandOutput('ls', 0, 'file', cached=True)
+    >>> cmd, code, output = out
+    >>> out == ('ls', 0, 'file'), out.cached
+    (True, True)
+    >>> CommandOutput('ls', 0, 'file', duration=3.0, batch=3).share
+    1.0
+    """
+
+    def __new__(cls, cmd, code, output, cached=False, duration=None,
+                ttfb=None, nbytes=0, su=False, batch=1, started=None):
+        obj = super(CommandOutput, cls).__new__(cls, (cmd, code, output))
+        obj.cached = cached
+        obj.started = started
+        obj.duration = duration
+        obj.ttfb = ttfb
+        obj.nbytes = nbytes
+        obj.su = su
+        obj.batch = batch
+        return obj
+
+    @property
+    def share(self):
+        """ Returns the wall time of this command in seconds, the one of a
+        script is split evenly between its commands.
+        """
+        return (self.duration or 0.0) / self.batch
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+
+class CommandCache(object):
+    """ This is a run-scoped cache of the read-only commands executed on a
+    host, keyed on the command string. It must be cleared every time a
+    harden step runs, since the host state may change.
+    """
+
+    def __init__(self, cache_all=False):
+        """ With cache_all, every command is taken as read-only by the
+        runners using this cache, e.g. when the host is never changed.
+        """
+        self.cache_all = cache_all
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def get(self, cmd):
+        """ Returns the tuple (code, output) of the cmd or None.
+        """
+        with self._lock:
+            return self._results.get(cmd)
+
+    def set(self, cmd, code, output):
+        with self._lock:
+            self._results[cmd] = (code, output)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
 class SshRunner(object):
     """ This class just the ssh runner for each topic, that also includes the
     history of outputs coming from the ssh executions. This "outputs" list
     history will be used later on in the ReportBuilder.
     """
 
-    def __init__(self, ssh, outputs, su_password=None):
+    password_warning = 'Warning: your password will expire in '
+    password_prompt_regex = re.compile(r'\s*Password: ')
+
+    def __init__(self, ssh, outputs, su_password=None, cache=None):
         """ It requires the ssh instance of SshScpClient and the outputs list.
+        The cache is an optional CommandCache instance shared by the runners
+        of the same host.
         """
         self._ssh = ssh
         self._su_password = su_password
         self.outputs = outputs
+        self.cache = cache
 
     def run(self, cmd, silent_fail_if=None, populate_output=True,
-            expects=None):
+            expects=None, cacheable=False):
         """ This method executes a command and returns the output. In case
         of failure (status code != 0), it raises the CommandExecutionException.
 
@@ -38,27 +118,179 @@ class SshRunner(object):
         shell prompts an expected input. So each string of the list will be
         input after the command execution.
 
+        The cacheable argument flags the cmd as read-only, so its output may
+        be taken from the cache in case the same cmd was already executed and
+        no harden step ran since then.
+
         :param cmd: str
         :param silent_fail_if: list of status codes to not raise exception
         :param populate_output: bool, to populate the output history
         :param expects: list of inputs in case the shell prompts
+        :param cacheable: bool, whether the cmd is read-only
         :return: str, the output coming from the execution of the cmd
         """
+        cacheable = self.cache is not None and not expects and \
+                    (cacheable or self.cache.cache_all)
+        if cacheable:
+            result = self.cache.get(cmd)
+            if result is not None:
+                code, out = result
+                return self.handle_output(cmd, code, out, silent_fail_if,
+                                          populate_output, cached=True)
         self._ssh.connect()
-        code, out, err = self._ssh.run(cmd, su=self._su_password,
-                                       expects=expects)
+        t0 = time.time()
+        result = self._ssh.run(cmd, su=self._su_password, expects=expects)
+        timing = self._timing(result, t0, time.time() - t0)
+        code, out, err = result
         out = out + err
+        if cacheable:
+            self.cache.set(cmd, code, out)
+        return self.handle_output(cmd, code, out, silent_fail_if,
+                                  populate_output, timing=timing)
+
+    def run_many(self, cmds, silent_fail_if=None, populate_output=True):
+        """ This method executes a list of commands shipped as a single
+        remote script over one channel, and returns the list of outputs. The
+        combined output is split back per command, so the output history
+        looks the same as running each command with the run() method above.
+
+        The script stops at the first command that fails (status code != 0
+        and not in silent_fail_if), and the CommandExecutionException is
+        raised for that command.
+
+        :param cmds: list of str
+        :param silent_fail_if: list of status codes to not raise exception
+        :param populate_output: bool, to populate the output history
+        :return: list of str, the outputs of each cmd
+        """
+        silent_fail_if = silent_fail_if or []
+        code, results, timing = self._execute_script(cmds, silent_fail_if)
+        timing['batch'] = len(results) or 1
+        outputs = []
+        for cmd, (cmd_code, out) in zip(cmds, results):
+            # the bytes are the ones of each command output.
+            timing['nbytes'] = len(out)
+            outputs.append(self.handle_output(cmd, cmd_code, out,
+                                              silent_fail_if,
+                                              populate_output,
+                                              timing=dict(timing)))
+        if len(results) < len(cmds):
+            # the script was interrupted before reaching this cmd
+            cmd = cmds[len(results)]
+            msg = "cmd: %s, status code: %s" % (cmd, code)
+            raise CommandExecutionException(msg, "", code)
+        return outputs
+
+    def execute_many(self, cmds, silent_fail_if=None, stop_on_failure=True):
+        """ This method ships the list of commands as a single remote script
+        and splits the combined output back per command. It doesn't populate
+        the output history and doesn't raise CommandExecutionException.
+
+        :param cmds: list of str
+        :param silent_fail_if: list of status codes to not stop the script
+        :param stop_on_failure: bool, whether the script stops at the first
+                                command that fails or not.
+        :return: tuple of (status code of the script, list of tuples of
+                 (status code, output) of the commands executed).
+        """
+        code, results, _ = self._execute_script(cmds, silent_fail_if,
+                                                stop_on_failure)
+        return code, results
+
+    def _execute_script(self, cmds, silent_fail_if=None,
+                        stop_on_failure=True):
+        """ Does the execute_many() above, and also returns the timing of
+        the script as a third item, see _timing().
+        """
+        if not cmds:
+            return 0, [], {}
+        silent_fail_if = silent_fail_if or []
+        token = uuid.uuid4().hex
+        marker = re.compile(r'\r?\n__NH_CMD_%s (\d+)(?:\r?\n|\Z)' % token)
+        allowed = '|'.join([str(c) for c in [0] + silent_fail_if])
+        lines = []
+        for cmd in cmds:
+            # the stdin of each cmd is /dev/null, so it can't read the rest
+            # of the script coming from the pipe below.
+            lines.append("{\n%s\n} </dev/null 2>&1" % cmd)
+            lines.append("__nh_rc=$?")
+            lines.append("printf '\\n%%s%%s %%d\\n' __NH_CMD_ %s $__nh_rc" %
+                         token)
+            if stop_on_failure:
+                lines.append("case $__nh_rc in %s) ;; *) exit $__nh_rc;; "
+                             "esac" % allowed)
+        script = base64.b64encode('\n'.join(lines) + '\n')
+        self._ssh.connect()
+        t0 = time.time()
+        result = self._ssh.run("echo %s | base64 -d | /bin/sh" % script,
+                               su=self._su_password)
+        timing = self._timing(result, t0, time.time() - t0)
+        code, out, err = result
+        parts = marker.split(out + err)
+        results = [(int(parts[i + 1]), parts[i])
+                   for i in range(0, len(parts) - 1, 2)]
+        return code, results[:len(cmds)], timing
+
+    def run_concurrently(self, cmds, silent_fail_if=None,
+                         populate_output=True):
+        """ This method executes a list of read-only commands concurrently,
+        each one in its own channel of the same SSH transport, and returns
+        the list of outputs in the same order of the cmds. The output history
+        is populated in that order as well.
+
+        :param cmds: list of str
+        :param silent_fail_if: list of status codes to not raise exception
+        :param populate_output: bool, to populate the output history
+        :return: list of str, the outputs of each cmd
+        """
+        self._ssh.connect()
+        results = self._ssh.run_concurrently(cmds, su=self._su_password)
+        outputs = []
+        for cmd, result in zip(cmds, results):
+            code, out, err = result
+            outputs.append(self.handle_output(cmd, code, out + err,
+                                              silent_fail_if,
+                                              populate_output,
+                                              timing=self._timing(result)))
+        return outputs
+
+    def _timing(self, result, started=None, duration=None):
+        """ Returns the timing of a command as a dict of CommandOutput
+        arguments, from the result of the ssh client and the start and wall
+        time measured by the caller, in case the client doesn't provide them.
+        """
+        _, out, err = result
+        return {'started': getattr(result, 'started', None) or started,
+                'duration': getattr(result, 'duration', None) or duration,
+                'ttfb': getattr(result, 'ttfb', None),
+                'nbytes': len(out) + len(err),
+                'su': bool(self._su_password)}
+
+    def handle_output(self, cmd, code, out, silent_fail_if=None,
+                      populate_output=True, cached=False, timing=None):
+        """ Populates the output history, raises the CommandExecutionException
+        in case of failure, and cleans up the output. The timing is a dict of
+        the CommandOutput timing arguments.
+        """
         silent_fail_if = silent_fail_if or []
         if populate_output:
-            self.outputs.append((cmd, code, out))
+            self.outputs.append(CommandOutput(cmd, code, out, cached,
+                                              **(timing or {})))
         if code != 0 and code not in silent_fail_if:
             msg = "cmd: %s, status code: %s, output: %s" % (cmd, code, out)
             raise CommandExecutionException(msg, out, code)
+        # normalizes the line breaks, the same as '\n'.join(splitlines())
+        # without building the list of lines for big outputs.
+        if '\r' in out:
+            out = out.replace('\r\n', '\n').replace('\r', '\n')
+        if out.endswith('\n'):
+            out = out[:-1]
         # takes password warning messages out from the output.
-        out = '\n'.join([l for l in out.splitlines()
-               if not l.startswith('Warning: your password will expire in ')])
-        if out.strip().startswith('Password: '):
-            out = '\n'.join(out.splitlines()[1:])
+        if self.password_warning in out:
+            out = '\n'.join([l for l in out.split('\n')
+                             if not l.startswith(self.password_warning)])
+        if self.password_prompt_regex.match(out):
+            out = out.split('\n', 1)[1] if '\n' in out else ''
         return out
 
     def read_file(self, path):
@@ -69,8 +301,9 @@ class SshRunner(object):
     def write_file(self, path, content):
         """ Writes a content in a remote file given a path.
         """
-        for line in content.splitlines():
-            self.run("echo %s >> %s".format(line, path), populate_output=False)
+        self.run_many(["echo %s >> %s" % (line, path)
+                       for line in content.splitlines()],
+                      populate_output=False)
 
     def insert_line_in_file(self, path, line, regex, after=True):
         """ Inserts a line in a file after or before a specific line defined on
@@ -110,13 +343,51 @@ def wait(func):
     return wait
 
 
+class PlanCoalescer(object):
+    """ This class collects the LITP plans deferred by the hardeners during a
+    run, so their model changes are applied by a single plan at the end of
+    it instead of a plan per hardener.
+    """
+
+    def __init__(self):
+        self.deferred = 0
+        self.sec_increment = 20
+        self._lock = threading.Lock()
+
+    def defer(self, sec_increment=20):
+        """ Defers a plan to the end of the run.
+        """
+        with self._lock:
+            self.deferred += 1
+            self.sec_increment = max(self.sec_increment, sec_increment)
+
+    def run_plan(self, litp):
+        """ Creates and runs the single plan of all the deferred ones, and
+        waits for it.
+        :param litp: LitpHelper, without a coalescer
+        :return: str, the plan status or None in case no plan was deferred
+        """
+        with self._lock:
+            deferred, self.deferred = self.deferred, 0
+        if not deferred:
+            return None
+        litp.create_plan()
+        litp.run_plan()
+        return litp.wait_plan(sec_increment=self.sec_increment)
+
+
 class LitpHelper(object):
 
     plan_not_exists_regex = re.compile(r'.*InvalidLocationError\s+Plan\s+does'
                                        r'\s+not\s+exist.*')
 
-    def __init__(self, ssh_runner):
+    def __init__(self, ssh_runner, coalescer=None):
+        """ In case a PlanCoalescer is given, the plans of the model changes
+        are deferred to it by the apply_changes() below.
+        """
         self.ssh = ssh_runner
+        self.coalescer = coalescer
+        self.plan_deferred = False
 
     def get_clusters(self):
         base = '/deployments/d1/clusters'
@@ -132,6 +403,27 @@ class LitpHelper(object):
         parser = LitpModelItemOutputParser(out)
         return parser.parse()
 
+    def get_model_items(self, paths):
+        """ Gets many model items at once, the "litp show" commands are
+        executed concurrently.
+        """
+        outs = self.ssh.run_concurrently(["/usr/bin/litp show -p %s" % path
+                                          for path in paths])
+        return [LitpModelItemOutputParser(out).parse() for out in outs]
+
+    def get_nodes(self):
+        """ Gets the model items of the nodes of all the clusters of all the
+        deployments. The items of each level are read concurrently.
+        """
+        def children(paths, suffix=''):
+            items = self.get_model_items(paths)
+            return ["%s%s%s" % (path, child, suffix)
+                    for path, item in zip(paths, items)
+                    for child in item.get('children', [])]
+        clusters = children(['/deployments'], '/clusters')
+        nodes = children(children(clusters, '/nodes'))
+        return self.get_model_items(nodes)
+
     def get_model_items_by_type(self, path, item_type):
         out = self.ssh.run("/usr/bin/litp show -r -p %s" % path)
         items = out.split("\n\n")
@@ -183,11 +475,28 @@ class LitpHelper(object):
     def run_plan(self):
         self.ssh.run("/usr/bin/litp run_plan")
 
+    def apply_changes(self, sec_increment=20):
+        """ Creates and runs a plan to apply the model changes and waits for
+        it. In case of a coalescer, the plan is deferred to the end of the run
+        instead, along with the ones of the other hardeners.
+        :return: str, the plan status or None in case it's deferred
+        """
+        if self.coalescer is not None:
+            self.coalescer.defer(sec_increment)
+            self.plan_deferred = True
+            return None
+        self.create_plan()
+        self.run_plan()
+        return self.wait_plan(sec_increment=sec_increment)
+
     def wait_plan(self, timeout=1800, sec_increment=20):
+        """ Waits for the plan up to the timeout, or up to the closest
+        deadline in effect in case it comes first.
+        """
         seconds_count = sec_increment
         finished_statuses = ["Failed", "Successful"]
         while True:
-            time.sleep(sec_increment)
+            sleep(sec_increment)
             plan = self.get_plan()
             status = plan['status']
             seconds_count += sec_increment
@@ -197,16 +506,93 @@ class LitpHelper(object):
                 raise StopHardeningExecution("LITP run plan timeout reached.")
 
 
+def _writes_to(writes, resources):
+    """ Checks whether the writes touch any of the resources, where None
+    means all of them.
+    """
+    if writes is None:
+        return resources is None or bool(resources)
+    if resources is None:
+        return bool(writes)
+    return any(resources_overlap(w, r) for w in writes for r in resources)
+
+
+class HardenerRegistry(type):
+    """ This metaclass registers every hardener class defining both the
+    section and the topic by (section, topic), in the registry of the package
+    of its module, e.g.: "node_hardening.hardening.litp". So the hardeners are
+    found once their modules are imported, without scanning them. Only the
+    modules of the hardeners packages are registered, and a TypeError is
+    raised in case two hardeners of a package have the same topic.
+    """
+
+    registry = {}
+    packages_prefix = 'node_hardening.hardening.'
+
+    def __init__(cls, name, bases, attrs):
+        super(HardenerRegistry, cls).__init__(name, bases, attrs)
+        package = cls.__module__.rpartition('.')[0]
+        if not (cls.section and cls.topic) or \
+           not package.startswith(cls.packages_prefix):
+            return
+        hardeners = cls.registry.setdefault(package, {})
+        key = (cls.section, cls.topic)
+        other = hardeners.get(key)
+        # the same class is registered again when its module is reloaded.
+        if other is not None and (other.__module__, other.__name__) != \
+                (cls.__module__, cls.__name__):
+            raise TypeError("The hardeners %s.%s and %s.%s have the same "
+                            "topic %s.%s" % ((other.__module__, other.__name__,
+                                              cls.__module__, name) + key))
+        hardeners[key] = cls
+
+    @classmethod
+    def hardeners(mcs, package):
+        """ Returns the hardeners registered in the package, in the order of
+        their module and class names, as a list of tuples of
+        ("<module>.<topic>", hardener class).
+        """
+        hardeners = mcs.registry.get(package, {}).values()
+        hardeners.sort(key=lambda h: (h.__module__, h.__name__))
+        return [("%s.%s" % (h.__module__.rpartition('.')[2], h.topic), h)
+                for h in hardeners]
+
+
 class BaseHardening(object):
+    __metaclass__ = HardenerRegistry
     section = None
     topic = None
+    # the resources the hardener reads in the check and the ones changed by
+    # the harden step, e.g.: "file:/etc/issue", "service:sshd", "packages",
+    # "litp:plan". A name ending with ":" or "/" covers all the names
+    # starting with it, and None means all the resources.
+    reads = None
+    writes = None
+
+    @classmethod
+    def conflicts_with(cls, other):
+        """ Checks whether this hardener and the other one can't run at the
+        same time, since one of them writes what the other reads or writes.
+        """
+        return _writes_to(cls.writes, cls._touches(other)) or \
+               _writes_to(other.writes, cls._touches(cls))
+
+    @staticmethod
+    def _touches(hardener):
+        if hardener.reads is None or hardener.writes is None:
+            return None
+        return tuple(hardener.reads) + tuple(hardener.writes)
 
-    def __init__(self, description, ssh, su_password=None):
+    def __init__(self, description, ssh, su_password=None, cache=None,
+                 facts=None, plan_coalescer=None):
         section = getattr(description, camelcase_to_underscore(self.section))
         self.topic = getattr(section, self.topic)
-        self.ssh = SshRunner(ssh, self.topic.outputs, su_password)
+        self.ssh = SshRunner(ssh, self.topic.outputs, su_password, cache)
         self.description = description
-        self.litp = LitpHelper(self.ssh)
+        self.litp = LitpHelper(self.ssh, plan_coalescer)
+        if facts is None:
+            facts = HostFacts(SshRunner(ssh, [], su_password, cache))
+        self.facts = facts.reader(self.ssh)
 
     def check(self):
         raise NotImplementedError
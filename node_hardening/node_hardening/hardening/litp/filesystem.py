@@ -7,6 +7,8 @@ class FileSystem(BaseHardening):
 
 class AutoMountEnabled(FileSystem):
     topic = 'auto_mount_enabled'
+    reads = ('service:autofs',)
+    writes = ('service:autofs', 'ports', 'processes')
 
     def check(self):
         try:
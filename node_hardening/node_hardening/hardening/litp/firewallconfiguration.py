@@ -4,11 +4,12 @@ from node_hardening.parsers import PropertiesOutputParser
 
 class FirewallConfiguration(BaseHardening):
     section = 'FirewallConfiguration'
+    reads = ('packages', 'litp:model')
+    writes = ()
 
     def _is_plugin_installed(self):
         is_installed = False
-        out = self.ssh.run('rpm -qa | grep firewall', silent_fail_if=[1])
-        for line in out.splitlines():
+        for line in self.facts.get('packages').splitlines():
             if line.startswith("ERIClitplinuxfirewall"):
                 is_installed = True
                 break
@@ -39,6 +40,8 @@ class PluginEnabled(FirewallConfiguration):
 
 class TftpPortDisabled(FirewallConfiguration):
     topic = 'tftp_port_disabled'
+    reads = ('litp:model', 'litp:plan')
+    writes = ('litp:model', 'litp:plan', 'firewall')
 
     def is_tftp_rule_applied(self, path):
         cluster_firewalls = self.litp.get_model_items_by_type(path,
@@ -89,9 +92,7 @@ class TftpPortDisabled(FirewallConfiguration):
                                   name="\"015 tftp\"", dport="69")
 
         if not cluster_tftp or not ms_tftp:
-            self.litp.create_plan()
-            self.litp.run_plan()
-            status = self.litp.wait_plan()
+            status = self.litp.apply_changes()
             if status == 'Failed':
                 raise StopHardeningExecution("Configure tftp firewall "
                                              "plan failed")
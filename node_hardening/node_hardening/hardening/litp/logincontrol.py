@@ -5,10 +5,10 @@ from node_hardening.parsers import RealUsersParser, PropertiesOutputParser
 
 class LoginControl(BaseHardening):
     section = 'LoginControl'
+    reads = ('file:/etc/passwd', 'file:/etc/shadow')
 
     def _get_users(self):
-        cmd = "cat /etc/passwd"
-        passwd = self.ssh.run(cmd)
+        passwd = self.facts.get('passwd')
         parser = RealUsersParser(passwd)
         return parser.parse() + ['root']
 
@@ -17,9 +17,8 @@ class LoginControl(BaseHardening):
         all_users = self._get_users()
         # Check what is the current MAX password age for each user
         users = []
-        for user in all_users:
-            cmd = 'chage -l {0}'.format(user)
-            out = self.ssh.run(cmd)
+        cmds = ['chage -l {0}'.format(user) for user in all_users]
+        for user, out in zip(all_users, self.ssh.run_many(cmds)):
             parser = PropertiesOutputParser(out)
             data = parser.parse()
             max_age = data['Maximum number of days between password change']
@@ -30,6 +29,7 @@ class LoginControl(BaseHardening):
 
 class PasswordAge(LoginControl):
     topic = 'password_age'
+    writes = ('file:/etc/shadow',)
 
     def check(self):
         users_ages = self._get_users_to_change()
@@ -39,21 +39,20 @@ class PasswordAge(LoginControl):
             return self.expected_value
 
     def harden(self):
-        report = []
         expected_password_age = self.expected_value
-        for user, _ in self._get_users_to_change():
-            # We are updating the last password change to current day
-            # This is OK for the automatic scan but it SHOULD NOT be done
-            # for the real hardening product.
-            cmd = 'chage -d $(date +%Y-%m-%d) -M {0} {1}'.format(
-                expected_password_age, user)
-            self.ssh.run(cmd)
-            report.append(user)
+        report = [user for user, _ in self._get_users_to_change()]
+        # We are updating the last password change to current day
+        # This is OK for the automatic scan but it SHOULD NOT be done
+        # for the real hardening product.
+        self.ssh.run_many(['chage -d $(date +%Y-%m-%d) -M {0} {1}'.format(
+            expected_password_age, user) for user in report])
         return "Changed users: %s." % ', '.join(report)
 
 
 class IdleTimeout(LoginControl):
     topic = 'idle_timeout'
+    reads = ('file:/etc/profile.d/os-security.sh',)
+    writes = ('file:/etc/profile.d/os-security.sh', 'file-modes')
 
     def check(self):
         filename = "/etc/profile.d/os-security.sh"
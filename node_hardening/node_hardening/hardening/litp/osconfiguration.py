@@ -7,10 +7,12 @@ from node_hardening.report import Table
 
 class OsConfiguration(BaseHardening):
     section = 'OsConfiguration'
+    writes = ()
 
 
 class Processes(OsConfiguration):
     topic = 'processes'
+    reads = ('processes',)
 
     def report(self):
         """ Report the running processes and memory usage.
@@ -25,6 +27,7 @@ class Processes(OsConfiguration):
 
 class RunningServices(OsConfiguration):
     topic = 'running_services'
+    reads = ('service:',)
 
     def report(self):
         """ Report the current services status in the system.
@@ -43,12 +46,12 @@ class RunningServices(OsConfiguration):
 
 class KnownServices(OsConfiguration):
     topic = 'known_services'
+    reads = ('service:',)
 
     def report(self):
         """ Report the know services in the system.
         """
-        cmd = '/sbin/chkconfig --list'
-        out = self.ssh.run(cmd)
+        out = self.facts.get('chkconfig')
         splited = out.split('\n\n')
         if len(splited) == 1:
             out1, out2 = splited[0], ""
@@ -66,12 +69,12 @@ class KnownServices(OsConfiguration):
 
 class ServicesPorts(OsConfiguration):
     topic = 'services_ports'
+    reads = ('ports',)
 
     def report(self):
         """ Report the running services and ports used.
         """
-        cmd = '/bin/netstat -tulpn'
-        out = self.ssh.run(cmd)
+        out = self.facts.get('netstat')
         parser = NetstatTulpnOutputParser(out.strip())
         reports = [Table(t, d, True) for t, d in parser.parse().items()]
         return reports
@@ -79,6 +82,7 @@ class ServicesPorts(OsConfiguration):
 
 class XWindowsUsed(OsConfiguration):
     topic = 'x_windows_used'
+    reads = ('processes',)
 
     def check(self):
         """ Check whether X-Windows is in use or not.
@@ -92,6 +96,9 @@ class XWindowsUsed(OsConfiguration):
 
 class SystemCronJobs(OsConfiguration):
     topic = 'system_cron_jobs'
+    reads = ('file:/etc/cron.d/', 'file:/etc/cron.daily/',
+             'file:/etc/cron.hourly/', 'file:/etc/cron.monthly/',
+             'file:/etc/cron.weekly/')
 
     def report(self):
         out = self.ssh.run('/bin/ls /etc/cron.*/*')
@@ -100,6 +107,7 @@ class SystemCronJobs(OsConfiguration):
 
 class CronJobsPerUser(OsConfiguration):
     topic = 'cron_jobs_per_user'
+    reads = ('file:/etc/passwd', 'file:/var/spool/cron/')
 
     def report(self):
         cmd = 'for user in $(cut -f1 -d: /etc/passwd); do echo __$user; ' \
@@ -111,6 +119,7 @@ class CronJobsPerUser(OsConfiguration):
 
 class SuidFiles(OsConfiguration):
     topic = 'suid_files'
+    reads = ('file-modes',)
 
     def report(self):
         report = dict()
@@ -152,6 +161,7 @@ class SuidFiles(OsConfiguration):
 
 class SgidFiles(OsConfiguration):
     topic = 'sgid_files'
+    reads = ('file-modes',)
 
     def report(self):
         report = dict()
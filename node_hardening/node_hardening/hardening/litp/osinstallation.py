@@ -4,19 +4,22 @@ from node_hardening.parsers import PropertiesOutputParser
 
 class OsInstallation(BaseHardening):
     section = 'OsInstallation'
+    reads = ('selinux',)
 
     def get_selinux_properties(self):
-        out = self.ssh.run('/usr/sbin/sestatus')
+        out = self.facts.get('sestatus')
         parser = PropertiesOutputParser(out)
         return parser.parse()
 
 
 class Packages(OsInstallation):
     topic = 'packages'
+    reads = ('packages',)
+    writes = ()
 
     def report(self):
         # 1 and 2. check un/necessary packages
-        out = self.ssh.run('/bin/rpm -qa')
+        out = self.facts.get('packages')
         #existing_packages = set(out.splitlines())
         #expected_packages = set(expected_value)
         #missing_packages = expected_packages - existing_packages
@@ -38,24 +41,26 @@ class Packages(OsInstallation):
 
 class UnwantedPackages(OsInstallation):
     topic = 'unwanted_packages'
+    reads = ('litp:model',)
+    # the plan removes the packages of the services, and with them their
+    # processes, ports and files.
+    writes = ('litp:model', 'litp:plan', 'packages', 'service:', 'ports',
+              'processes', 'file-modes')
 
     def _get_cluster_services(self):
-        services = []
+        paths = []
         for cluster in self.litp.get_clusters():
             servs = self.litp.get_model_item("%s/%s" % (cluster['vpath'],
                                                        'services'))
             for service in servs.get('children', []):
-                path = "%s/services/%s/applications" % (cluster['vpath'],
-                                                        service.strip('/'))
-                apps = self.litp.get_model_item(path)
-                services.append((path, map(lambda x: x.strip('/'),
-                                           apps.get('children', []))))
-                path = "%s/services/%s/runtimes" % (cluster['vpath'],
-                                                    service.strip('/'))
-                runts = self.litp.get_model_item(path)
-                services.append((path, map(lambda x: x.strip('/'),
-                                            runts.get('children', []))))
-        return services
+                paths.append("%s/services/%s/applications" % (
+                    cluster['vpath'], service.strip('/')))
+                paths.append("%s/services/%s/runtimes" % (
+                    cluster['vpath'], service.strip('/')))
+        # the applications and runtimes items are read concurrently
+        items = self.litp.get_model_items(paths)
+        return [(path, map(lambda x: x.strip('/'), item.get('children', [])))
+                for path, item in zip(paths, items)]
 
     def check(self):
         services = set(reduce(lambda a, b: a + b,
@@ -71,15 +76,15 @@ class UnwantedPackages(OsInstallation):
                     for_removal.append(item)
                     path_to_remove = '/'.join(path.split('/')[:-1])
                     self.litp.remove_item(path_to_remove)
-        self.litp.create_plan()
-        self.litp.run_plan()
-        self.litp.wait_plan(sec_increment=30)
+        self.litp.apply_changes(sec_increment=30)
         return "The following services/packages were removed successfully: " \
                "%s" % ', '.join(for_removal)
 
 
 class SeLinuxEnabled(OsInstallation):
     topic = 'selinux_enabled'
+    # enabling or disabling selinux is not implemented.
+    writes = ()
 
     def check(self):
         status = self.get_selinux_properties().get('SELinux status')
@@ -97,6 +102,7 @@ class SeLinuxEnabled(OsInstallation):
 
 class SeLinuxEnforced(OsInstallation):
     topic = 'selinux_enforced'
+    writes = ('selinux',)
 
     def check(self):
         mode = self.get_selinux_properties().get('Current mode')
@@ -8,6 +8,8 @@ class PasswordEncryption(BaseHardening):
 
 class GrubPasswordEncrypted(PasswordEncryption):
     topic = 'grub_password_encrypted'
+    reads = ('file:/boot/grub/grub.conf',)
+    writes = ('file:/boot/grub/grub.conf',)
 
     timeout_regex_str = 'timeout=[0-9]+'
     password_line_regex_str = r'password \-\-md5 .*'
@@ -16,7 +18,7 @@ class GrubPasswordEncrypted(PasswordEncryption):
 
     def check(self):
         is_encrypted = False
-        for line in self.ssh.read_file(self.grub_conf).splitlines():
+        for line in self.facts.get('grub_conf').splitlines():
             if self.password_line_regex.match(line.strip()):
                 is_encrypted = True
                 break
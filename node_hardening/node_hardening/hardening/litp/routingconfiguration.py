@@ -17,9 +17,10 @@ class SourceRoutingDisabled(RoutingConfiguration):
         "net.ipv4.conf.all.secure_redirects",
         "net.ipv4.conf.all.send_redirects"
     ]
+    reads = writes = tuple(['sysctl:%s' % p for p in sysctl_params])
 
     def check(self):
-        out = self.ssh.run("/sbin/sysctl -a")
+        out = self.facts.get('sysctl')
         values = []
         for line in out.splitlines():
             for param in self.sysctl_params:
@@ -9,12 +9,14 @@ class SecuringServices(BaseHardening):
 
 class MaxLogins(SecuringServices):
     topic = 'max_logins'
+    reads = ('file:/etc/security/limits.conf',)
+    writes = ('file:/etc/security/limits.conf',)
 
     max_logins_regex = re.compile(r'^\s*\*\s+\-\s+maxlogins\s+(\d+).*')
     limits_conf = "/etc/security/limits.conf"
 
     def check(self):
-        out = self.ssh.run("/bin/cat %s" % self.limits_conf)
+        out = self.facts.get('limits_conf')
         current_max_logins = 0
         for line in out.splitlines():
             match = self.max_logins_regex.match(line)
@@ -30,12 +32,10 @@ class MaxLogins(SecuringServices):
         try:
             cmd = "/bin/grep -i maxlogins %s" % limits_conf
             out = self.ssh.run(cmd)
-            for line in out.splitlines():
-                if line.startswith('#'):
-                    continue
-                # delete any previous settings if they exist
-                cmd = "/bin/sed -i '/%s/d' %s" % (line, limits_conf)
-                out = self.ssh.run(cmd)
+            # delete any previous settings if they exist
+            self.ssh.run_many(["/bin/sed -i '/%s/d' %s" % (line, limits_conf)
+                               for line in out.splitlines()
+                               if not line.startswith('#')])
         except CommandExecutionException as error:
             if error.status_code == 1:
                 report['Not found'] = "No previous settings found"
@@ -47,6 +47,9 @@ class MaxLogins(SecuringServices):
 
 class TelnetClientInstalled(SecuringServices):
     topic = 'telnet_client_installed'
+    reads = ('packages',)
+    # the telnet client has no service, port or setuid file.
+    writes = ('packages',)
     package = 'telnet'
 
     def check(self):
@@ -74,16 +77,25 @@ class TelnetClientInstalled(SecuringServices):
 
 class TelnetServerInstalled(TelnetClientInstalled):
     topic = 'telnet_server_installed'
+    # the telnet server is run by xinetd, its removal closes the port 23.
+    writes = ('packages', 'service:xinetd', 'ports', 'processes',
+              'file:/etc/xinetd.d/')
     package = 'telnet-server'
 
 
 class FtpInstalled(TelnetClientInstalled):
     topic = 'ftp_installed'
+    # removing vsftpd stops the service and closes its ports, and removes
+    # its configuration files.
+    writes = ('packages', 'service:vsftpd', 'ports', 'processes',
+              'file:/etc/vsftpd/', 'file:/etc/pam.d/vsftpd')
     package = 'vsftpd'
 
 
 class PortsNotInUse(SecuringServices):
     topic = 'ports_not_in_use'
+    reads = ('ports',)
+    writes = ('ports', 'processes')
 
     def __init__(self, *args, **kwargs):
         super(PortsNotInUse, self).__init__(*args, **kwargs)
@@ -92,7 +104,7 @@ class PortsNotInUse(SecuringServices):
     def _is_in_use(self, port):
         port = int(port)
         if self._netstat_data_cache is None:
-            out = self.ssh.run('/bin/netstat -tulpn')
+            out = self.facts.get('netstat')
             parser = NetstatTulpnOutputParser(out.strip())
             self._netstat_data_cache = parser.parse()
         data = self._netstat_data_cache
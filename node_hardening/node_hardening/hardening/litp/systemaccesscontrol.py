@@ -1,5 +1,4 @@
 import re
-import sys
 
 from node_hardening.hardening.base import BaseHardening, CommandExecutionException, StopHardeningExecution
 
@@ -15,9 +14,13 @@ class AccountLocking(SystemAccessControl):
     regex2 = re.compile(r'\s*auth\s+\[default=die\]\s+pam_faillock\.so\s+'
                        r'authfail\s+audit\s+deny=(\d+)\s+unlock_time=(\d+)\s*')
     pam_files = ["/etc/pam.d/system-auth", "/etc/pam.d/password-auth"]
+    pam_facts = {"/etc/pam.d/system-auth": 'system_auth',
+                 "/etc/pam.d/password-auth": 'password_auth'}
+    reads = ('file:/etc/pam.d/system-auth', 'file:/etc/pam.d/password-auth')
+    writes = reads
 
     def _get_deny_unlock_time(self, pam_file):
-        content = self.ssh.run('cat %s' % pam_file)
+        content = self.facts.get(self.pam_facts[pam_file])
         match1 = match2 = None
         for line in content.splitlines():
             if not match1:
@@ -56,13 +59,10 @@ class AccountLocking(SystemAccessControl):
 
             self.ssh.run('cp {0} {0}.bkp'.format(pam_file))
             print "\nUpdating {0} file".format(pam_file)
-            for line in updated_auth:
-                sys.stdout.write('. ')
-                sys.stdout.flush()
-                # Fixme: It will be good to have some other method to copy file
-                # Fixme: on the node, rather then copy line by line :(
-                self.ssh.run("echo '{0}' >> {1}.new".format(line, pam_file),
-                             populate_output=False)
+            # all the lines are appended by a single remote script.
+            self.ssh.run_many(["echo '{0}' >> {1}.new".format(line, pam_file)
+                               for line in updated_auth],
+                              populate_output=False)
             self.ssh.run('mv {0}.new {0}'.format(pam_file))
             msg = "File {0} updated with pam_faillock account " \
                   "locking configuration".format(pam_file)
@@ -75,7 +75,7 @@ class AccountLocking(SystemAccessControl):
             The pam_faillock auth lines have to placed in specific place in
             the pam configuration files, please refer the LITP hardening doc.
         """
-        content = self.ssh.run('cat %s' % pam_file)
+        content = self.ssh.run('cat %s' % pam_file, cacheable=True)
         updated_content = []
         count = 0
         auth1_faillock = "auth        required      pam_faillock.so preauth " \
@@ -108,6 +108,8 @@ class AccountLocking(SystemAccessControl):
 
 class LoginBannerPresent(SystemAccessControl):
     topic = 'login_banner_present'
+    reads = ('file:/etc/issue',)
+    writes = ('file:/etc/issue',)
 
     banner_file = '/etc/issue'
     banner_phrase = "This system is for authorised use only. By using this " \
@@ -8,6 +8,9 @@ class TimeSynchronisation(BaseHardening):
 
 class NtpSyncEnabled(TimeSynchronisation):
     topic = 'ntp_sync_enabled'
+    # the peers given by ntpq come from the ntpd running with the ntp.conf.
+    reads = ('service:ntpd', 'processes', 'packages', 'file:/etc/ntp.conf')
+    writes = ()
 
     def check(self):
         cmd = '/usr/sbin/ntpq -p'
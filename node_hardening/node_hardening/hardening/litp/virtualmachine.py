@@ -8,15 +8,23 @@ class VirtualMachineHardening(BaseHardening):
 
 class RootSshAccess(VirtualMachineHardening):
     topic = 'root_ssh_access'
+    reads = ('file:/etc/ssh/sshd_config',)
+    writes = ('file:/etc/ssh/sshd_config', 'service:sshd')
 
-    cmd = "grep '^PermitRootLogin' /etc/ssh/sshd_config || echo 'Not Found'"
+    def _get_permit_root_login(self):
+        """ Returns the PermitRootLogin lines of the sshd_config fact, or
+        'Not Found', the same as grep '^PermitRootLogin' || echo 'Not Found'.
+        """
+        lines = [l for l in self.facts.get('sshd_config').splitlines()
+                 if l.startswith('PermitRootLogin')]
+        return '\n'.join(lines) if lines else 'Not Found'
 
     def check(self):
-        out = self.ssh.run(self.cmd)
+        out = self._get_permit_root_login()
         return bool(re.search(r'yes', out))
 
     def harden(self):
-        out = self.ssh.run(self.cmd)
+        out = self._get_permit_root_login()
         if self.expected_value:
             if re.search('no', out):
                 # Change Permit Root login to Yes and restart sshd service
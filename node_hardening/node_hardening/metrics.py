@@ -0,0 +1,141 @@
+""" Writes the metrics of the hardening runs in the Prometheus text format,
+for the textfile collector of the node exporter.
+"""
+import os
+import tempfile
+import time
+from collections import Counter
+
+from node_hardening.ssh import retries_done
+
+PREFIX = 'node_hardening'
+
+
+class Metrics(object):
+    """ This class collects the samples of the metrics and writes them in a
+    file in the Prometheus text format. The file is written in a temporary
+    file first and then renamed, so the collector never reads it half
+    written.
+    >>> metrics = Metrics()
+    >>> metrics.add('run_duration_seconds', 'Duration of the run.', 1.5,
+    ...             host='ms1')
+    >>> print metrics.to_text().strip()
+    # HELP node_hardening_run_duration_seconds Duration of the run.
+    # TYPE node_hardening_run_duration_seconds gauge
+    node_hardening_run_duration_seconds{host="ms1"} 1.5
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        # the metrics by name, in the order they're added.
+        self._metrics = []
+        self._samples = {}
+
+    def add(self, name, desc, value, metric_type='gauge', **labels):
+        """ Adds a sample of a metric.
+        :param name: str, without the prefix
+        :param desc: str, the help of the metric
+        :param value: int or float
+        :param metric_type: str, e.g.: gauge or counter
+        :param labels: the labels of the sample
+        :return: None
+        """
+        name = "%s_%s" % (self.prefix, name)
+        if name not in self._samples:
+            self._metrics.append((name, desc, metric_type))
+            self._samples[name] = []
+        self._samples[name].append((labels, value))
+
+    def to_text(self):
+        """ Returns the metrics in the Prometheus text format.
+        :return: str
+        """
+        escape = lambda v: str(v).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        lines = []
+        for name, desc, metric_type in self._metrics:
+            lines.append("# HELP %s %s" % (name, desc))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for labels, value in self._samples[name]:
+                labels = ','.join(['%s="%s"' % (k, escape(v))
+                                   for k, v in sorted(labels.items())])
+                lines.append("%s{%s} %r" % (name, labels, float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """ Writes the metrics in the file, replacing it at once.
+        :param filename: str, e.g.: "<textfile directory>/hardening.prom"
+        :return: None
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            os.write(fd, self.to_text())
+        finally:
+            os.close(fd)
+        os.chmod(tmp_filename, 0644)
+        os.rename(tmp_filename, filename)
+
+
+def topic_status(topic):
+    """ Returns the status of a defined topic at the end of a run.
+    :param topic: Topic instance
+    :return: str
+    """
+    if topic.timed_out:
+        return 'timeout'
+    if topic.error:
+        return 'failed'
+    if topic.unhandled_error:
+        return 'error'
+    if not topic.is_hardener_implemented():
+        return 'not_implemented'
+    if topic.drift:
+        return 'drift'
+    if topic.is_incomplete():
+        return 'incomplete'
+    if topic.just_report:
+        return 'report'
+    if topic.checked_and_hardened:
+        return 'hardened'
+    return 'checked'
+
+
+def add_run_metrics(metrics, processor):
+    """ Adds the metrics of the run of a HardeningProcessor: the topics by
+    status, the durations of the run and of each section, the SSH commands
+    executed and the bytes received by them, and the retries of the SSH
+    client.
+    :param metrics: a Metrics instance
+    :param processor: a HardeningProcessor instance, after its run
+    :return: None
+    """
+    description = processor.description
+    host = description.host
+    statuses = Counter([topic_status(t) for s in description.sections
+                        for _, t in s.topics if t.is_defined()])
+    statuses['ignored'] = len(description.ignored_topics)
+    for status, count in sorted(statuses.items()):
+        metrics.add('topics', 'Number of topics by status.', count,
+                    host=host, status=status)
+    if description.duration:
+        metrics.add('run_duration_seconds', 'Duration of the run.',
+                    description.duration, host=host)
+    metrics.add('last_run_timestamp_seconds', 'Time the run finished.',
+                time.time(), host=host)
+    outputs = []
+    for section in description.sections:
+        durations = [t.duration for _, t in section.topics if t.duration]
+        if durations:
+            metrics.add('section_duration_seconds', 'Time spent processing '
+                        'the topics of a section.', sum(durations), host=host,
+                        section=section.__class__.__name__)
+        outputs += [o for _, t in section.topics for o in t.outputs
+                    if not getattr(o, 'cached', False)]
+    metrics.add('ssh_commands', 'Number of SSH commands executed by the '
+                'topics.', len(outputs), host=host)
+    metrics.add('ssh_received_bytes', 'Bytes received by the SSH commands of '
+                'the topics.', sum([getattr(o, 'nbytes', 0) for o in outputs]),
+                host=host)
+    metrics.add('ssh_retries', 'Number of SSH retries after a lost session.',
+                retries_done[processor.connection.client.host], host=host)
@@ -0,0 +1,88 @@
+""" Profiles a node hardening run, one topic at a time.
+"""
+import cProfile
+import os
+import pstats
+import resource
+import threading
+
+
+class RunProfiler(object):
+    """ This class runs each topic of a HardeningProcessor under its own
+    cProfile profiler, and writes one "<name>.pstats" file per topic in the
+    profile_dir. The merge() writes the "run.pstats" of all of them.
+
+    The profilers only see the thread running the topic, so the commands
+    run concurrently by the SshRunner.run_concurrently() in other threads
+    are not part of its stats.
+
+    With memory, the peak resident memory of the process (the ru_maxrss of
+    getrusage) is read before and after each topic, and merge() writes the
+    growth of each one in "memory.txt", the biggest first. It covers the
+    whole process, so the topics running at the same time are mixed in it.
+    """
+
+    def __init__(self, profile_dir, memory=False):
+        """ It requires the directory of the files written, it's created in
+        case it doesn't exist.
+        """
+        self.profile_dir = profile_dir
+        self.memory = memory
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        self.stats_files = []
+        # the tuples of (name, peak before, peak after) in kilobytes.
+        self.memory_usage = []
+        self._lock = threading.Lock()
+
+    def _filename(self, name, extension):
+        return os.path.join(self.profile_dir, "%s.%s" % (name, extension))
+
+    @staticmethod
+    def _max_rss():
+        """ Returns the peak resident memory of this process in kilobytes.
+        """
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def profile(self, name, func, *args, **kwargs):
+        """ Calls func with the args and kwargs under a profiler, and writes
+        its stats in the file of the given name.
+        :param name: str, e.g.: "<section>.<topic>"
+        :param func: callable
+        :return: the value returned by func
+        """
+        profiler = cProfile.Profile()
+        max_rss = self._max_rss() if self.memory else None
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            filename = self._filename(name, 'pstats')
+            profiler.dump_stats(filename)
+            with self._lock:
+                self.stats_files.append(filename)
+                if max_rss is not None:
+                    self.memory_usage.append((name, max_rss,
+                                              self._max_rss()))
+
+    def _write_memory(self):
+        """ Writes the growth of the peak memory of each topic.
+        """
+        usage = sorted(self.memory_usage, key=lambda u: u[1] - u[2])
+        with open(self._filename('memory', 'txt'), 'w') as memory_file:
+            memory_file.write("%12s %12s  %s\n" % ('growth (KB)', 'peak (KB)',
+                                                   'name'))
+            for name, before, after in usage:
+                memory_file.write("%12d %12d  %s\n" % (after - before, after,
+                                                       name))
+
+    def merge(self):
+        """ Writes the stats of all the topics profiled in a single file.
+        :return: str or None, the filename written, if any
+        """
+        if not self.stats_files:
+            return None
+        filename = self._filename('run', 'pstats')
+        pstats.Stats(*self.stats_files).dump_stats(filename)
+        if self.memory:
+            self._write_memory()
+        return filename
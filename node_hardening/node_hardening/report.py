@@ -1,10 +1,34 @@
 
 import os
+from collections import OrderedDict
 from datetime import datetime
 from decimal import Decimal
 from node_hardening.basedescription import FailedOrIncompleteTopicsException
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+SLOWEST_COMMANDS = 10
+
+
+def command_timing(outputs):
+    """ Sums up the timing of the commands of an output history, it returns
+    a tuple of (commands, seconds, bytes received, commands through su). The
+    entries without timing, e.g. from older reports, count as 0.
+    >>> command_timing([('ls', 0, 'file')])
+    (1, 0.0, 0, 0)
+    """
+    seconds = sum([getattr(o, 'share', 0.0) for o in outputs])
+    nbytes = sum([getattr(o, 'nbytes', 0) for o in outputs])
+    su = len([o for o in outputs if getattr(o, 'su', False)])
+    return len(outputs), seconds, nbytes, su
+
+
+def format_timing(outputs):
+    """ Formats the command_timing() of an output history.
+    >>> format_timing([('ls', 0, 'file')])
+    '1 commands in 0.0s, 0 bytes received, 0 through su'
+    """
+    return "%s commands in %.1fs, %s bytes received, %s through su" % \
+           command_timing(outputs)
 
 
 class Table(object):
@@ -142,6 +166,7 @@ class TextReportFormat(ReportFormatter):
     warning_icon = '!'
     harden_not_implemented_icon = ':('
     flag_icon = 'P(%s)'
+    timeout_icon = 'T(%s)'
     checked_icon = 'V'
     space = ' '
 
@@ -190,6 +215,7 @@ class HtmlReportFormat(ReportFormatter):
     harden_not_implemented_icon = ' <i class="fa fa-thumbs-o-down fa-1x red"></i>'
     secret_icon = ' <i title="%s" class="fa fa-user-secret fa-1x red"></i>'
     flag_icon = ' <i title="%s" class="fa fa-flag fa-1x dark-blue"></i>'
+    timeout_icon = ' <i title="%s" class="fa fa-clock-o fa-1x red"></i>'
     checked_icon = ' <i title="%s" class="fa fa-check fa-1x dark-green"></i>'
     space = '&nbsp;'
 
@@ -222,6 +248,81 @@ class ReportBuilder(object):
         title = "Hardening Report for %s" % str(self.description.host)
         return html_base % dict(body=body, title=title)
 
+    def format_outputs(self, format, outputs):
+        """ Formats the commands executed and their outputs. The outputs
+        taken from the cache are flagged, the timing of the others is shown.
+        """
+        lines = []
+        for entry in outputs:
+            cmd, code, output = entry
+            if getattr(entry, 'cached', False):
+                cmd = "%s (cached)" % cmd
+            elif getattr(entry, 'duration', None) is not None:
+                cmd = "%s (%s)" % (cmd, self.format_command_timing(entry))
+            lines.append(format.div % ('$ %s' % cmd))
+            lines.append(format.pre % "STATUS CODE: %s\n%s\n\n%s" %
+                         (code, '-' * 80, output))
+        return lines
+
+    def format_command_timing(self, entry):
+        """ Formats the timing of a single command of an output history.
+        """
+        timing = ["%.2fs" % entry.duration]
+        if entry.batch > 1:
+            timing[0] += " for a batch of %s" % entry.batch
+        if entry.ttfb is not None:
+            timing.append("first byte after %.2fs" % entry.ttfb)
+        timing.append("%s bytes" % entry.nbytes)
+        if entry.su:
+            timing.append("su")
+        return ', '.join(timing)
+
+    def slowest_commands(self, limit=SLOWEST_COMMANDS):
+        """ Returns the table of the slowest commands of all the topics.
+        :param limit: int, the number of commands in the table
+        :return: Table or None, in case no command has timing
+        """
+        entries = []
+        for section in self.description.sections:
+            for name, topic in section.topics:
+                entries += [(o, section, name) for o in topic.outputs
+                            if getattr(o, 'duration', None) is not None]
+        if not entries:
+            return None
+        entries.sort(key=lambda e: e[0].share, reverse=True)
+        rows = []
+        for entry, section, name in entries[:limit]:
+            rows.append(OrderedDict([
+                ('Seconds', "%.2f" % entry.share),
+                ('Command', entry[0]),
+                ('Topic', "%s: %s" % (section, name)),
+                ('Timing', self.format_command_timing(entry))]))
+        return Table("Slowest commands", rows, dict_lines=True)
+
+    def section_timing(self, section):
+        """ Returns the table of the timing of the topics of a section, and
+        of the section itself.
+        :param section: Section instance
+        :return: Table or None, in case no command was executed
+        """
+        rows = []
+        outputs = []
+        for name, topic in section.topics:
+            if not topic.outputs:
+                continue
+            outputs += topic.outputs
+            count, seconds, nbytes, su = command_timing(topic.outputs)
+            rows.append(OrderedDict([('Topic', name), ('Commands', count),
+                                     ('Seconds', "%.2f" % seconds),
+                                     ('Bytes', nbytes), ('Su', su)]))
+        if not rows:
+            return None
+        count, seconds, nbytes, su = command_timing(outputs)
+        rows.append(OrderedDict([('Topic', 'Total'), ('Commands', count),
+                                 ('Seconds', "%.2f" % seconds),
+                                 ('Bytes', nbytes), ('Su', su)]))
+        return Table(str(section), rows, dict_lines=True)
+
     def build_formated_lines(self, format):
         lines = []
         format_topic_name = lambda x: x.title().replace('_', ' ')
@@ -236,6 +337,16 @@ class ReportBuilder(object):
             dur = str(self.description.duration)
             duration = Decimal(dur).quantize(Decimal('.0'))
             lines.append(kv("Duration", "%ss" % duration))
+        outputs = reduce(lambda a, b: a + b,
+                         [t.outputs for s in self.description.sections
+                          for _, t in s.topics], [])
+        if outputs:
+            lines.append(kv("Commands", format_timing(outputs)))
+            slowest = self.slowest_commands()
+            if slowest is not None:
+                lines.append(format.scroll)
+                lines += slowest.format_dict(format)
+                lines.append(format.scroll_end)
 
         try:
             self.description.check_failed_topics()
@@ -247,6 +358,12 @@ class ReportBuilder(object):
             if err.incomplete_topics:
                 lines.append(format.warning % "Hardening Incomplete")
                 lines.append(format.br)
+            if err.drifted_topics:
+                lines.append(format.warning % "Drift Found (audit only)")
+                lines.append(format.br)
+            if [t for t in err.failed_topics if t.timed_out]:
+                lines.append(format.error % "Time Budget Exceeded")
+                lines.append(format.br)
 
         lines.append(format.h1 % (format.a_anchor % dict(id="__index",
                                                          title="INDEX")))
@@ -273,7 +390,7 @@ class ReportBuilder(object):
                     alert_icon = format.error_icon
                 elif topic.harden_case_not_implemented:
                     alert_icon = format.harden_not_implemented_icon
-                elif topic.is_incomplete():
+                elif topic.drift or topic.is_incomplete():
                     alert_icon = format.warning_icon
                 else:
                     alert_icon = format.checked_icon
@@ -283,6 +400,8 @@ class ReportBuilder(object):
                     extra = format.flag_icon % "This topic is just a report"
                 if topic.checked_and_hardened:
                     extra += format.secret_icon % "It was checked and hardened"
+                if topic.timed_out:
+                    extra += format.timeout_icon % "It exceeded its time budget"
                 lines.append(format.li % ("%s %s %s" % (alert_icon, a, extra)))
             lines.append(format.ul_vis_end)
             lines.append(format.br)
@@ -305,6 +424,18 @@ class ReportBuilder(object):
             lines.append(format.br)
             lines.append(format.hr)
 
+        tables = [self.section_timing(s) for s in self.description.sections]
+        tables = [t for t in tables if t is not None]
+        if tables:
+            lines.append(format.h2 % (format.a_anchor % dict(id="__timing",
+                                                title="TIMING")))
+            for table in tables:
+                lines.append(format.scroll)
+                lines += table.format_dict(format)
+                lines.append(format.scroll_end)
+            lines.append(format.br)
+            lines.append(format.hr)
+
 
         for section in self.description.sections:
             if not [t for i, t in section.topics if t.is_defined()]:
@@ -350,6 +481,8 @@ class ReportBuilder(object):
                     elif topic.checked_and_hardened:
                         reports = [format.secret_icon % "It was checked and hardened",
                                    "It was checked and hardened."]
+                    elif topic.drift:
+                        reports = [format.warning_icon]
                     else:
                         reports = [format.checked_icon]
                     rep = topic.report if isinstance(topic.report, list) else [topic.report]
@@ -364,6 +497,8 @@ class ReportBuilder(object):
                 if topic.outputs:
                     lines.append(format.br)
                     lines.append(format.br)
+                    lines.append(kv("Commands", format_timing(topic.outputs)))
+                    lines.append(format.br)
                     if topic.harden_outputs:
                         lines.append(format.div % 'Commands executed during '
                                                   'the first check process:')
@@ -375,28 +510,21 @@ class ReportBuilder(object):
                             lines.append(format.div % 'Commands executed '
                                                    'during the check process:')
                     lines.append(format.br)
-                    for cmd, code, output in topic.check_outputs:
-                        lines.append(format.div % ('$ %s' % cmd))
-                        lines.append(format.pre % "STATUS CODE: %s\n%s\n\n%s" %
-                                     (code, '-' * 80, output))
+                    lines += self.format_outputs(format, topic.check_outputs)
                     if topic.harden_outputs:
                         lines.append(format.br)
                         lines.append(format.div % 'Commands executed during '
                                                   'the hardening process:')
                         lines.append(format.br)
-                        for cmd, code, output in topic.harden_outputs:
-                            lines.append(format.div % ('$ %s' % cmd))
-                            lines.append(format.pre % "STATUS CODE: %s\n%s\n\n%s" %
-                                         (code, '-' * 80, output))
+                        lines += self.format_outputs(format,
+                                                     topic.harden_outputs)
                     if topic.double_check_outputs:
                         lines.append(format.br)
                         lines.append(format.div % 'Commands executed during '
                                                   'the second check process:')
                         lines.append(format.br)
-                        for cmd, code, output in topic.double_check_outputs:
-                            lines.append(format.div % ('$ %s' % cmd))
-                            lines.append(format.pre % "STATUS CODE: %s\n%s\n\n%s" %
-                                         (code, '-' * 80, output))
+                        lines += self.format_outputs(format,
+                                                 topic.double_check_outputs)
 
                 lines.append(format.br)
                 lines.append(format.br)
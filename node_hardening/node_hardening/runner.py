@@ -1,18 +1,29 @@
 import cPickle
 from datetime import datetime
 
-from node_hardening.utils import import_module
+from node_hardening.utils import import_module, Deadline
 from node_hardening.basedescription import HardeningDescription, \
                                            FailedOrIncompleteTopicsException
 from node_hardening.hardening import HardeningProcessor
+from node_hardening.profiler import RunProfiler
+from node_hardening.events import EventStream
+from node_hardening.trace import TraceRecorder
+from node_hardening.metrics import Metrics, add_run_metrics
+from node_hardening.ssh import tunnels
 from node_hardening.report import ReportBuilder
 
 
+# the description classes already found, by description module name.
+_description_classes = {}
+
+
 def get_description_class(description_module):
     """ From a description module name, gets the actual description class.
     :param description_module: str, e.g.: module.sub_module
     :return: HardeningDescription based class
     """
+    if description_module in _description_classes:
+        return _description_classes[description_module]
     module_name = "node_hardening.descriptions.%s" % description_module
     module = import_module(module_name)
     for attr in dir(module):
@@ -22,6 +33,7 @@ def get_description_class(description_module):
                issubclass(value, HardeningDescription) and \
                hasattr(value, '__module__') and \
                value.__module__ == module_name:
+                _description_classes[description_module] = value
                 return value
         except TypeError:
             pass
@@ -31,7 +43,12 @@ def get_description_class(description_module):
 def run_node_hardening(description_module, host, user, password, port=22,
         su_password=None, via_host=None, via_user=None,
         via_password=None, topic=None, mock_report=False,
-                       report_filename=None):
+                       report_filename=None, persistent_su=False,
+                       record_to=None, replay_from=None, replay_latency=False,
+                       topic_workers=1, audit=False, state_dir=None,
+                       topic_timeout=None, run_timeout=None,
+                       profile_dir=None, profile_memory=False,
+                       events_to=None, trace_to=None, metrics_to=None):
     """ From a description_module and connection arguments, runs all the node
     hardening procedure based on the sections and topics of the description.
 
@@ -51,34 +68,70 @@ def run_node_hardening(description_module, host, user, password, port=22,
     :param topic: str, the name of the topic to be executed
     :param mock_report: bool
     :param report_filename: str, full path to generated report
+    :param persistent_su: bool, uses a single root shell for the su commands
+    :param record_to: str, session file to record the commands executed
+    :param replay_from: str, session file to replay instead of connecting
+    :param replay_latency: bool, replays the recorded latencies as well
+    :param topic_workers: int, number of topics processed at the same time
+    :param audit: bool, only checks the topics and reports the drift
+    :param state_dir: str, directory of the state kept between runs to skip
+                      the topics whose inputs have not changed
+    :param topic_timeout: float, time budget in seconds of each topic
+    :param run_timeout: float, time budget in seconds of the whole run
+    :param profile_dir: str, profiles each topic and the report, and writes
+                        the pstats files in this directory
+    :param profile_memory: bool, writes the growth of the peak memory during
+                           each topic as well
+    :param events_to: str, file or pipe where the JSON-lines events of the
+                      run are written, "-" is the standard output
+    :param trace_to: str, file where the spans of the run are written in the
+                     Chrome trace-event format
+    :param metrics_to: str, file where the metrics of the run are written in
+                       the Prometheus text format, e.g.: in the directory
+                       of the textfile collector of the node exporter
     :return: tuple (bool, str) => (success or not, report filename)
     """
 
     failed_topics = []
     incomplete_topics = []
     no_hardener_implemented = []
+    drifted_topics = []
     description = None
+    profiler = None
+    if profile_dir:
+        profiler = RunProfiler(profile_dir, profile_memory)
+    events = EventStream(events_to) if events_to else None
+    trace = TraceRecorder() if trace_to else None
     if not mock_report:
         hardener_name = description_module.split('.')[0]
         DescriptionClass = get_description_class(description_module)
         description = DescriptionClass(host)
         h = HardeningProcessor(hardener_name, description, host, user,
                 password, port, su_password, via_host,
-                               via_user, via_password)
+                               via_user, via_password, persistent_su,
+                               record_to, replay_from, replay_latency,
+                               topic_workers, audit=audit,
+                               state_dir=state_dir,
+                               topic_timeout=topic_timeout,
+                               run_timeout=run_timeout, profiler=profiler,
+                               events=events, trace=trace)
         if topic:
             try:
                 hclass = h.get_hardener_topic(topic)
                 print(" Running the topic: %s" % topic)
-            except AttributeError:
+            except KeyError:
                 print " Topic %s doesn't exist." % topic
                 exit(1)
-            h.process_hardener(hclass)
+            h.connect()
+            with h.connection as ssh_client, Deadline(run_timeout, 'run'):
+                h.run_hardener(hclass, ssh_client)
             try:
                 description.check_failed_topics()
             except FailedOrIncompleteTopicsException as err:
                 failed_topics = err.failed_topics
                 incomplete_topics = err.incomplete_topics
                 no_hardener_implemented = err.no_hardener_implemented_topics
+                drifted_topics = err.drifted_topics
         else:
             try:
                 h.start()
@@ -86,6 +139,14 @@ def run_node_hardening(description_module, host, user, password, port=22,
                 failed_topics = err.failed_topics
                 incomplete_topics = err.incomplete_topics
                 no_hardener_implemented = err.no_hardener_implemented_topics
+                drifted_topics = err.drifted_topics
+        tunnels.close()
+        if events is not None:
+            events.close()
+        if metrics_to:
+            metrics = Metrics()
+            add_run_metrics(metrics, h)
+            metrics.write(metrics_to)
 
         #from copy import deepcopy
         #with open('last_report.pickle', 'w') as f:
@@ -105,7 +166,18 @@ def run_node_hardening(description_module, host, user, password, port=22,
         )
 
     with open(report_filename, 'w') as report_file:
-        report_file.write(report.to_html())
+        to_html = report.to_html
+        if profiler is not None:
+            to_html = lambda: profiler.profile('report', report.to_html)
+        if trace is not None:
+            with trace.span('report', description.host, 'report'):
+                report_file.write(to_html())
+            trace.write(trace_to)
+        else:
+            report_file.write(to_html())
+    if profiler is not None:
+        print " The profile of the run has been saved in the file %s" % \
+              profiler.merge()
 
     report_msg = "The report has been saved in the file %s" % report_filename
 
@@ -125,7 +197,8 @@ def run_node_hardening(description_module, host, user, password, port=22,
             print report_msg
             print
     else:
-        if failed_topics or incomplete_topics or no_hardener_implemented:
+        if failed_topics or incomplete_topics or no_hardener_implemented \
+                or drifted_topics:
             print " !!!!!! FAILED !!!!!!"
             print
             if incomplete_topics:
@@ -144,6 +217,11 @@ def run_node_hardening(description_module, host, user, password, port=22,
                       "Hardener class seems to be created:"
                 for topic in no_hardener_implemented:
                     print " - %s" % topic
+            if drifted_topics:
+                print
+                print " The following topics drifted from the description:"
+                for topic in drifted_topics:
+                    print " - %s: %s" % (topic, topic.report)
 
             print
             print
@@ -1,5 +1,4 @@
 import re
-from copy import copy
 from utils import camelcase_to_underscore
 
 
@@ -88,10 +87,11 @@ class Topic(object):
     bool_choices_sub_regex = re.compile(r"(.*)\<\w*\|\w*\>(.*)")
     bool_choices_regex = re.compile(r".*\<(\w*)\|(\w*)\>.*")
 
-    def __init__(self, _type, _desc=None):
+    def __init__(self, _type, _desc=None, timeout=None):
         """ The builds an instance, a _type is required. This argument must be
         any "type" in Python. The _desc argument is just a brief description
-        to be include in the report for this topic.
+        to be include in the report for this topic. The timeout is the time
+        budget in seconds of the topic, overriding the one of the run.
 
         The first instance of a topic contains a null value for the
         _expected_value. It will be properly valued by the child Section
@@ -101,6 +101,7 @@ class Topic(object):
         self._type = _type
         self.name = None
         self._desc = _desc
+        self.timeout = timeout
         self.outputs = []
         self.check_outputs = []
         self.harden_outputs = []
@@ -113,6 +114,10 @@ class Topic(object):
         self.hardener_implemented = False
         self.harden_case_not_implemented = False
         self.retrieved_value = None
+        self.drift = False
+        self.timed_out = False
+        # the seconds spent processing the topic.
+        self.duration = None
         self.ssh_runner = None
 
     def __str__(self):
@@ -121,6 +126,22 @@ class Topic(object):
     def __repr__(self):
         return "<Topic: %s>" % str(self)
 
+    def clone(self):
+        """ Returns a new instance of this topic with the same definition,
+        i.e. name, type, description and expected_value, but a fresh state
+        to be populated by a run.
+        >>> topic = Topic(int, "desc")
+        >>> topic.expected_value = 5
+        >>> topic.outputs.append(('ls', 0, ''))
+        >>> clone = topic.clone()
+        >>> clone.expected_value, clone.description, clone.outputs
+        (5, 'desc', [])
+        """
+        topic = self.__class__(self._type, self._desc, self.timeout)
+        topic.name = self.name
+        topic._expected_value = self._expected_value
+        return topic
+
     @property
     def expected_value(self):
         return self._expected_value
@@ -233,7 +254,7 @@ class MetaSection(type):
                 base_topic.name = attr
                 # makes a copy of the base_topic instance to be used in the
                 # child class.
-                topic = copy(base_topic)
+                topic = base_topic.clone()
                 try:
                     # populates the value taken from the child Section class to
                     # the new topic instance "copied" from the base class, to
@@ -295,6 +316,25 @@ class Section(object):
     """
     __metaclass__ = MetaSection
 
+    def __init__(self):
+        """ The topics of the class are the definitions only, every instance
+        has its own clones of them to keep the state of a run.
+        >>> class BaseOtherSection(Section):
+        ...     some_topic = Topic(str)
+        ...
+        >>> class OtherSection(BaseOtherSection):
+        ...     some_topic = "value"
+        ...
+        >>> section = OtherSection()
+        >>> section.some_topic.outputs.append(('ls', 0, ''))
+        >>> OtherSection().some_topic.outputs, OtherSection.some_topic.outputs
+        ([], [])
+        """
+        for name in dir(self.__class__):
+            value = getattr(self.__class__, name, None)
+            if isinstance(value, Topic):
+                setattr(self, name, value.clone())
+
     def __str__(self):
         return self.title
 
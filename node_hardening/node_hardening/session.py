@@ -0,0 +1,122 @@
+import base64
+import json
+import re
+import threading
+import time
+from collections import deque
+
+from node_hardening.ssh import SshScpClient
+
+SCRIPT_REGEX = re.compile(r'^echo (\S+) \| base64 -d \| /bin/sh$')
+TOKEN_REGEX = re.compile(r'__NH_CMD_ ([0-9a-f]{32})')
+TOKEN_PLACEHOLDER = '{token}'
+
+
+def normalize(cmd):
+    """ The scripts built by the SshRunner.execute_many() are shipped in
+    base64 and carry a random token, so they would never match between a
+    record and its replay. This function returns the tuple (cmd, token),
+    where the cmd is the decoded script with the token replaced by a
+    placeholder, or just the cmd and None for any other command.
+    >>> normalize('ls -l')
+    ('ls -l', None)
+    >>> script = "echo a\\nprintf __NH_CMD_ %s $?" % ('f' * 32)
+    >>> normalize('echo %s | base64 -d | /bin/sh' % base64.b64encode(script))
+    ('echo a\\nprintf __NH_CMD_ {token} $?', 'ffffffffffffffffffffffffffffffff')
+    """
+    match = SCRIPT_REGEX.match(cmd)
+    if not match:
+        return cmd, None
+    try:
+        script = base64.b64decode(match.group(1))
+    except TypeError:
+        return cmd, None
+    token = TOKEN_REGEX.search(script)
+    if not token:
+        return script, None
+    token = token.group(1)
+    return script.replace(token, TOKEN_PLACEHOLDER), token
+
+
+class SessionRecorder(object):
+    """ This class writes every command executed by the SshClient in a
+    session file, one JSON object per line with the host, the command, the
+    su flag, the status code, the outputs and the latency in seconds. The su
+    password and the expected inputs are never written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def record(self, host, cmd, su, status, out, err, latency):
+        cmd, token = normalize(cmd)
+        if token:
+            out = out.replace(token, TOKEN_PLACEHOLDER)
+            err = err.replace(token, TOKEN_PLACEHOLDER)
+        text = lambda s: s.decode('utf-8', 'replace') \
+            if isinstance(s, str) else s
+        line = json.dumps({'host': host, 'cmd': text(cmd), 'su': bool(su),
+                           'status': status, 'out': text(out),
+                           'err': text(err), 'latency': latency})
+        with self._lock:
+            with open(self.filename, 'a') as session_file:
+                session_file.write(line + '\n')
+
+
+class ReplaySshClient(SshScpClient):
+    """ This class replays a session file written by the SessionRecorder
+    instead of connecting to the host, so a full HardeningProcessor run can
+    be done offline. The entries of the same command are returned in the
+    recorded order, the last one is kept for any further execution.
+
+    With replay_latency, each command takes the same time as recorded.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.session_file = kwargs.pop('session_file')
+        self.replay_latency = kwargs.pop('replay_latency', False)
+        super(ReplaySshClient, self).__init__(*args, **kwargs)
+        self._entries = {}
+        self._entries_lock = threading.Lock()
+        with open(self.session_file) as session_file:
+            for line in session_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry['host'] not in (None, self.host):
+                    continue
+                key = (entry['cmd'].encode('utf-8'), entry['su'])
+                self._entries.setdefault(key, deque()).append(entry)
+
+    def connect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def run(self, cmd, timeout=None, su=None, expects=None):
+        key, token = normalize(cmd)
+        with self._entries_lock:
+            entries = self._entries.get((key, bool(su)))
+            if not entries:
+                self.debug("no recorded output (%s)" % cmd)
+                return 127, '', "%s: command not found" % cmd.split()[0]
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+        if self.replay_latency:
+            time.sleep(entry['latency'])
+        out = entry['out'].encode('utf-8')
+        err = entry['err'].encode('utf-8')
+        if token:
+            out = out.replace(TOKEN_PLACEHOLDER, token)
+            err = err.replace(TOKEN_PLACEHOLDER, token)
+        return entry['status'], out, err
+
+    def get(self, path):
+        pass
+
+    def put(self, source, dest):
+        pass
+
+    def close(self):
+        pass
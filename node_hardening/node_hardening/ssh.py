@@ -1,32 +1,443 @@
 """ SSH helpers using paramiko library.
 """
 
+import base64
 import os
 import paramiko
+import re
 import socket
 import sys
+import tempfile
+import threading
 import time
 import traceback
+import uuid
+from collections import Counter
 from functools import wraps
 
+from node_hardening.utils import run_in_pool, remaining_time, sleep, \
+    Deadline, DeadlineExceeded
+
 CONNECT_TIMEOUT = 20   # seconds
+EXPECT_TIMEOUT = 30    # seconds
+RECV_SIZE = 65536      # bytes
+SPILL_THRESHOLD = 8 * 1024 * 1024  # bytes
+MATCH_OVERLAP = 256    # bytes
+MAX_SESSIONS = 10      # sshd default MaxSessions
+
+PASSWORD_PROMPT = re.compile(r'[Pp]assword:\s*$')
+INPUT_PROMPT = re.compile(r'[:?]\s*$')
+LINE_END = re.compile(r'\n')
 
 
 class TimeoutException(Exception):
     pass
 
 
+class RootShellException(Exception):
+    """ This exception is raised when the persistent root shell can't be
+    opened, e.g.: the su password is wrong.
+    """
+
+
+class CommandResult(tuple):
+    """ The tuple of (status, out, err) of a command run by the SshClient,
+    that also carries the epoch time it started, its wall time and time to
+    first byte in seconds, or None when they're not known.
+    >>> status, out, err = CommandResult(0, 'out', '', 0.5, 0.1)
+    >>> CommandResult(0, 'out', '', 0.5, 0.1).ttfb
+    0.1
+    """
+
+    def __new__(cls, status, out, err, duration=None, ttfb=None,
+                started=None):
+        obj = super(CommandResult, cls).__new__(cls, (status, out, err))
+        obj.started = started
+        obj.duration = duration
+        obj.ttfb = ttfb
+        return obj
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+
+class OutputBuffer(object):
+    """ Accumulates the data read from a channel in a preallocated bytearray
+    (written through a memoryview, so no intermediate strings are built),
+    and spills it to a temporary file once it goes past the spill_threshold.
+    The data is converted to str only once, when it is retrieved.
+    """
+
+    def __init__(self, size=RECV_SIZE, spill_threshold=SPILL_THRESHOLD):
+        """ The size is the initial size of the bytearray, it grows
+        geometrically as needed up to the spill_threshold.
+        >>> buf = OutputBuffer(4, spill_threshold=10)
+        >>> buf.write('abc'); buf.write('def')
+        >>> buf.size, buf.spilled, buf.getvalue()
+        (6, False, 'abcdef')
+        >>> buf.write('ghijk')
+        >>> buf.size, buf.spilled, buf.getvalue(2, 8)
+        (11, True, 'cdefgh')
+        """
+        self.spill_threshold = spill_threshold
+        self.size = 0
+        self._array = bytearray(size)
+        self._view = memoryview(self._array)
+        self._file = None
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, data):
+        """ Appends the data to the buffer.
+        """
+        length = len(data)
+        end = self.size + length
+        if self._file is None and end > self.spill_threshold:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(self._view[:self.size])
+            self._array = self._view = None
+        if self._file is not None:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+        else:
+            if end > len(self._array):
+                array = bytearray(max(end, 2 * len(self._array)))
+                array[:self.size] = self._view[:self.size]
+                self._array = array
+                self._view = memoryview(array)
+            self._view[self.size:end] = data
+        self.size = end
+
+    def getvalue(self, start=0, end=None):
+        """ Retrieves the data from start to end as a str.
+        """
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return ''
+        if self._file is not None:
+            self._file.seek(start)
+            return self._file.read(end - start)
+        return self._view[start:end].tobytes()
+
+    def close(self):
+        """ Releases the memory and the temporary file.
+        """
+        if self._file is not None:
+            self._file.close()
+        self._file = self._array = self._view = None
+
+
+class ChannelExpect(object):
+    """ A small expect engine on top of a paramiko channel. It reads the
+    channel until a prompt shows up, so the caller can send the input right
+    away instead of sleeping a fixed amount of time.
+    """
+
+    def __init__(self, channel, timeout=EXPECT_TIMEOUT,
+                 spill_threshold=SPILL_THRESHOLD):
+        """ The timeout is the deadline in seconds to wait for each prompt.
+        The spill_threshold is the size of the output kept in memory before
+        it's moved to a temporary file while reading.
+        """
+        self.channel = channel
+        self.timeout = timeout
+        self.spill_threshold = spill_threshold
+        self.buffer = OutputBuffer(spill_threshold=spill_threshold)
+        # the time the first data was read, reset by the caller before each
+        # command sent to the channel.
+        self.first_read_at = None
+
+    def _write(self, data):
+        if self.first_read_at is None:
+            self.first_read_at = time.time()
+        self.buffer.write(data)
+
+    def _consume(self, end):
+        """ Takes the data out of the buffer up to the end position, and
+        keeps only the rest in it.
+        """
+        data = self.buffer.getvalue(0, end)
+        rest = self.buffer.getvalue(end)
+        self.buffer.close()
+        self.buffer = OutputBuffer(spill_threshold=self.spill_threshold)
+        if rest:
+            self.buffer.write(rest)
+        return data
+
+    def expect(self, regex, timeout=None):
+        """ Reads the channel until the regex matches the data received since
+        the last match and returns that data. In case the channel is closed
+        before the prompt shows up, returns None. The timeout is the one of
+        this instance by default.
+        """
+        return self.read_until(regex, timeout or self.timeout)
+
+    def read_until(self, regex, timeout=None):
+        """ The same as expect(), but without a timeout it waits for the match
+        as long as it takes, e.g.: the end of a long command. The reads are
+        bounded by the closest deadline in effect anyway.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        # only the tail of the data received is searched again after each
+        # read, so big outputs before the match are not scanned many times.
+        searched = 0
+        while True:
+            start = max(0, searched - MATCH_OVERLAP)
+            match = regex.search(self.buffer.getvalue(start))
+            searched = self.buffer.size
+            if match:
+                return self._consume(start + match.end())
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutException("No prompt matching \"%s\" was "
+                                           "read within %s seconds. Output: "
+                                           "%s" % (regex.pattern, timeout,
+                                                   self.buffer.getvalue(
+                                                       start)))
+            self.channel.settimeout(remaining_time(remaining))
+            try:
+                data = self.channel.recv(RECV_SIZE)
+            except socket.timeout:
+                continue
+            if not data:
+                return None
+            self._write(data)
+
+    def read_until_eof(self, timeout=None):
+        """ Reads the remaining output until the channel is closed. The
+        timeout is applied to each read, a socket.timeout is raised if the
+        channel stays silent for longer than it. The reads are bounded by the
+        closest deadline in effect as well.
+        """
+        while True:
+            self.channel.settimeout(remaining_time(timeout))
+            data = self.channel.recv(RECV_SIZE)
+            if not data:
+                break
+            self._write(data)
+        return self._consume(self.buffer.size)
+
+
+class RootShell(object):
+    """ A long-lived root shell opened once per host. The su authentication
+    and the PTY allocation happen only once, then each command is piped
+    through the same shell and delimited by a sentinel marker that carries
+    its exit status.
+    """
+
+    def __init__(self, client, su_password):
+        """ It requires the SshClient instance and the su password.
+        >>> shell = RootShell(SshClient("host", "user"), "pwd")
+        >>> shell.is_open()
+        False
+        """
+        self.client = client
+        self.su_password = su_password
+        self._channel = None
+        self._expect = None
+        self._lock = threading.Lock()
+        token = uuid.uuid4().hex
+        # the markers are printed in two parts, so the shell echo of the
+        # printf line itself never matches the regexes below.
+        self._ready_cmd = "printf '%%s%%s\\n' __NH_READY_ %s" % token
+        self._end_cmd = "printf '\\n%%s%%s %%d\\n' __NH_END_ %s $?" % token
+        self._ready_regex = re.compile(r'__NH_READY_%s\r?\n' % token)
+        self._end_regex = re.compile(r'\r?\n__NH_END_%s (\d+)\r?\n' % token)
+
+    def is_open(self):
+        """ Checks whether the shell is still alive.
+        """
+        return bool(self._channel is not None and
+                    not self._channel.closed and
+                    not self._channel.exit_status_ready())
+
+    def open(self):
+        """ Opens the channel, authenticates with su and prepares the shell
+        to be used without echo and prompts.
+        """
+        self.close()
+        channel = self.client._open_session()
+        channel.set_combine_stderr(True)
+        channel.get_pty()
+        channel.exec_command('su')
+        expect = ChannelExpect(channel, self.client.expect_timeout,
+                               self.client.spill_threshold)
+        if expect.expect(PASSWORD_PROMPT) is not None:
+            channel.sendall('%s\n' % self.su_password)
+        channel.sendall("stty -echo; unset HISTFILE; PS1=''; PS2=''; %s\n" %
+                        self._ready_cmd)
+        if expect.expect(self._ready_regex) is None:
+            channel.close()
+            raise RootShellException("Failed to open a root shell on %s: %s"
+                                     % (self.client.host,
+                                        expect.buffer.getvalue()))
+        self._channel = channel
+        self._expect = expect
+        self.client.debug("root shell opened on %s" % self.client.host)
+
+    def run(self, cmd, timeout=None, expects=None):
+        """ Runs the cmd through the root shell and returns a CommandResult
+        of (status, output, ''), its time to first byte is set. The command
+        is sent base64 encoded and evaluated in a single line, so it can still
+        read its own input from the PTY.
+        """
+        with self._lock:
+            if not self.is_open():
+                self.open()
+            encoded = base64.b64encode(cmd)
+            t0 = time.time()
+            self._expect.first_read_at = None
+            self._channel.sendall('eval "$(echo %s | base64 -d)"; %s\n' %
+                                  (encoded, self._end_cmd))
+            try:
+                out = []
+                for exp in expects or []:
+                    prompt = self._expect.expect(INPUT_PROMPT)
+                    if prompt is None:
+                        break
+                    out.append(prompt)
+                    self._channel.sendall('%s\n' % exp)
+                # the command may take long, so there's no limit by default
+                # to wait for its end, but the timeout and the deadlines.
+                data = self._expect.read_until(self._end_regex, timeout)
+            except (TimeoutException, socket.timeout) as err:
+                # the shell state is unknown after a timeout, so it is
+                # opened again in the next run.
+                self.close()
+                raise socket.timeout(str(err) or "no sentinel read")
+            except Exception:
+                self.close()
+                raise
+            if data is None:
+                self.close()
+                raise paramiko.SSHException("SSH session not active")
+            match = self._end_regex.search(data,
+                                           max(0, len(data) - MATCH_OVERLAP))
+            out.append(data[:match.start()])
+            first_read_at = self._expect.first_read_at
+            ttfb = first_read_at - t0 if first_read_at else None
+            return CommandResult(int(match.group(1)), "".join(out), "",
+                                 ttfb=ttfb)
+
+    def close(self):
+        """ Closes the channel of the root shell.
+        """
+        if self._channel is not None:
+            self._channel.close()
+        self._channel = None
+        self._expect = None
+
+
+class TunnelManager(object):
+    """ This class keeps one authenticated transport per jump host (the
+    "via_host" machine) and opens the direct-tcpip channels to the target
+    hosts on demand, so many target hosts can be reached through the same
+    bastion handshake.
+    """
+
+    def __init__(self):
+        """ The transports are indexed by (host, port, user) of the bastion.
+        >>> TunnelManager().bastions()
+        []
+        """
+        self._transports = {}
+        self._lock = threading.Lock()
+
+    def bastions(self):
+        """ Returns the list of (host, port, user) of the bastion transports
+        still alive.
+        """
+        with self._lock:
+            return [k for k, t in self._transports.items() if t.is_active()]
+
+    def get_bastion(self, host, port, user, password):
+        """ Gets the authenticated transport of the bastion, it is only built
+        again in case it is not active anymore.
+        """
+        key = (host, port, user)
+        with self._lock:
+            transport = self._transports.get(key)
+            if transport is not None and transport.is_active():
+                return transport
+            if transport is not None:
+                transport.close()
+            transport = paramiko.Transport((host, port))
+            transport.start_client()
+            transport.auth_password(user, password)
+            self._transports[key] = transport
+            return transport
+
+    def adopt(self, host, port, user, transport):
+        """ Registers an already authenticated transport as the bastion for
+        the given host, port and user.
+        """
+        with self._lock:
+            self._transports[(host, port, user)] = transport
+
+    def open_tunnel(self, via_host, via_port, via_user, via_password, host,
+                    port):
+        """ Opens a direct-tcpip channel to host:port through the bastion. In
+        case the bastion died since it was last used, it's built again once.
+        A channel refused by the bastion, e.g.: the host is down, is raised
+        as is, the bastion is still in use by the other tunnels.
+        """
+        for attempt in (1, 2):
+            bastion = self.get_bastion(via_host, via_port, via_user,
+                                       via_password)
+            try:
+                # setup forwarding from 127.0.0.1:<free_random_port> to |host|
+                return bastion.open_channel('direct-tcpip', (host, port),
+                                            ('127.0.0.1', 0))
+            except paramiko.ChannelException:
+                raise
+            except (paramiko.SSHException, socket.error, EOFError):
+                if attempt == 2 or bastion.is_active():
+                    raise
+                bastion.close()
+
+    def close(self):
+        """ Closes all the bastion transports.
+        """
+        with self._lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._transports = {}
+
+
+tunnels = TunnelManager()
+
+
 class SSHConnection(object):
 
     def __init__(self, *args, **kwargs):
-        self.client = SshClient(*args, **kwargs)
+        """ The connection arguments are the ones of the SshClient, or of the
+        client_class given as keyword argument. An already built client may
+        be borrowed as well, with the "client" keyword argument, and then it
+        is not closed on exit.
+        """
+        self.borrowed = 'client' in kwargs
+        if self.borrowed:
+            self.client = kwargs['client']
+        else:
+            client_class = kwargs.pop('client_class', SshClient)
+            self.client = client_class(*args, **kwargs)
 
     def __enter__(self):
         self.client.connect()
         return self.client
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.client.close()
+        if not self.borrowed:
+            self.client.close()
+
+
+# the number of retries done by the retry_if_fail decorator below, by host.
+retries_done = Counter()
+_retries_lock = threading.Lock()
 
 
 def retry_if_fail(retries, interval=10):
@@ -37,6 +448,9 @@ def retry_if_fail(retries, interval=10):
         @wraps(func)
         def wrapper(ssh, *args, **kwargs):
             def _run(count):
+                # the transport in use, other threads may connect again while
+                # this one is failing.
+                transport = ssh.transport
                 try:
                     return func(ssh, *args, **kwargs)
                 except paramiko.SSHException as err:
@@ -45,11 +459,13 @@ def retry_if_fail(retries, interval=10):
                         "Authentication failed" in str(err)) \
                             and count < retries:
                         count += 1
+                        with _retries_lock:
+                            retries_done[ssh.host] += 1
                         ssh.log(str(err))
                         ssh.log('Retrying to run "%s" for the %s time.' %
                                 (func.__name__, s(count)))
-                        time.sleep(interval)
-                        ssh.close()
+                        sleep(interval)
+                        ssh.reset(transport)
                         return _run(count)
                     else:
                         exc_type, exc_val, exc_tb = sys.exc_info()
@@ -69,7 +485,10 @@ class SshClient(object):
     """
 
     def __init__(self, host, user, password=None, port=22, via_host=None,
-                 via_user=None, via_password=None, via_port=22):
+                 via_user=None, via_password=None, via_port=22,
+                 expect_timeout=EXPECT_TIMEOUT, persistent_su=False,
+                 tunnel_manager=None, max_sessions=MAX_SESSIONS,
+                 spill_threshold=SPILL_THRESHOLD, recorder=None):
         """ This constructor requires the connection arguments.
         >>> SshClient("host", "user")
         <SshClient host 22>
@@ -81,6 +500,21 @@ class SshClient(object):
         True
         >>> client._ssh is None
         True
+
+        With persistent_su, the commands executed with su are piped through
+        a single root shell per host instead of a "su -c" per command.
+
+        The connections via_host go through the tunnel_manager, by default
+        the module "tunnels" instance shared by all the clients.
+
+        The max_sessions is the maximum number of channels opened at the same
+        time by run_concurrently(), it must respect the sshd MaxSessions.
+
+        The outputs bigger than spill_threshold are moved to a temporary file
+        while they are read.
+
+        The recorder is an optional session.SessionRecorder instance that
+        writes every command executed by run() in a session file.
         """
         self.host = host
         self.user = user
@@ -90,6 +524,17 @@ class SshClient(object):
         self.via_user = via_user
         self.via_password = via_password
         self.via_port = via_port
+        self.expect_timeout = expect_timeout
+        self.persistent_su = persistent_su
+        self.tunnels = tunnel_manager or tunnels
+        self.max_sessions = max_sessions
+        self.spill_threshold = spill_threshold
+        self.recorder = recorder
+        self._connect_lock = threading.RLock()
+        # the root shell is shared by the threads running commands with su.
+        self._shell_lock = threading.Lock()
+        self._root_shell = None
+        self._tunnel = None
         self._ssh = None
         self.transport = None
 
@@ -125,13 +570,8 @@ class SshClient(object):
     def ssh(self):
         """ Gets the paramiko SshClient object connected.
         """
-        if self._ssh is not None:
-            if not self.is_connected():
-                self.debug("connection lost to NAS server, will "
-                           "try again now")
-                self.connect()
-            return self._ssh
-        self.connect()
+        if not self.is_connected():
+            self.connect()
         return self._ssh
 
     @retry_if_fail(5)
@@ -139,18 +579,32 @@ class SshClient(object):
         """ Builds the paramiko.SshClient object, sets
         the system keys, the missing host key (for .ssh/know_host file) and try
         to establish the SSH connection.
+
+        In both cases, directly or via the "via_host" machine, the
+        authenticated transport is kept in self.transport, so the exec
+        channels and the SFTP session share the same SSH handshake.
         """
-        if self._ssh is not None:
+        with self._connect_lock:
+            self._connect()
+
+    def _connect(self):
+        """ Does the actual connection, see the connect() method above.
+        """
+        if self.is_connected():
             return
+        if self.transport is not None or self._ssh is not None:
+            self.debug("connection lost to %s, will try again now" %
+                       self.host)
+            self.close()
         if self.via_host:
-            t0 = paramiko.Transport(self.via_host)
-            t0.start_client()
-            t0.auth_password(self.via_user, self.via_password)
-            # setup forwarding from 127.0.0.1:<free_random_port> to |host|
-            channel = t0.open_channel('direct-tcpip', (self.host,
-                                                       self.port),
-                                      ('127.0.0.1', 0))
-            self.transport = paramiko.Transport(channel)
+            # the bastion transport is reused, only the tunnel to this host
+            # and its own transport are built here.
+            self._tunnel = self.tunnels.open_tunnel(self.via_host,
+                                                    self.via_port,
+                                                    self.via_user,
+                                                    self.via_password,
+                                                    self.host, self.port)
+            self.transport = paramiko.Transport(self._tunnel)
             self.transport.start_client()
             self.transport.auth_password(self.user,
                                          self.password)
@@ -161,129 +615,186 @@ class SshClient(object):
             self.debug("connecting to the NAS server")
             self._ssh.connect(self.host, self.port, self.user, self.password,
                               timeout=CONNECT_TIMEOUT)
+            self.transport = self._ssh.get_transport()
             self.debug("connection to the NAS server has been established.")
 
     def is_connected(self):
         """ Checks the SSH connectivity.
+        >>> SshClient("host", "user").is_connected()
+        False
         """
-        transport = self._ssh.get_transport() if self._ssh else None
-        return bool(transport and transport.is_active())
+        if self._tunnel is not None and self._tunnel.closed:
+            return False
+        return bool(self.transport and self.transport.is_active())
 
-    def _via_run(self, cmd, su=None, expects=None):
-        """ Executes a command using self.transport object to open a channel
-        inside the "via_host" machine.
+    def get_transport(self):
+        """ Gets the authenticated paramiko Transport of this host, it
+        connects again in case the connection is lost.
         """
-        if self.transport is None:
+        if not self.is_connected():
             self.connect()
-        ch = self.transport.open_session()
-        ch.set_combine_stderr(True)
-        if su:
-            ch.get_pty()
-            cmd = cmd.replace('$', '\$')
-            cmd = 'su -c "%s"' % cmd
-        ch.exec_command(cmd)
-        if su:
-            time.sleep(2)
-            buf = ''
-            while ch.recv_ready():
-                resp = ch.recv(1024)
-                if resp:
-                    buf += resp
-            time.sleep(1)
-            ch.send('%s\n' % su)
-        buf = ''
-        while ch.recv_ready():
-            resp = ch.recv(1024)
-            if resp:
-                buf += resp
-        if expects:
-            time.sleep(1)
-            for exp in expects:
-                time.sleep(1)
-                ch.send('%s\n' % exp)
-        status = ch.recv_exit_status()
-        buf = ''
-        while ch.recv_ready():
-            time.sleep(0.5)
-            resp = ch.recv(1024)
-            if resp:
-                buf += resp
-        if status == 0:
-            out = ["%s\n" % i for i in buf.splitlines()]
-            err = ""
-        else:
-            out = ""
-            err = ["%s\n" % i for i in buf.splitlines()]
-        return status, out, err
-
-    def _normal_run(self, cmd, timeout=None, su=None, expects=None):
-        """ Uses the paramiko SSHClient to execute a cmd.
-        """
-        ssh_kwargs = dict(get_pty=True)
-        if su:
-            cmd = cmd.replace('$', '\$')
-            cmd = 'su -c "%s"' % cmd
-        stdin, stdout, stderr = self.ssh.exec_command(cmd,
-                                     timeout=timeout, **ssh_kwargs)
-        if su:
-            time.sleep(1)
-            stdin.write('%s\n' % su)
-            stdin.flush()
-        if expects:
-            for exp in expects:
-                time.sleep(1)
-                stdin.write('%s\n' % exp)
-                stdin.flush()
-        self.debug("the paramiko exec_command ran successfully (%s)"
-                   % cmd)
-        out = stdout.readlines()
-        self.debug("paramiko stdout.readlines() ran successfully (%s)"
-                   % cmd)
-        err = stderr.readlines()
-        self.debug("paramiko stderr.readlines() ran successfully (%s)"
-                   % cmd)
-        # IMPORTANT: the exit status must be caught after reading the
-        # stdout and stderr, since the timeout exception will be only
-        # raised by reading those buffers. Paramiko may hangs while
-        # executing recv_exit_status before reading the buffers.
-        status = stdout.channel.recv_exit_status()
+        return self.transport
+
+    def _open_session(self):
+        """ Opens a new channel on the transport in use, either the direct
+        one or the one tunneled through the "via_host" machine.
+        """
+        return self.get_transport().open_session()
+
+    def _execute(self, cmd, timeout=None, su=None, expects=None):
+        """ Executes a cmd in a new channel. In case of su or expects, the
+        input is sent as soon as the corresponding prompt is read from the
+        channel, instead of waiting a fixed amount of time. It returns a
+        CommandResult with the time to first byte set.
+        """
+        t0 = time.time()
+        channel = self._open_session()
+        try:
+            channel.set_combine_stderr(True)
+            if su or not self.via_host:
+                channel.get_pty()
+            if su:
+                cmd = cmd.replace('$', '\$')
+                cmd = 'su -c "%s"' % cmd
+            channel.exec_command(cmd)
+            self.debug("the paramiko exec_command ran successfully (%s)"
+                       % cmd)
+            expect = ChannelExpect(channel, self.expect_timeout,
+                                   self.spill_threshold)
+            out = []
+            if su:
+                # the prompt and the echoed new line are not part of the
+                # command output.
+                if expect.expect(PASSWORD_PROMPT) is not None:
+                    channel.sendall('%s\n' % su)
+                    expect.expect(LINE_END)
+            for exp in expects or []:
+                prompt = expect.expect(INPUT_PROMPT)
+                if prompt is None:
+                    break
+                out.append(prompt)
+                channel.sendall('%s\n' % exp)
+            out.append(expect.read_until_eof(timeout))
+            # IMPORTANT: the exit status must be caught after reading the
+            # output, since the timeout exception will be only raised by
+            # reading it. Paramiko may hangs while executing
+            # recv_exit_status before reading the buffers.
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        out = "".join(out)
+        ttfb = expect.first_read_at - t0 if expect.first_read_at else None
         if status != 0:
             self.debug("paramiko status: %s (%s)" % (status, cmd))
-            err = out + err
-            out = []
-        return status, out, err
+            return CommandResult(status, "", out, ttfb=ttfb)
+        return CommandResult(status, out, "", ttfb=ttfb)
+
+    def _shell_run(self, cmd, timeout=None, su=None, expects=None):
+        """ Executes a cmd through the persistent root shell of this host,
+        the commands of all the threads go through the same shell one at a
+        time.
+        """
+        with self._shell_lock:
+            shell = self._root_shell
+            if shell is None or shell.su_password != su:
+                if shell is not None:
+                    shell.close()
+                shell = self._root_shell = RootShell(self, su)
+        result = shell.run(cmd, timeout, expects)
+        status, out, _ = result
+        if status != 0:
+            self.debug("root shell status: %s (%s)" % (status, cmd))
+            return CommandResult(status, "", out, ttfb=result.ttfb)
+        return result
 
     @retry_if_fail(5)
     def run(self, cmd, timeout=None, su=None, expects=None):
         """ Uses paramiko SshClient object to execute commands remotely and
-        retrieves the correspond standard output and standard error.
+        retrieves the correspond standard output and standard error, as a
+        CommandResult carrying the wall time and the time to first byte.
         """
         self.debug("running (%s)" % cmd)
+        requested, timeout = timeout, remaining_time(timeout)
+        t0 = time.time()
         try:
-            if self.via_host:
-                status, out, err = self._via_run(cmd, su, expects)
+            if su and self.persistent_su:
+                result = self._shell_run(cmd, timeout, su, expects)
             else:
-                status, out, err = self._normal_run(cmd, timeout, su, expects)
+                result = self._execute(cmd, timeout, su, expects)
         except socket.timeout as err:
+            deadline = Deadline.closest()
+            if deadline is not None:
+                deadline.check()
+                # the timeout was cut by the deadline, so it's the deadline
+                # that was exceeded, even if it's not expired just yet.
+                if requested is None or timeout < requested:
+                    raise DeadlineExceeded("The time budget of %s seconds of "
+                                           "the %s was exceeded." %
+                                           (deadline.seconds, deadline.name))
             raise TimeoutException("A timeout of %s seconds "
                                    "occurred after trying to execute"
                                    "the following command remotely "
                                    "through SSH: \"%s\". Error: %s" % (
                                    timeout, cmd, str(err)))
         self.debug("ran (%s)" % cmd)
-        return status, "".join(out), "".join(err)
+        status, out, err = result
+        result.started = t0
+        result.duration = time.time() - t0
+        if self.recorder is not None:
+            self.recorder.record(self.host, cmd, su, status, out, err,
+                                 result.duration)
+        return result
+
+    def run_concurrently(self, cmds, timeout=None, su=None,
+                         max_sessions=None):
+        """ Executes the cmds concurrently, each one in its own channel of
+        the same transport, and retrieves the list of (status, out, err) in
+        the same order of the cmds. At most max_sessions channels are opened
+        at the same time. It's meant for read-only commands, since there's no
+        guarantee of the order of execution.
+        """
+        self.connect()
+        max_sessions = max_sessions or self.max_sessions
+        return run_in_pool(lambda cmd: self.run(cmd, timeout, su), cmds,
+                           max_sessions)
+
+    def reset(self, transport):
+        """ Closes the connection after a command failed on the given
+        transport, so the next one connects again. The connection is kept in
+        case the transport is still alive, e.g.: only the channel of the
+        command was lost, or another thread already connected again, since
+        the other threads may be running commands on it.
+        """
+        with self._connect_lock:
+            if transport is not self.transport or self.is_connected():
+                return
+            self.close()
 
     def close(self):
         """ Closes the ssh connection properly.
         """
-        self.debug("closing ssh")
-        if self._ssh is not None:
-            self._ssh.close()
-        self._ssh = None
-        self.debug("closed ssh")
+        with self._connect_lock:
+            self.debug("closing ssh")
+            if self._root_shell is not None:
+                self._root_shell.close()
+                self._root_shell = None
+            if self._ssh is not None:
+                self._ssh.close()
+            elif self.transport is not None:
+                self.transport.close()
+            if self._tunnel is not None:
+                self._tunnel.close()
+            self._ssh = None
+            self._tunnel = None
+            self.transport = None
+            self.debug("closed ssh")
 
 
 class SshScpClient(SshClient):
+    """ This class adds the SFTP features to the SshClient. The SFTP session
+    is opened lazily on the same transport used by the exec channels, so it
+    also works through the "via_host" machine.
+    """
 
     def __init__(self, *args, **kwargs):
         super(SshScpClient, self).__init__(*args, **kwargs)
@@ -291,19 +802,18 @@ class SshScpClient(SshClient):
 
     @property
     def sftp(self):
-        if self._sftp is not None:
-            return self._sftp
-        self.connect()
+        """ Gets the SFTP session, opening it in case it is not opened yet or
+        the transport was connected again in the meantime.
+        """
+        transport = self.get_transport()
+        if self._sftp is not None and \
+           self._sftp.get_channel().get_transport() is not transport:
+            self._sftp = None
+        if self._sftp is None:
+            self.debug("opening sftp")
+            self._sftp = paramiko.SFTPClient.from_transport(transport)
         return self._sftp
 
-    def connect(self):
-        super(SshScpClient, self).connect()
-        if self._sftp is not None:
-            return
-        t = paramiko.Transport((self.host, self.port))
-        t.connect(username=self.user, password=self.password)
-        self._sftp = paramiko.SFTPClient.from_transport(t)
-
     def get(self, path):
         self.sftp.get(path)
 
@@ -315,8 +825,9 @@ class SshScpClient(SshClient):
         self.debug("Put %s to %s: SUCCESS!" % (source, dest))
 
     def close(self):
-        super(SshScpClient, self).close()
         self.debug("closing sftp")
-        self.sftp.close()
+        if self._sftp is not None:
+            self._sftp.close()
         self._sftp = None
         self.debug("closed sftp")
+        super(SshScpClient, self).close()
@@ -0,0 +1,136 @@
+""" Persisted state of the previous runs, used to skip the topics whose
+inputs have not changed since their last successful check.
+"""
+import json
+import os
+import threading
+import time
+
+from node_hardening.utils import resources_overlap
+
+# commands giving a fingerprint of the resources that are not files.
+FINGERPRINTS = {
+    'packages': 'stat -c %Y /var/lib/rpm /var/lib/rpm/Packages',
+    'selinux': '/usr/sbin/sestatus | sha256sum',
+}
+
+
+def fingerprint_command(resource):
+    """ Returns the command that gives a fingerprint of the resource, or None
+    in case it can't be fingerprinted, e.g. "ports" or "litp:plan".
+    >>> fingerprint_command('file:/etc/issue')
+    'sha256sum /etc/issue'
+    >>> fingerprint_command('file:/etc/cron.d/')
+    'ls -la --full-time /etc/cron.d/ | sha256sum'
+    >>> fingerprint_command('sysctl:net.ipv4.conf.all.forwarding')
+    '/sbin/sysctl net.ipv4.conf.all.forwarding | sha256sum'
+    >>> fingerprint_command('service:sshd') is None
+    True
+    """
+    if resource.startswith('file:/'):
+        path = resource[len('file:'):]
+        if path.endswith('/'):
+            return "ls -la --full-time %s | sha256sum" % path
+        return "sha256sum %s" % path
+    # only single parameters, since "sysctl -a" has values changing at
+    # every read, e.g.: kernel.random.uuid.
+    if resource.startswith('sysctl:') and resource != 'sysctl:':
+        return "/sbin/sysctl %s | sha256sum" % resource[len('sysctl:'):]
+    return FINGERPRINTS.get(resource)
+
+
+class HostState(object):
+    """ This class keeps the fingerprints of the resources read by the
+    topics that passed the check in the previous run, in the JSON file
+    <state_dir>/<host>.json. A topic is skipped in the next run in case its
+    expected value and the fingerprints of all its resources are the same.
+    """
+
+    def __init__(self, state_dir, host):
+        self.filename = os.path.join(state_dir, '%s.json' % host)
+        self.fingerprints = {}
+        self._topics = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.filename):
+            with open(self.filename) as state_file:
+                self._topics = json.load(state_file)
+
+    @staticmethod
+    def _key(hardener_class):
+        return "%s.%s" % (hardener_class.section, hardener_class.topic)
+
+    def gather(self, ssh_runner, hardener_classes):
+        """ Gets the fingerprints of all the resources read by the
+        hardener_classes in a single remote execution.
+        """
+        resources = set()
+        for hardener_class in hardener_classes:
+            resources.update(hardener_class.reads or [])
+        resources = sorted([r for r in resources if fingerprint_command(r)])
+        cmds = [fingerprint_command(r) for r in resources]
+        _, results = ssh_runner.execute_many(cmds, stop_on_failure=False)
+        self.fingerprints = dict([(res, out.strip())
+                                  for res, (code, out) in
+                                  zip(resources, results) if code == 0])
+
+    def invalidate_resources(self, resources):
+        """ Forgets the fingerprints of the given resources, or all of them in
+        case resources is None, after a harden step wrote them.
+        """
+        with self._lock:
+            for resource in self.fingerprints.keys():
+                if resources is None or \
+                   any(resources_overlap(resource, r) for r in resources):
+                    del self.fingerprints[resource]
+
+    def _current(self, hardener_class):
+        """ Returns the current fingerprints of the resources read by the
+        hardener, or None in case any of them is unknown.
+        """
+        if not hardener_class.reads:
+            return None
+        with self._lock:
+            fingerprints = dict(self.fingerprints)
+        current = {}
+        for resource in hardener_class.reads:
+            if resource not in fingerprints:
+                return None
+            current[resource] = fingerprints[resource]
+        return current
+
+    def is_unchanged(self, hardener_class, topic):
+        """ Returns the time of the previous check in case the topic passed it
+        and its inputs have not changed since then, otherwise None.
+        """
+        with self._lock:
+            previous = self._topics.get(self._key(hardener_class))
+        current = self._current(hardener_class)
+        if previous is None or current is None:
+            return None
+        if previous['expected'] != repr(topic.expected_value) or \
+           previous['fingerprints'] != current:
+            return None
+        return previous['time']
+
+    def record(self, hardener_class, topic, passed):
+        """ Records whether the topic passed the check or not in this run.
+        """
+        current = self._current(hardener_class) if passed else None
+        with self._lock:
+            key = self._key(hardener_class)
+            if current is None:
+                self._topics.pop(key, None)
+            elif key not in self._topics or \
+                 self._topics[key]['fingerprints'] != current:
+                self._topics[key] = {'expected': repr(topic.expected_value),
+                                     'fingerprints': current,
+                                     'time': time.time()}
+
+    def save(self):
+        with self._lock:
+            content = json.dumps(self._topics, indent=1, sort_keys=True)
+        state_dir = os.path.dirname(self.filename)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        with open(self.filename, 'w') as state_file:
+            state_file.write(content)
@@ -0,0 +1,134 @@
+""" Records the spans of the hardening runs in the Chrome trace-event format,
+to be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TraceRecorder(object):
+    """ This class records the spans of the runs of one or many hosts, and
+    writes them as "complete" trace events. Each host is a process of the
+    trace. Its spans (connect, topic phases, LITP plan, report) are in the
+    track of the thread running them, and its SSH commands are laid out in
+    "channel" tracks, a new one for each command overlapping the others.
+    >>> trace = TraceRecorder()
+    >>> with trace.span('connect', 'ms1', 'ssh'):
+    ...     trace.add_command('ms1', 'ls', time.time(), 0.1)
+    >>> sorted(set(e['name'] for e in trace.trace_events()))
+    ['connect', 'ls', 'process_name', 'thread_name']
+    """
+
+    def __init__(self):
+        self._spans = []
+        self._commands = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def _thread(self):
+        """ Returns the track number of the current thread.
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = (len(self._threads) + 1,
+                                               thread.name)
+            return self._threads[thread.ident][0]
+
+    def add_span(self, name, host, category, start, duration, **args):
+        """ Records a span of the host in the track of the current thread.
+        :param name: str
+        :param host: str
+        :param category: str, e.g.: "ssh", "topic", "litp", "report"
+        :param start: float, the epoch time it started
+        :param duration: float, seconds
+        :return: None
+        """
+        tid = self._thread()
+        with self._lock:
+            self._spans.append((host, tid, name, category, start, duration,
+                                args))
+
+    @contextmanager
+    def span(self, name, host, category, **args):
+        """ Records the span of the "with" block, see add_span().
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, host, category, start, time.time() - start,
+                          **args)
+
+    def add_command(self, host, cmd, start, duration, **args):
+        """ Records an SSH command of the host, it's laid out in a channel
+        track when the trace is written.
+        :param host: str
+        :param cmd: str
+        :param start: float, the epoch time it started
+        :param duration: float, seconds
+        :return: None
+        """
+        with self._lock:
+            self._commands.append((host, cmd, start, duration, args))
+
+    def trace_events(self):
+        """ Returns the list of the trace events recorded, the timestamps are
+        in microseconds.
+        :return: list of dicts
+        """
+        with self._lock:
+            spans = list(self._spans)
+            commands = sorted(self._commands, key=lambda c: c[2])
+            threads = dict(self._threads.values())
+        hosts = []
+        for host in [s[0] for s in spans] + [c[0] for c in commands]:
+            if host not in hosts:
+                hosts.append(host)
+        pids = dict([(host, index + 1) for index, host in enumerate(hosts)])
+        events = []
+        tracks = set()
+
+        def add(host, tid, name, category, start, duration, args):
+            tracks.add((host, tid))
+            events.append({'name': name, 'cat': category, 'ph': 'X',
+                           'ts': int(start * 1e6),
+                           'dur': int(duration * 1e6), 'pid': pids[host],
+                           'tid': tid, 'args': args})
+
+        for span in spans:
+            add(*span)
+        # the channel tracks start after the thread ones, a command goes in
+        # the first channel that is free at the time it started.
+        first_channel = len(threads) + 1
+        channels = {}
+        for host, cmd, start, duration, args in commands:
+            ends = channels.setdefault(host, [])
+            for index, end in enumerate(ends):
+                if end <= start:
+                    break
+            else:
+                index = len(ends)
+                ends.append(0)
+            ends[index] = start + duration
+            add(host, first_channel + index, cmd, 'command', start, duration,
+                args)
+        for host in hosts:
+            events.append({'name': 'process_name', 'ph': 'M',
+                           'pid': pids[host], 'args': {'name': host}})
+        for host, tid in sorted(tracks):
+            name = threads.get(tid) or "channel %s" % (tid - first_channel + 1)
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': pids[host], 'tid': tid,
+                           'args': {'name': name}})
+        return events
+
+    def write(self, filename):
+        """ Writes the trace file in the JSON object format.
+        :param filename: str
+        :return: None
+        """
+        with open(filename, 'w') as trace_file:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, trace_file)
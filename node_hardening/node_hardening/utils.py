@@ -1,6 +1,9 @@
 import re
 import os
 import sys
+import threading
+import time
+import Queue
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
@@ -40,3 +43,224 @@ def import_module(name, package=None):
         name = _resolve_name(name[level:], package, level)
     __import__(name)
     return sys.modules[name]
+
+
+class DeadlineExceeded(Exception):
+    """ This exception is raised when the time budget of a topic or of the
+    whole run is exceeded.
+    """
+
+
+class Deadline(object):
+    """ A time budget in seconds, where None means no budget at all. It is
+    in effect in the thread running the "with" block, the blocking calls
+    (e.g. ssh commands, retries and LITP plan waits) are bounded by the
+    closest deadline in effect.
+    >>> with Deadline(60, 'run'):
+    ...     with Deadline(None, 'topic'):
+    ...         0 < remaining_time(120) <= 60
+    True
+    >>> remaining_time(5)
+    5
+    """
+
+    _local = threading.local()
+
+    def __init__(self, seconds=None, name='deadline'):
+        self.seconds = seconds
+        self.name = name
+        self.expires = time.time() + seconds if seconds else None
+
+    def remaining(self):
+        """ Returns the seconds left, or None in case there's no budget.
+        """
+        if self.expires is None:
+            return None
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def check(self):
+        """ Raises the DeadlineExceeded in case the deadline is expired.
+        """
+        if self.expired():
+            raise DeadlineExceeded("The time budget of %s seconds of the %s "
+                                   "was exceeded." % (self.seconds, self.name))
+
+    @classmethod
+    def active(cls):
+        """ Returns the list of the deadlines in effect in this thread.
+        """
+        return list(getattr(cls._local, 'stack', []))
+
+    @classmethod
+    def inherit(cls, deadlines):
+        """ Puts the deadlines of another thread in effect in this one,
+        e.g.: in the worker threads of a pool.
+        """
+        cls._local.stack = list(deadlines)
+
+    @classmethod
+    def closest(cls):
+        """ Returns the deadline in effect that expires first, or None.
+        """
+        deadlines = [d for d in cls.active() if d.expires is not None]
+        if not deadlines:
+            return None
+        return min(deadlines, key=lambda d: d.expires)
+
+    def __enter__(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.stack.remove(self)
+
+
+def remaining_time(timeout=None):
+    """ Returns the timeout bounded by the closest deadline in effect in this
+    thread, or raises the DeadlineExceeded in case it's already expired.
+    :param timeout: float, seconds or None
+    :return: float or None
+    """
+    deadline = Deadline.closest()
+    if deadline is None:
+        return timeout
+    deadline.check()
+    remaining = deadline.remaining()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def sleep(seconds):
+    """ Sleeps for the given seconds, unless the closest deadline in effect
+    comes first, then the DeadlineExceeded is raised.
+    """
+    time.sleep(max(0, remaining_time(seconds)))
+    deadline = Deadline.closest()
+    if deadline is not None:
+        deadline.check()
+
+
+def run_in_pool(func, items, workers):
+    """ Calls func for each one of the items using up to "workers" threads,
+    and returns the list of results in the same order of the items. In case
+    func raises an exception, the first one (in the order of the items) is
+    raised again once all the threads are finished.
+    >>> run_in_pool(lambda x: x * 2, [3, 1, 2], 2)
+    [6, 2, 4]
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    queue = Queue.Queue()
+    for index, item in enumerate(items):
+        queue.put((index, item))
+    deadlines = Deadline.active()
+
+    def worker():
+        Deadline.inherit(deadlines)
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception:
+                errors.append((index, sys.exc_info()))
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        exc_type, exc_val, exc_tb = sorted(errors)[0][1]
+        raise exc_type, exc_val, exc_tb
+    return results
+
+
+def run_dag(func, items, depends, workers):
+    """ Calls func for each one of the items using up to "workers" threads,
+    the same as run_in_pool(), but an item is only started once all the
+    items it depends on are finished. The depends argument maps the index of
+    an item to the indexes of the items it depends on, which must come
+    before it in the list, so there are no cycles. With a single worker, the
+    items are called in the same order of the list.
+    >>> run_dag(lambda x: x * 2, [3, 1, 2], {2: [0]}, 2)
+    [6, 2, 4]
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    pending = dict((i, set(depends.get(i, ()))) for i in range(len(items)))
+    dependents = dict((i, []) for i in range(len(items)))
+    for index, deps in pending.items():
+        for dep in deps:
+            dependents[dep].append(index)
+    ready = sorted([i for i, deps in pending.items() if not deps])
+    state = {'finished': 0}
+    cond = threading.Condition()
+    deadlines = Deadline.active()
+
+    def worker():
+        Deadline.inherit(deadlines)
+        while True:
+            with cond:
+                while not ready and state['finished'] < len(items):
+                    cond.wait()
+                if not ready:
+                    return
+                index = ready.pop(0)
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                errors.append((index, sys.exc_info()))
+            with cond:
+                state['finished'] += 1
+                for dependent in dependents[index]:
+                    pending[dependent].discard(index)
+                    if not pending[dependent]:
+                        ready.append(dependent)
+                ready.sort()
+                cond.notify_all()
+
+    if workers <= 1 or len(items) <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(workers, len(items)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        exc_type, exc_val, exc_tb = sorted(errors)[0][1]
+        raise exc_type, exc_val, exc_tb
+    return results
+
+
+def resources_overlap(res1, res2):
+    """ Checks whether two resource names refer to the same thing. A name
+    ending with ":" or "/" covers all the names starting with it.
+    >>> resources_overlap('file:/etc/issue', 'file:/etc/issue')
+    True
+    >>> resources_overlap('file:/etc/pam.d/', 'file:/etc/pam.d/system-auth')
+    True
+    >>> resources_overlap('service:', 'service:sshd')
+    True
+    >>> resources_overlap('file:/etc/issue', 'file:/etc/issue.net')
+    False
+    """
+    if res1 == res2:
+        return True
+    short, long_ = sorted([res1, res2], key=len)
+    return short[-1:] in (':', '/') and long_.startswith(short)
@@ -3,6 +3,8 @@ import sys
 from commands import getstatusoutput
 
 from node_hardening.runner import run_node_hardening
+from node_hardening.fleet import run_fleet
+from node_hardening.cluster import run_cluster
 
 
 def get_arguments():
@@ -26,6 +28,10 @@ def get_arguments():
                         help='The host port')
     parser.add_argument('--su-password', '-s', dest='su_password',
                         help='The su password')
+    parser.add_argument('--persistent-su', dest='persistent_su',
+                        required=False, action='store_true',
+                        help='Opens a single root shell with the su password '
+                             'and runs all the commands through it.')
     parser.add_argument('--via-host', '-o', dest='via_host',
                         help='Connects to the host defined in the argument'
                              '"host" via this host --via-host.')
@@ -33,6 +39,93 @@ def get_arguments():
                         help='The username of the above host')
     parser.add_argument('--via-password', '-a', dest='via_password',
                         help='The password of the above user')
+    parser.add_argument('--topic-workers', dest='topic_workers', type=int,
+                        default=1, required=False,
+                        help='The number of topics processed at the same '
+                             'time, the harden steps run concurrently as well '
+                             'unless they touch the same resources, e.g.: the '
+                             'same file or the LITP model.')
+    parser.add_argument('--audit', dest='audit', required=False,
+                        action='store_true',
+                        help="Only checks the topics and reports the drift "
+                             "from the description, the host is never "
+                             "changed.")
+    parser.add_argument('--state-dir', dest='state_dir', required=False,
+                        help='Keeps the state of the topics checked in this '
+                             'directory, the next runs skip the topics whose '
+                             'inputs have not changed since then.')
+    parser.add_argument('--topic-timeout', dest='topic_timeout', type=float,
+                        required=False,
+                        help='The time budget in seconds of each topic, a '
+                             'topic exceeding it is cancelled and the run '
+                             'moves on. The topics may define their own.')
+    parser.add_argument('--run-timeout', dest='run_timeout', type=float,
+                        required=False,
+                        help='The time budget in seconds of the whole run of '
+                             'a host, the topics still running when it is '
+                             'exceeded are cancelled.')
+    parser.add_argument('--profile', dest='profile_dir', required=False,
+                        help='Profiles each topic and the report, and writes '
+                             'a pstats file per topic and one for the whole '
+                             'run in this directory.')
+    parser.add_argument('--profile-memory', dest='profile_memory',
+                        required=False, action='store_true',
+                        help='Writes the growth of the peak memory of the '
+                             'process during each topic in the --profile '
+                             'directory as well.')
+    parser.add_argument('--events', dest='events_to', required=False,
+                        help='Writes the progress of the run as JSON-lines '
+                             'events in this file or pipe, "-" is the '
+                             'standard output and then the console output '
+                             'goes to the standard error.')
+    parser.add_argument('--trace', dest='trace_to', required=False,
+                        help='Writes the spans of the run in this file in the '
+                             'Chrome trace-event format. In the --inventory '
+                             'mode, a <host>.trace.json file is written per '
+                             'host in the --report-dir instead.')
+    parser.add_argument('--metrics', dest='metrics_to', required=False,
+                        help='Writes the metrics of the run in this file in '
+                             'the Prometheus text format, e.g.: in the '
+                             'directory of the node exporter textfile '
+                             'collector. In the --inventory mode, a '
+                             '<host>_<file name> file is written per host in '
+                             'the same directory instead.')
+    parser.add_argument('--record', dest='record_to', required=False,
+                        help='Records every command executed, its output, '
+                             'status code and latency in this session file.')
+    parser.add_argument('--replay', dest='replay_from', required=False,
+                        help="Doesn't connect to the host, replays the "
+                             "session file recorded with --record instead.")
+    parser.add_argument('--replay-latency', dest='replay_latency',
+                        required=False, action='store_true',
+                        help='Replays the recorded latencies as well.')
+    parser.add_argument('--inventory', '-i', dest='inventory',
+                        required=False,
+                        help='Hardens all the hosts of this inventory file '
+                             'instead of a single --host.')
+    parser.add_argument('--cluster', '-c', dest='cluster', required=False,
+                        action='store_true',
+                        help='The --host is a LITP MS, hardens it and all the '
+                             'nodes of its deployments through it.')
+    parser.add_argument('--node-user', dest='node_user', required=False,
+                        help='The username of the nodes in the --cluster '
+                             'mode, default is the --user.')
+    parser.add_argument('--node-password', dest='node_password',
+                        required=False,
+                        help='The password of the above user, default is '
+                             'the --password.')
+    parser.add_argument('--node-su-password', dest='node_su_password',
+                        required=False,
+                        help='The su password of the nodes, default is the '
+                             '--su-password.')
+    parser.add_argument('--workers', '-w', dest='workers', type=int,
+                        default=4, required=False,
+                        help='The number of hosts of the inventory or the '
+                             'cluster hardened at the same time.')
+    parser.add_argument('--report-dir', dest='report_dir', default='.',
+                        required=False,
+                        help='The directory of the reports, logs and summary '
+                             'of the hosts of the inventory.')
     parser.add_argument('--view-report', '-v', dest='view_report',
                         required=False, action='store_true',
                         help="Open a new tab in the Chrome browser with the "
@@ -47,6 +140,10 @@ def get_arguments():
                                              "report in html format")
 
     args = parser.parse_args()
+    if args.inventory:
+        return args
+    if args.cluster and all([args.host, args.user, args.password]):
+        return args
     if not all([args.description, args.host, args.user, args.password]):
         print
         parser.print_help()
@@ -57,10 +154,35 @@ def get_arguments():
 
 if __name__ == '__main__':
     args = get_arguments()
+    if args.events_to == '-':
+        # the standard output is left to the events, so it can be parsed,
+        # and the console output goes to the standard error.
+        sys.stdout = sys.stderr
+    if args.inventory:
+        success, filename = run_fleet(args.inventory, args.workers,
+            args.report_dir, args.topic, args.persistent_su,
+            args.topic_workers, args.audit, args.state_dir,
+            args.topic_timeout, args.run_timeout, args.events_to,
+            bool(args.trace_to), args.metrics_to)
+        print open(filename).read()
+        sys.exit(0 if success else 244)
+    if args.cluster:
+        success, filename = run_cluster(args.host, args.user, args.password,
+            int(args.port), args.su_password, args.node_user,
+            args.node_password, args.node_su_password, args.workers,
+            args.report_dir, args.persistent_su, args.topic_workers,
+            args.audit, args.state_dir, args.topic_timeout, args.run_timeout,
+            args.events_to, args.trace_to, args.metrics_to)
+        print open(filename).read()
+        sys.exit(0 if success else 244)
     success, filename = run_node_hardening(args.description, args.host,
         args.user, args.password, args.port, args.su_password,
         args.via_host, args.via_user, args.via_password, args.topic,
-        args.mock_report, args.report_filename)
+        args.mock_report, args.report_filename, args.persistent_su,
+        args.record_to, args.replay_from, args.replay_latency,
+        args.topic_workers, args.audit, args.state_dir, args.topic_timeout,
+        args.run_timeout, args.profile_dir, args.profile_memory,
+        args.events_to, args.trace_to, args.metrics_to)
     if args.view_report:
         browsers = ['/usr/bin/sensible-browser', '/usr/bin/google-chrome',
                     '/usr/bin/firefox']
@@ -1,3 +1,5 @@
+import socket
+import time
 
 from node_hardening.ssh import SshScpClient
 
@@ -20,3 +22,77 @@ class SshScpClientMock(SshScpClient):
             if regex.match(cmd):
                 return status, '', output
         return 127, '', "%s: command not found" % cmd.split()[0]
+
+
+class FakeChannel(object):
+    """ A paramiko channel that returns the given chunks from recv(), an
+    empty string once they're over (EOF) and raises socket.timeout for the
+    None ones. Without eof, it stays silent after the chunks instead and
+    keeps raising socket.timeout. The data sent is kept in self.sent, and
+    the chunks returned by reply(data) are added for each one, if given.
+    """
+
+    def __init__(self, chunks=(), status=0, eof=True, reply=None):
+        self.chunks = list(chunks)
+        self.status = status
+        self.eof = eof
+        self.reply = reply
+        self.sent = []
+        self.timeouts = []
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeouts.append(timeout)
+
+    def recv(self, size):
+        if not self.chunks and not self.eof:
+            time.sleep(0.01)
+            raise socket.timeout()
+        if not self.chunks:
+            return ''
+        chunk = self.chunks.pop(0)
+        if chunk is None:
+            time.sleep(0.01)
+            raise socket.timeout()
+        return chunk
+
+    def sendall(self, data):
+        self.sent.append(data)
+        if self.reply is not None:
+            self.chunks += self.reply(data)
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def get_pty(self):
+        pass
+
+    def exec_command(self, cmd):
+        self.cmd = cmd
+
+    def exit_status_ready(self):
+        return self.closed
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport(object):
+    """ A paramiko transport that opens the given channels in order.
+    """
+
+    def __init__(self, channels=()):
+        self.channels = list(channels)
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def open_session(self):
+        return self.channels.pop(0)
+
+    def close(self):
+        self.active = False
@@ -1,9 +1,37 @@
 #!/usr/bin/env python
+import base64
+import json
+import os
+import paramiko
 import re
+import socket
+import tempfile
+import threading
+import time
+from commands import getstatusoutput
+from importlib import import_module
 
 from node_hardening.hardening import HardeningProcessor
+from node_hardening.hardening.base import SshRunner, CommandCache, \
+    CommandExecutionException, BaseHardening, PlanCoalescer
+from node_hardening.cluster import discover_nodes
 from node_hardening.descriptions.litp.ms import MsDescription
-from sshmock import SshScpClientMock
+from node_hardening.events import EventStream
+from node_hardening.facts import HostFacts
+from node_hardening.fleet import load_inventory, InvalidInventory
+from node_hardening.session import SessionRecorder, ReplaySshClient
+from node_hardening import ssh as ssh_module
+from node_hardening.ssh import CommandResult, ChannelExpect, \
+    TimeoutException, PASSWORD_PROMPT, LINE_END, SshClient, SshScpClient, \
+    RootShell, TunnelManager
+from node_hardening.metrics import Metrics, add_run_metrics
+from node_hardening.profiler import RunProfiler
+from node_hardening.report import command_timing
+from node_hardening.state import HostState
+from node_hardening.trace import TraceRecorder
+from node_hardening.utils import Deadline, DeadlineExceeded, sleep, \
+    run_in_pool
+from sshmock import SshScpClientMock, FakeChannel, FakeTransport
 
 from unittest import TestCase
 
@@ -13,3 +41,801 @@ class TestMsNodeHardening(TestCase):
     def setUp(self):
         description = MsDescription('MS')
         self.processor = HardeningProcessor('litp', description, '', '', '')
+
+    def test_audit(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                return -1
+
+            def harden(self):
+                raise AssertionError("harden in the audit mode")
+
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '',
+                                       audit=True)
+        processor.process_hardener(PasswordAge, SshScpClientMock('', ''))
+        topic = processor.description.login_control.password_age
+        self.assertTrue(topic.drift)
+        self.assertFalse(topic.error or topic.unhandled_error)
+        self.assertFalse(topic.harden_outputs)
+
+    def test_topic_timeout(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                sleep(5)
+
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '',
+                                       topic_timeout=0.2)
+        t0 = time.time()
+        with Deadline(60, 'run'):
+            processor.process_hardener(PasswordAge, SshScpClientMock('', ''))
+        self.assertLess(time.time() - t0, 5)
+        topic = processor.description.login_control.password_age
+        self.assertTrue(topic.timed_out)
+        self.assertIn('time budget', topic.error)
+
+    def test_run_timeout_while_gathering(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                sleep(5)
+
+        def gather():
+            sleep(5)
+
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '')
+        t0 = time.time()
+        with Deadline(0.2, 'run'):
+            processor._gather('facts', gather)
+            processor.process_hardener(PasswordAge, SshScpClientMock('', ''))
+        self.assertLess(time.time() - t0, 5)
+        topic = processor.description.login_control.password_age
+        self.assertTrue(topic.timed_out)
+        self.assertIn('of the run', topic.error)
+
+    def test_events(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                self.ssh.run('ls', silent_fail_if=[127])
+                return self.expected_value
+
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        events = EventStream(filename)
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '',
+                                       events=events)
+        processor.process_hardener(PasswordAge, SshScpClientMock('', ''))
+        events.close()
+        with open(filename) as events_file:
+            lines = [json.loads(line) for line in events_file]
+        self.assertEqual([e['event'] for e in lines],
+                         ['topic_started', 'command', 'phase_finished',
+                          'status', 'topic_finished'])
+        self.assertEqual((lines[1]['cmd'], lines[1]['code']), ('ls', 127))
+        self.assertEqual(lines[3]['status'], 'SUCCESS')
+        self.assertTrue(all(e['host'] == 'MS' and e['topic'] == 'password_age'
+                            for e in lines))
+
+    def test_trace(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                self.ssh.run_concurrently(['sleep 0.1', 'sleep 0.1'])
+                self.ssh.run_many(['true', 'true'])
+                return self.expected_value
+
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '',
+                                       trace=TraceRecorder())
+        processor.connection.client = LocalShellMock('', '')
+        processor.connect()
+        processor.process_hardener(PasswordAge, processor.connection.client)
+        events = processor.trace.trace_events()
+        spans = [(e['name'], e['tid']) for e in events if e['ph'] == 'X']
+        names = dict((e['tid'], e['args']['name']) for e in events
+                     if e['name'] == 'thread_name')
+        self.assertEqual([n for n, _ in spans],
+                         ['connect', 'check password_age', 'sleep 0.1',
+                          'sleep 0.1', 'true (batch of 2)'])
+        self.assertEqual([names[t] for _, t in spans[2:]],
+                         ['channel 1', 'channel 2', 'channel 1'])
+
+    def test_run_metrics(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                self.ssh.run('echo ab')
+                return self.expected_value
+
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '')
+        processor.process_hardener(PasswordAge, LocalShellMock('', ''))
+        metrics = Metrics()
+        add_run_metrics(metrics, processor)
+        lines = metrics.to_text().splitlines()
+        self.assertIn('node_hardening_topics{host="MS",status="checked"} 1.0',
+                      lines)
+        self.assertIn('node_hardening_ssh_commands{host="MS"} 1.0', lines)
+        self.assertIn('node_hardening_ssh_received_bytes{host="MS"} 2.0',
+                      lines)
+        self.assertTrue([l for l in lines if l.startswith(
+            'node_hardening_section_duration_seconds{host="MS",'
+            'section="LoginControl"}')])
+
+    def test_deferred_plan(self):
+        plans = []
+
+        class Coalescer(PlanCoalescer):
+            def run_plan(self, litp):
+                plans.append(self.deferred)
+                litp.run_plan()
+                return 'Successful'
+
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+            reads = writes = ('litp:model',)
+
+            def check(self):
+                return self.expected_value if plans else -1
+
+            def harden(self):
+                self.litp.apply_changes()
+                return "hardened"
+
+        class IdleTimeout(BaseHardening):
+            section = 'LoginControl'
+            topic = 'idle_timeout'
+            reads = ('litp:model',)
+            writes = ()
+
+            def check(self):
+                return -1 if plans else self.expected_value
+
+        client = SshScpClientMock('', '')
+        client.outputs = [(re.compile('^/usr/bin/litp run_plan$'), '')]
+        self.processor.plan_coalescer = Coalescer()
+        self.processor.process_hardener(PasswordAge, client)
+        self.processor.process_hardener(IdleTimeout, client)
+        section = self.processor.description.login_control
+        self.assertFalse(section.password_age.checked_and_hardened)
+        self.processor._apply_deferred_plan(client, [PasswordAge,
+                                                     IdleTimeout])
+        self.assertEqual(plans, [1])
+        self.assertTrue(section.password_age.checked_and_hardened)
+        self.assertIn('after the LITP plan', section.idle_timeout.error)
+        self.assertEqual([o[0] for o in section.password_age.harden_outputs],
+                         ['/usr/bin/litp run_plan'])
+        self.assertEqual(dict([(s, c) for s, c in
+                               self.processor.statuses.items() if c]),
+                         {'SUCCESS': 1, 'FAILED': 1})
+
+    def test_deferred_plan_rechecks_earlier_readers(self):
+        plans = []
+
+        class Coalescer(PlanCoalescer):
+            def run_plan(self, litp):
+                plans.append(self.deferred)
+                return 'Successful'
+
+        class IdleTimeout(BaseHardening):
+            section = 'LoginControl'
+            topic = 'idle_timeout'
+            reads = ('litp:model',)
+            writes = ()
+
+            def check(self):
+                return -1 if plans else self.expected_value
+
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+            reads = writes = ('litp:model',)
+
+            def check(self):
+                return self.expected_value if plans else -1
+
+            def harden(self):
+                self.litp.apply_changes()
+                return "hardened"
+
+        client = SshScpClientMock('', '')
+        self.processor.plan_coalescer = Coalescer()
+        self.processor.process_hardener(IdleTimeout, client)
+        self.processor.process_hardener(PasswordAge, client)
+        self.processor._apply_deferred_plan(client, [IdleTimeout,
+                                                     PasswordAge])
+        section = self.processor.description.login_control
+        self.assertTrue(section.password_age.checked_and_hardened)
+        self.assertIn('after the LITP plan', section.idle_timeout.error)
+
+    def test_isolated_state(self):
+        other = MsDescription('MS2')
+        topic = self.processor.description.os_installation.packages
+        topic.outputs.append(('rpm -qa', 0, ''))
+        topic.error = 'error'
+        other_topic = other.os_installation.packages
+        self.assertEqual((other_topic.outputs, other_topic.error), ([], ''))
+        self.assertEqual(other_topic.expected_value, topic.expected_value)
+        self.assertFalse(MsDescription.os_installation.packages.outputs)
+
+    def test_get_dependencies(self):
+        def hardener(reads, writes):
+            return type('Hardener', (BaseHardening,),
+                        {'reads': reads, 'writes': writes})
+        hardeners = [hardener(('file:/etc/issue',), ('file:/etc/issue',)),
+                     hardener(('file:/etc/pam.d/',), ()),
+                     hardener(('packages',), ('packages',)),
+                     hardener(('file:/etc/pam.d/system-auth',),
+                              ('file:/etc/pam.d/system-auth',)),
+                     hardener(None, ()),
+                     hardener((), None)]
+        depends = self.processor.get_dependencies(hardeners)
+        self.assertEqual(depends, {0: set(), 1: set(), 2: set(), 3: set([1]),
+                                   4: set([0, 2, 3]),
+                                   5: set([0, 1, 2, 3, 4])})
+
+    def test_package_removal_resources(self):
+        hardener = self.processor.get_hardener_topic
+        ftp = hardener('securingservice.ftp_installed')
+        for name in ('osconfiguration.running_services',
+                     'osconfiguration.services_ports',
+                     'osconfiguration.x_windows_used',
+                     'osinstallation.packages'):
+            self.assertTrue(ftp.conflicts_with(hardener(name)), name)
+        ntp = hardener('timesynchronisation.ntp_sync_enabled')
+        self.assertTrue(ntp.conflicts_with(
+            hardener('securingservice.ports_not_in_use')))
+        self.assertFalse(ftp.conflicts_with(
+            hardener('securingservice.max_logins')))
+
+    def test_hardener_registry(self):
+        hardener = self.processor.get_hardener_topic(
+            'logincontrol.password_age')
+        self.assertEqual((hardener.section, hardener.topic),
+                         ('LoginControl', 'password_age'))
+        self.assertRaises(KeyError, self.processor.get_hardener_topic,
+                          'nomodule.password_age')
+        self.assertRaises(KeyError, self.processor.get_hardener_topic,
+                          'logincontrol.notopic')
+        names = [name for name, _ in self.processor._get_hardener_topics()]
+        self.assertEqual(names, sorted(names, key=lambda n: n.split('.')[0]))
+        self.assertIn('logincontrol.password_age', names)
+
+    def test_hardener_registry_conflicts(self):
+        hardener = self.processor.get_hardener_topic(
+            'logincontrol.password_age')
+
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+        self.assertIs(self.processor.get_hardener_topic(
+            'logincontrol.password_age'), hardener)
+        with self.assertRaises(TypeError):
+            type('OtherPasswordAge', (BaseHardening,),
+                 {'section': 'LoginControl', 'topic': 'password_age',
+                  '__module__': hardener.__module__})
+
+    def test_hardener_import_error(self):
+        package = tempfile.mkdtemp()
+        self.addCleanup(getstatusoutput, 'rm -rf %s' % package)
+        with open(os.path.join(package, 'broken.py'), 'w') as module:
+            module.write('import some_missing_module\n')
+        litp = import_module('node_hardening.hardening.litp')
+        litp.__path__.append(package)
+        self.addCleanup(litp.__path__.remove, package)
+        self.assertRaises(ImportError, self.processor.get_hardener_topic,
+                          'broken.some_topic')
+
+
+class LocalShellMock(SshScpClientMock):
+    """ Runs the commands in the local shell, useful to test the scripts
+    generated by the SshRunner.
+    """
+
+    def run(self, cmd, timeout=None, su=None, expects=None):
+        t0 = time.time()
+        status, out = getstatusoutput(cmd)
+        if self.recorder is not None:
+            self.recorder.record(self.host, cmd, su, status >> 8, out, '', 0)
+        return CommandResult(status >> 8, out, '', time.time() - t0,
+                             started=t0)
+
+
+class TestSshRunner(TestCase):
+
+    def setUp(self):
+        self.outputs = []
+        self.runner = SshRunner(LocalShellMock('host', 'user'), self.outputs)
+
+    def test_run_many(self):
+        outs = self.runner.run_many(['echo a', 'echo "b\nc"', 'true'])
+        self.assertEqual(outs, ['a', 'b\nc', ''])
+        self.assertEqual(self.outputs, [('echo a', 0, 'a\n'),
+                                        ('echo "b\nc"', 0, 'b\nc\n'),
+                                        ('true', 0, '')])
+
+    def test_run_many_stops_at_failure(self):
+        cmds = ['echo a', 'echo b; sh -c "exit 3"', 'echo c']
+        with self.assertRaises(CommandExecutionException) as ctx:
+            self.runner.run_many(cmds)
+        self.assertEqual(ctx.exception.status_code, 3)
+        self.assertEqual([o[0] for o in self.outputs], cmds[:2])
+
+    def test_run_many_silent_fail(self):
+        outs = self.runner.run_many(['echo a; false', 'echo b'],
+                                    silent_fail_if=[1])
+        self.assertEqual(outs, ['a', 'b'])
+
+    def test_run_concurrently(self):
+        outs = self.runner.run_concurrently(['sleep 0.2; echo a', 'echo b'])
+        self.assertEqual(outs, ['a', 'b'])
+        self.assertEqual([o[0] for o in self.outputs],
+                         ['sleep 0.2; echo a', 'echo b'])
+
+    def test_command_timing(self):
+        self.runner.run('sleep 0.1; echo a')
+        self.runner.run_many(['echo b', 'echo cd'])
+        single, first, second = self.outputs
+        self.assertGreaterEqual(single.duration, 0.1)
+        self.assertEqual((single.nbytes, single.su, single.batch),
+                         (1, False, 1))
+        self.assertEqual((first.batch, first.nbytes, second.nbytes),
+                         (2, 2, 3))
+        self.assertEqual(first.duration, second.duration)
+        self.assertEqual(command_timing(self.outputs)[:1], (3,))
+
+    def test_run_cacheable(self):
+        self.runner.cache = CommandCache()
+        self.runner.run('echo $RANDOM', cacheable=True)
+        self.runner.run('echo $RANDOM', cacheable=True)
+        first, second = self.outputs
+        self.assertEqual(first, second)
+        self.assertEqual((first.cached, second.cached), (False, True))
+        self.runner.cache.clear()
+        self.runner.run('echo $RANDOM', cacheable=True)
+        self.assertFalse(self.outputs[-1].cached)
+
+    def test_host_facts(self):
+        facts = HostFacts(SshRunner(LocalShellMock('host', 'user'), []))
+        facts.commands = {'a': 'echo $RANDOM', 'b': 'echo b; false'}
+        facts.gather()
+        reader = facts.reader(self.runner)
+        first = reader.get('a')
+        self.assertEqual(reader.get('a'), first)
+        self.assertEqual(reader.get('b', silent_fail_if=[1]), 'b')
+        self.assertRaises(CommandExecutionException, reader.get, 'b')
+        self.assertTrue(all(o.cached for o in self.outputs))
+        facts.invalidate(['a'])
+        reader.get('a')
+        self.assertFalse(self.outputs[-1].cached)
+
+    def test_record_and_replay(self):
+        fd, session_file = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, session_file)
+        cmds = ['echo $RANDOM', 'echo b']
+        recorder = SessionRecorder(session_file)
+        recorded = SshRunner(LocalShellMock('host', 'user', recorder=recorder),
+                             [])
+        outs = [recorded.run('echo a')] + recorded.run_many(cmds)
+        replayed = SshRunner(ReplaySshClient('host', 'user',
+                                             session_file=session_file), [])
+        self.assertEqual([replayed.run('echo a')] + replayed.run_many(cmds),
+                         outs)
+        self.assertEqual(recorded.outputs, replayed.outputs)
+
+    def test_host_state(self):
+        state_dir = tempfile.mkdtemp()
+        fd, filename = tempfile.mkstemp(dir=state_dir)
+        os.write(fd, 'a')
+        os.close(fd)
+        self.addCleanup(getstatusoutput, 'rm -rf %s' % state_dir)
+        hardener = type('Hardener', (BaseHardening,),
+                        {'section': 'LoginControl', 'topic': 'password_age',
+                         'reads': ('file:%s' % filename,)})
+        topic = MsDescription('MS').login_control.password_age
+        state = HostState(state_dir, 'host')
+        state.gather(self.runner, [hardener])
+        self.assertEqual(state.is_unchanged(hardener, topic), None)
+        state.record(hardener, topic, True)
+        state.save()
+        state = HostState(state_dir, 'host')
+        state.gather(self.runner, [hardener])
+        self.assertNotEqual(state.is_unchanged(hardener, topic), None)
+        state.invalidate_resources(['file:%s' % filename])
+        self.assertEqual(state.is_unchanged(hardener, topic), None)
+        with open(filename, 'w') as changed:
+            changed.write('b')
+        state.gather(self.runner, [hardener])
+        self.assertEqual(state.is_unchanged(hardener, topic), None)
+
+
+class TestChannelExpect(TestCase):
+
+    def test_expect_partial_reads(self):
+        channel = FakeChannel(['su: Pass', 'word: ', 'out', 'put\n'])
+        expect = ChannelExpect(channel, spill_threshold=4)
+        self.assertEqual(expect.expect(PASSWORD_PROMPT), 'su: Password: ')
+        self.assertEqual(expect.read_until_eof(), 'output\n')
+        self.assertEqual(expect.read_until_eof(), '')
+
+    def test_expect_keeps_the_rest(self):
+        channel = FakeChannel(['a\nb', 'c'])
+        expect = ChannelExpect(channel)
+        self.assertEqual(expect.expect(LINE_END), 'a\n')
+        self.assertEqual(expect.read_until_eof(), 'bc')
+
+    def test_expect_eof(self):
+        expect = ChannelExpect(FakeChannel(['no prompt']))
+        self.assertEqual(expect.expect(PASSWORD_PROMPT), None)
+        self.assertEqual(expect.buffer.getvalue(), 'no prompt')
+
+    def test_expect_timeout(self):
+        expect = ChannelExpect(FakeChannel([None], eof=False), timeout=0.1)
+        t0 = time.time()
+        self.assertRaises(TimeoutException, expect.expect, PASSWORD_PROMPT)
+        self.assertLess(time.time() - t0, 5)
+
+    def test_read_until_eof_timeout(self):
+        expect = ChannelExpect(FakeChannel(['a', None]))
+        self.assertRaises(socket.timeout, expect.read_until_eof, 1)
+
+
+class FlakySshClient(SshClient):
+    """ An SshClient on fake transports, each connect() builds a new one. The
+    commands run the callables of self.commands instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FlakySshClient, self).__init__(*args, **kwargs)
+        self.commands = {}
+        self.connects = 0
+
+    def _connect(self):
+        if not self.is_connected():
+            self.connects += 1
+            self.transport = FakeTransport()
+
+    def _execute(self, cmd, timeout=None, su=None, expects=None):
+        transport = self.get_transport()
+        out = self.commands[cmd](self)
+        if not transport.is_active():
+            raise paramiko.SSHException("SSH session not active")
+        return CommandResult(0, out, '')
+
+
+class TestSshClientRetry(TestCase):
+
+    def setUp(self):
+        original = ssh_module.sleep
+        ssh_module.sleep = lambda seconds: None
+        self.addCleanup(setattr, ssh_module, 'sleep', original)
+        self.client = FlakySshClient('host', 'user')
+        self.client.connect()
+        self.first = self.client.transport
+
+    def _run_with_failing(self, fail):
+        """ Runs a failing command while other ones are running, the first
+        call of fail(client) fails its command.
+        """
+        failed = []
+        started = threading.Event()
+
+        def failing(client):
+            started.wait()
+            if not failed:
+                failed.append(True)
+                return fail(client)
+            return 'retried'
+
+        def running(client):
+            started.set()
+            time.sleep(0.2)
+            return 'alive' if client.transport.is_active() else 'dead'
+
+        self.client.commands = {'fail': failing, 'run': running}
+        return run_in_pool(lambda cmd: self.client.run(cmd)[1],
+                           ['run', 'fail', 'run'], 3)
+
+    def test_channel_lost(self):
+        def fail(client):
+            raise paramiko.SSHException("SSH session not active")
+        outs = self._run_with_failing(fail)
+        self.assertEqual(outs, ['alive', 'retried', 'alive'])
+        self.assertIs(self.client.transport, self.first)
+        self.assertEqual(self.client.connects, 1)
+
+    def test_connected_again_by_another_thread(self):
+        def fail(client):
+            client.transport.close()
+            client.connect()
+            raise paramiko.SSHException("SSH session not active")
+        outs = self._run_with_failing(fail)
+        self.assertEqual(outs[1], 'retried')
+        self.assertTrue(self.client.transport.is_active())
+        self.assertEqual(self.client.connects, 2)
+
+    def test_transport_lost(self):
+        def fail(client):
+            client.transport.close()
+            return ''
+        outs = self._run_with_failing(fail)
+        self.assertEqual(outs[1], 'retried')
+        self.assertIsNot(self.client.transport, self.first)
+        self.assertTrue(self.client.transport.is_active())
+        self.assertEqual(self.client.connects, 2)
+
+
+class TestRootShell(TestCase):
+
+    def _client(self, outputs):
+        """ Returns an SshClient with a single fake channel that answers the
+        ready marker and runs the commands of outputs, a dict of cmd:
+        (chunks, status).
+        """
+        def reply(data):
+            ready = re.search(r"__NH_READY_ (\w+)", data)
+            if ready:
+                return ['__NH_READY_%s\r\n' % ready.group(1)]
+            sent = re.search(r'echo (\S+) \| base64 -d.* __NH_END_ (\w+)',
+                             data)
+            if sent:
+                chunks, status = outputs[base64.b64decode(sent.group(1))]
+                end = '\r\n__NH_END_%s %s\r\n' % (sent.group(2), status)
+                # the sentinel is split across reads as well
+                return chunks + [end[:10], end[10:]]
+            return []
+
+        self.channel = FakeChannel(['Password: '], reply=reply)
+        client = SshClient('host', 'user', expect_timeout=0.05,
+                           persistent_su=True)
+        client.transport = FakeTransport([self.channel])
+        return client
+
+    def _shell(self, outputs):
+        return RootShell(self._client(outputs), 'pwd')
+
+    def test_shared_by_threads(self):
+        client = self._client(dict([('echo %s' % i, ([str(i)], 0))
+                                    for i in range(8)]))
+        results = run_in_pool(lambda i: client._shell_run('echo %s' % i,
+                                                          su='pwd'),
+                              range(8), 8)
+        self.assertEqual([out for _, out, _ in results],
+                         [str(i) for i in range(8)])
+        self.assertTrue(client._root_shell.is_open())
+
+    def test_run(self):
+        shell = self._shell({'ls': (['a\r\n', 'b'], 0), 'false': ([], 1)})
+        self.assertEqual(shell.run('ls'), (0, 'a\r\nb', ''))
+        self.assertEqual(shell.run('false'), (1, '', ''))
+        self.assertEqual(self.channel.sent[0], 'pwd\n')
+        self.assertTrue(shell.is_open())
+
+    def test_run_longer_than_the_expect_timeout(self):
+        shell = self._shell({'find /': ([None] * 10 + ['/bin/su'], 0)})
+        self.assertEqual(shell.run('find /'), (0, '/bin/su', ''))
+
+    def test_run_timeout(self):
+        shell = self._shell({'find /': ([None] * 100, 0)})
+        self.assertRaises(socket.timeout, shell.run, 'find /', 0.05)
+        self.assertFalse(shell.is_open())
+
+    def test_run_timeout_cut_by_the_deadline(self):
+        # the deadline is checked right before it expires
+        original = ssh_module.remaining_time
+        ssh_module.remaining_time = lambda timeout: 0.05
+        self.addCleanup(setattr, ssh_module, 'remaining_time', original)
+        client = self._client({'find /': ([None] * 100, 0)})
+        with Deadline(60, 'topic'):
+            self.assertRaises(DeadlineExceeded, client.run, 'find /', 10,
+                              su='pwd')
+        ssh_module.remaining_time = lambda timeout: timeout
+        client = self._client({'find /': ([None] * 100, 0)})
+        with Deadline(60, 'topic'):
+            self.assertRaises(TimeoutException, client.run, 'find /', 0.05,
+                              su='pwd')
+
+
+class FakeBastion(FakeTransport):
+    """ A bastion transport that raises the errors given to open_channel,
+    one for each call, and dies with the ones of the dead hosts.
+    """
+
+    def __init__(self, *errors):
+        super(FakeBastion, self).__init__()
+        self.errors = list(errors)
+
+    def open_channel(self, kind, dest_addr, src_addr):
+        error = self.errors.pop(0) if self.errors else None
+        if isinstance(error, EOFError):
+            self.active = False
+        if error is not None:
+            raise error
+        return FakeChannel()
+
+
+class TestTunnelManager(TestCase):
+
+    def setUp(self):
+        self.tunnels = TunnelManager()
+        self.bastion = FakeBastion()
+        self.tunnels.adopt('ms', 22, 'user', self.bastion)
+
+    def _open_tunnel(self, host='node1'):
+        return self.tunnels.open_tunnel('ms', 22, 'user', '', host, 22)
+
+    def test_open_tunnel(self):
+        self.assertIsInstance(self._open_tunnel(), FakeChannel)
+        self.assertIsInstance(self._open_tunnel(), FakeChannel)
+        self.assertEqual(self.tunnels.bastions(), [('ms', 22, 'user')])
+
+    def test_channel_refused(self):
+        self.bastion.errors = [paramiko.ChannelException(2, 'refused')]
+        self.assertRaises(paramiko.ChannelException, self._open_tunnel)
+        self.assertTrue(self.bastion.is_active())
+        self.assertIsInstance(self._open_tunnel('node2'), FakeChannel)
+
+    def test_error_on_an_active_bastion(self):
+        self.bastion.errors = [paramiko.SSHException('some error')]
+        self.assertRaises(paramiko.SSHException, self._open_tunnel)
+        self.assertTrue(self.bastion.is_active())
+
+    def test_dead_bastion(self):
+        new_bastion = FakeBastion()
+        self.tunnels.get_bastion = lambda *args: (
+            self.bastion if self.bastion.is_active() else new_bastion)
+        self.bastion.errors = [EOFError()]
+        self.assertIsInstance(self._open_tunnel(), FakeChannel)
+        self.assertFalse(self.bastion.is_active())
+
+
+class FakeSftp(object):
+
+    def __init__(self, transport):
+        self.channel = type('Channel', (object,),
+                            {'get_transport': lambda _: transport})()
+        self.closed = False
+
+    def get_channel(self):
+        return self.channel
+
+    def close(self):
+        self.closed = True
+
+
+class TestSshScpClient(TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+        def from_transport(transport):
+            self.opened.append(FakeSftp(transport))
+            return self.opened[-1]
+
+        original = paramiko.SFTPClient.from_transport
+        paramiko.SFTPClient.from_transport = staticmethod(from_transport)
+        self.addCleanup(setattr, paramiko.SFTPClient, 'from_transport',
+                        original)
+
+    def test_sftp_shares_the_transport(self):
+        client = SshScpClient('host', 'user')
+        client.transport = FakeTransport()
+        sftp = client.sftp
+        self.assertIs(client.sftp, sftp)
+        self.assertIs(sftp.get_channel().get_transport(), client.transport)
+        self.assertEqual(len(self.opened), 1)
+        # the transport was connected again in the meantime
+        client.transport = FakeTransport()
+        self.assertIsNot(client.sftp, sftp)
+        self.assertEqual(len(self.opened), 2)
+        client.close()
+        self.assertTrue(self.opened[-1].closed)
+        self.assertFalse(client.transport)
+
+
+class TestRunProfiler(TestCase):
+
+    def test_profile(self):
+        class PasswordAge(BaseHardening):
+            section = 'LoginControl'
+            topic = 'password_age'
+
+            def check(self):
+                return self.expected_value
+
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(getstatusoutput, 'rm -rf %s' % profile_dir)
+        profiler = RunProfiler(profile_dir, memory=True)
+        processor = HardeningProcessor('litp', MsDescription('MS'), '', '', '',
+                                       profiler=profiler)
+        processor.run_hardener(PasswordAge, SshScpClientMock('', ''))
+        topic = processor.description.login_control.password_age
+        self.assertFalse(topic.error or topic.unhandled_error)
+        profiler.profile('report', lambda: ' ' * 50 * 1024 * 1024)
+        self.assertEqual(profiler.merge(),
+                         os.path.join(profile_dir, 'run.pstats'))
+        self.assertEqual(sorted(os.listdir(profile_dir)),
+                         ['LoginControl.password_age.pstats', 'memory.txt',
+                          'report.pstats', 'run.pstats'])
+        with open(os.path.join(profile_dir, 'memory.txt')) as memory_file:
+            lines = memory_file.read().splitlines()
+        self.assertEqual([l.split()[-1] for l in lines[1:]],
+                         ['report', 'LoginControl.password_age'])
+
+
+class TestFleet(TestCase):
+
+    def _inventory(self, content):
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, content)
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    def test_load_inventory(self):
+        filename = self._inventory("[credentials:litp]\n"
+                                   "user = litp-admin\n"
+                                   "password = p%ss\n"
+                                   "[host:ms1]\n"
+                                   "address = 10.0.0.1\n"
+                                   "description = litp.ms\n"
+                                   "credentials = litp\n"
+                                   "[host:node1]\n"
+                                   "description = litp.node\n"
+                                   "credentials = litp\n"
+                                   "via_host = ms1\n")
+        ms, node = load_inventory(filename)
+        self.assertEqual((ms['host'], ms['via_host'], ms['password']),
+                         ('10.0.0.1', None, 'p%ss'))
+        self.assertEqual((node['host'], node['via_host'], node['via_user']),
+                         ('node1', '10.0.0.1', 'litp-admin'))
+
+    def test_load_inventory_missing_credentials(self):
+        filename = self._inventory("[host:ms1]\n"
+                                   "description = litp.ms\n"
+                                   "credentials = litp\n")
+        self.assertRaises(InvalidInventory, load_inventory, filename)
+
+
+class TestCluster(TestCase):
+
+    def _litp_show(self, path, children=(), **properties):
+        out = "%s\n    type: some-type\n    state: Applied\n" % path
+        if properties:
+            out += "    properties:\n"
+            out += ''.join(["        %s: %s\n" % p for p in properties.items()])
+        if children:
+            out += "    children:\n"
+            out += ''.join(["        /%s\n" % c for c in children])
+        cmd = re.compile(r'^/usr/bin/litp show -p %s$' % path)
+        return cmd, out
+
+    def test_discover_nodes(self):
+        ms_client = SshScpClientMock('ms', 'user')
+        clusters = '/deployments/d1/clusters'
+        ms_client.outputs = [
+            self._litp_show('/deployments', ['d1']),
+            self._litp_show(clusters, ['c1', 'c2']),
+            self._litp_show(clusters + '/c1/nodes', ['n1', 'n2']),
+            self._litp_show(clusters + '/c2/nodes', ['n3']),
+            self._litp_show(clusters + '/c1/nodes/n1', hostname='node1'),
+            self._litp_show(clusters + '/c1/nodes/n2', hostname='node2'),
+            self._litp_show(clusters + '/c2/nodes/n3', hostname='node3')]
+        self.assertEqual(discover_nodes(ms_client),
+                         ['node1', 'node2', 'node3'])
@@ -0,0 +1,69 @@
+""" Writes the metrics of a scan in the Prometheus text format, for the
+textfile collector of the node exporter.
+
+The Metrics class is the same as the one of node_hardening.metrics, it's
+kept here since vascan is shipped on its own and can't import the
+node_hardening package.
+"""
+import os
+import tempfile
+
+
+class Metrics(object):
+    """ Collects the samples of the metrics of a scan and writes them in the
+    Prometheus text format, for the textfile collector of the node exporter.
+    """
+
+    def __init__(self, prefix='vascan'):
+        self.prefix = prefix
+        self._metrics = []
+        self._samples = {}
+
+    def add(self, name, desc, value, metric_type='gauge', **labels):
+        name = "%s_%s" % (self.prefix, name)
+        if name not in self._samples:
+            self._metrics.append((name, desc, metric_type))
+            self._samples[name] = []
+        self._samples[name].append((labels, value))
+
+    def add_api_calls(self, request):
+        """ Adds the number of calls and the seconds spent by each Nessus API
+        path and response status, and the retries of the requests.
+        :param request: NessusRequest instance
+        """
+        for (method, path, status), (count, seconds) in \
+                sorted(request.calls.items()):
+            self.add('nessus_api_calls_total', 'Number of Nessus API calls.',
+                     count, 'counter', method=method, path=path,
+                     status=status)
+            self.add('nessus_api_call_seconds_total', 'Seconds spent in the '
+                     'Nessus API calls.', seconds, 'counter', method=method,
+                     path=path, status=status)
+        self.add('nessus_api_retries_total', 'Number of Nessus API requests '
+                 'retried.', request.retries, 'counter')
+
+    def to_text(self):
+        escape = lambda v: str(v).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        lines = []
+        for name, desc, metric_type in self._metrics:
+            lines.append("# HELP %s %s" % (name, desc))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for labels, value in self._samples[name]:
+                labels = ','.join(['%s="%s"' % (k, escape(v))
+                                   for k, v in sorted(labels.items())])
+                lines.append("%s{%s} %r" % (name, labels, float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """ Writes the metrics in a temporary file renamed to the filename,
+        so the collector never reads it half written.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            os.write(fd, self.to_text())
+        finally:
+            os.close(fd)
+        os.chmod(tmp_filename, 0644)
+        os.rename(tmp_filename, filename)
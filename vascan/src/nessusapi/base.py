@@ -1,4 +1,5 @@
 
+import re
 import time
 import simplejson
 from urllib2 import HTTPError
@@ -14,11 +15,17 @@ class NessusRequest(object):
 
     request_attempts = 5
     seconds_between_attempts = 5
+    id_regex = re.compile(r'/\d+')
 
     def __init__(self, uri, access_key, secret_key):
         self.access_key = access_key
         self.secret_key = secret_key
         self.uri = uri
+        # the number of calls and the seconds spent by (method, path,
+        # status), the ids in the path are replaced by "{id}" and the status
+        # is "error" for the requests raising an exception.
+        self.calls = {}
+        self.retries = 0
 
     def _request(self, path, method, **data):
         """
@@ -39,17 +46,27 @@ class NessusRequest(object):
                 print("HTTPError occurred while trying to request the url "
                       "%s. %s. Trying again in %s seconds..." % (url, err,
                                                 self.seconds_between_attempts))
+                self.retries += 1
                 time.sleep(self.seconds_between_attempts)
                 return open_request(attempts)
             except requests.exceptions.ChunkedEncodingError as err:
                 print("ChunkedEncodingError occurred while trying to request "
                       "the url %s. %s. Trying again in %s seconds..." % (url,
                                            err, self.seconds_between_attempts))
+                self.retries += 1
                 time.sleep(self.seconds_between_attempts)
                 return open_request(attempts)
 
         attempts = 0
-        response = open_request(attempts)
+        status = 'error'
+        t0 = time.time()
+        try:
+            response = open_request(attempts)
+            status = str(response.status_code)
+        finally:
+            key = (method, self.id_regex.sub('/{id}', path), status)
+            count, seconds = self.calls.get(key, (0, 0.0))
+            self.calls[key] = (count + 1, seconds + time.time() - t0)
         # We should rise exception if the status code is not 'OK'
         if response.status_code != 200:
             raise NessusApiError(response.status_code, response.reason)
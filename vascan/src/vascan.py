@@ -1,4 +1,5 @@
 from nessusapi import NessusApi, NessusApiError
+from metrics import Metrics
 import sys
 import os
 import yaml
@@ -36,6 +37,9 @@ def process_args():
     parser.add_argument('--format', '-f', default='pdf',
                         choices=["nessus", "csv", "html", "pdf"],
                         help='The Scan report format')
+    parser.add_argument('--metrics', '-m', dest='metrics_filename',
+                        help='Writes the metrics of the scan in this file in '
+                             'the Prometheus text format')
     return parser.parse_args()
 
 
@@ -81,18 +85,42 @@ if __name__ == "__main__":
     args = process_args()
     url, access_key, secret_key = get_args_from_setting_file(args)
     api = NessusApi(url, access_key, secret_key)
-    policy_id = get_policy_id(api, args.policy)
-
-    s_name = '{0} scan for {1} at {2}'.format(
-        args.policy, args.target, time.strftime("%d/%m/%Y %H:%M")
-    )
-    scan = api.scans.create(name=s_name, policy_id=policy_id, targets=args.target)
-    scan_id = scan['scan']['id']
-    print "\nCreating scan using policy: {0} for target: {1}" \
-          "\nScanning...".format(args.policy, args.target)
-    api.scans.launch_and_wait(scan_id)
-    print "Scan report exported to file: {0}".format(args.report_filename)
-    file_content = api.scans.export_and_download(scan_id,
-                                                 export_format=args.format)
-    with open(args.report_filename, 'wb') as fd:
-        fd.write(file_content)
+    metrics = Metrics()
+    labels = dict(policy=args.policy, target=args.target)
+    success = False
+    t0 = time.time()
+    try:
+        policy_id = get_policy_id(api, args.policy)
+
+        s_name = '{0} scan for {1} at {2}'.format(
+            args.policy, args.target, time.strftime("%d/%m/%Y %H:%M")
+        )
+        scan = api.scans.create(name=s_name, policy_id=policy_id,
+                                targets=args.target)
+        scan_id = scan['scan']['id']
+        print "\nCreating scan using policy: {0} for target: {1}" \
+              "\nScanning...".format(args.policy, args.target)
+        t_scan = time.time()
+        api.scans.launch_and_wait(scan_id)
+        metrics.add('scan_duration_seconds', 'Duration of the scan.',
+                    time.time() - t_scan, **labels)
+        print "Scan report exported to file: {0}".format(args.report_filename)
+        t_export = time.time()
+        file_content = api.scans.export_and_download(scan_id,
+                                                     export_format=args.format)
+        metrics.add('export_duration_seconds', 'Duration of the export and '
+                    'download of the report.', time.time() - t_export,
+                    format=args.format, **labels)
+        with open(args.report_filename, 'wb') as fd:
+            fd.write(file_content)
+        success = True
+    finally:
+        if args.metrics_filename:
+            metrics.add('run_duration_seconds', 'Duration of the run.',
+                        time.time() - t0, **labels)
+            metrics.add('run_success', 'Whether the run succeeded.',
+                        int(success), **labels)
+            metrics.add('last_run_timestamp_seconds', 'Time the run '
+                        'finished.', time.time(), **labels)
+            metrics.add_api_calls(api.request)
+            metrics.write(args.metrics_filename)